@@ -15,7 +15,8 @@ from database import (
     get_all_users, create_user, set_user_block_status,
     reset_user_password, delete_user, extend_subscription # <-- Añadido extend_subscription
 )
-from auth import set_password # Para hashear la nueva contraseña
+from signals import signal_inputs, signal_output, signal_state
+from auth import set_password, invalidate_user # Para hashear la nueva contraseña
 
 def get_layout():
     """Devuelve el layout del panel de administración."""
@@ -191,9 +192,9 @@ def register_callbacks(app):
         Output('admin-users-table', 'data'),
         Output('admin-create-alert', 'children'),
         Output('admin-action-alert', 'children'),
-        Input('store-data-signal', 'data'),
+        *signal_inputs('admin'),
     )
-    def refresh_admin_table(signal):
+    def refresh_admin_table(*signals):
         """Recarga la tabla de usuarios."""
         if not current_user.is_authenticated or not current_user.is_admin:
             return [], None, None
@@ -250,7 +251,7 @@ def register_callbacks(app):
     # --- CORREGIDO: Añadido state para fecha de suscripción ---
 # --- CORREGIDO: Añadido state para switch 'no_expiry' ---
     @app.callback(
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('users'),
         Output('admin-create-alert', 'children', allow_duplicate=True),
         Output('admin-new-username', 'value'),
         Output('admin-new-password', 'value'),
@@ -260,7 +261,7 @@ def register_callbacks(app):
          State('admin-is-admin-switch', 'value'),
          State('admin-subscription-date-picker', 'date'),
          State('admin-no-expiry-switch', 'value'),
-         State('store-data-signal', 'data')],
+         signal_state('users')],
         prevent_initial_call=True
     )
     def handle_create_user(n, username, password, is_admin, sub_date, no_expiry, signal):
@@ -306,7 +307,7 @@ def register_callbacks(app):
         Output('admin-reset-modal', 'is_open'),
         Output('admin-delete-modal', 'is_open'),
         Output('admin-extend-modal', 'is_open'), # <-- NUEVO OUTPUT
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('users'),
         Output('admin-action-alert', 'children', allow_duplicate=True),
         Output('admin-user-id-store', 'data'),
         Output('admin-username-store', 'data'),
@@ -317,7 +318,7 @@ def register_callbacks(app):
         Output('admin-extend-date-picker', 'date'), # <-- NUEVO OUTPUT (reset date)
         Input('admin-users-table', 'active_cell'),
         State('admin-users-table', 'derived_virtual_data'),
-        State('store-data-signal', 'data'),
+        signal_state('users'),
         prevent_initial_call=True
     )
     def open_admin_modals(active_cell, data, signal):
@@ -343,6 +344,7 @@ def register_callbacks(app):
         if col_id == 'action-block':
             new_status = not user_info['is_blocked']
             set_user_block_status(user_id, new_status)
+            invalidate_user(user_id)
             status_text = "bloqueado" if new_status else "desbloqueado"
             alert = dbc.Alert(f"Usuario '{username}' ha sido {status_text}.", color="info")
             # Indices: (reset, delete, extend, signal, alert, user_id, username, reset_txt, delete_txt, extend_txt, confirm_input, extend_date)
@@ -381,13 +383,13 @@ def register_callbacks(app):
     # --- CALLBACK CORREGIDO: Resetear Contraseña (Admin ingresa pass) ---
     @app.callback(
         Output('admin-reset-modal', 'is_open', allow_duplicate=True),
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('users'),
         Output('admin-action-alert', 'children', allow_duplicate=True),
         Output('admin-new-temp-password', 'value'), # <-- Limpiar campo
         Input('admin-confirm-reset-button', 'n_clicks'),
         [State('admin-user-id-store', 'data'),
          State('admin-new-temp-password', 'value'), # <-- Leer input
-         State('store-data-signal', 'data')],
+         signal_state('users')],
         prevent_initial_call=True
     )
     def handle_reset_password(n, user_id, temp_password, signal):
@@ -401,6 +403,7 @@ def register_callbacks(app):
 
         hashed_password = set_password(temp_password)
         reset_user_password(user_id, hashed_password)
+        invalidate_user(user_id)
 
         alert = dbc.Alert(f"¡Contraseña reseteada exitosamente!", color="success")
         # Cerrar modal, enviar señal, mostrar éxito, limpiar campo
@@ -409,7 +412,7 @@ def register_callbacks(app):
     # --- CALLBACK CORREGIDO: Eliminar Usuario (con confirmación de texto) ---
     @app.callback(
         Output('admin-delete-modal', 'is_open', allow_duplicate=True),
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('users'),
         Output('admin-action-alert', 'children', allow_duplicate=True),
         Output('admin-delete-modal-alert', 'children'), # Alerta interna
         Output('admin-delete-confirm-input', 'value'), # Limpiar campo
@@ -417,7 +420,7 @@ def register_callbacks(app):
         [State('admin-user-id-store', 'data'),
          State('admin-username-store', 'data'), # <-- Nuevo State
          State('admin-delete-confirm-input', 'value'), # <-- Nuevo State
-         State('store-data-signal', 'data')],
+         signal_state('users')],
         prevent_initial_call=True
     )
     def handle_delete_user(n, user_id, username, confirm_input, signal):
@@ -436,6 +439,7 @@ def register_callbacks(app):
         # Si la confirmación es correcta, proceder con la eliminación
         try:
             delete_user(user_id)
+            invalidate_user(user_id)
             alert_main = dbc.Alert(f"Usuario '{username}' (ID: {user_id}) eliminado permanentemente.", color="danger")
             # Cerrar modal, enviar señal, alerta afuera, limpiar alerta adentro, limpiar campo
             return False, (signal or 0) + 1, alert_main, None, ""
@@ -450,13 +454,13 @@ def register_callbacks(app):
 # --- NUEVO CALLBACK: Guardar extensión de suscripción ---
     @app.callback(
         Output('admin-extend-modal', 'is_open', allow_duplicate=True),
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('users'),
         Output('admin-action-alert', 'children', allow_duplicate=True),
         Input('admin-confirm-extend-button', 'n_clicks'),
         [State('admin-user-id-store', 'data'),
          State('admin-extend-date-picker', 'date'),
          State('admin-extend-no-expiry-switch', 'value'), # <-- NUEVO STATE
-         State('store-data-signal', 'data')],
+         signal_state('users')],
          prevent_initial_call=True
     )
     def handle_extend_subscription(n, user_id, new_date, no_expiry, signal): # <-- Nuevo param
@@ -477,6 +481,7 @@ def register_callbacks(app):
         try:
             # --- CORREGIDO: Pasar final_new_date ---
             extend_subscription(user_id, final_new_date)
+            invalidate_user(user_id)
 
             # Ajustar mensaje de éxito
             if final_new_date:
@@ -0,0 +1,109 @@
+# api.py
+# Rutas Flask (fuera de los callbacks de Dash) registradas en app.server.
+# /api/import/<tipo>: recibe el archivo como multipart (el navegador lo envía con fetch),
+# lo guarda en un archivo temporal y encola la importación en segundo plano (ver jobs.py),
+# sin base64 ni el archivo completo en memoria del worker.
+# /api/pos/sales: lotes de ventas JSON de terminales POS, autenticados con token Bearer
+# (ver create_api_token) e idempotentes por línea.
+import os
+import tempfile
+
+from flask import Blueprint, jsonify, request
+from flask_login import current_user
+
+from database import (get_import_job, request_import_job_cancel,
+                      get_api_token_user, record_pos_sales, POS_MAX_LINES)
+from jobs import submit_import_job, IMPORT_RUNNERS
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+
+def _result(success, message, level=None, errors=None, status=200, **extra):
+    """Respuesta JSON que el callback de Dash convierte en un dbc.Alert."""
+    level = level or ("success" if success else "danger")
+    return jsonify(success=success, message=message, level=level, errors=errors or [], **extra), status
+
+
+def _unauthorized():
+    return _result(False, "Sesión expirada. Vuelve a iniciar sesión.", status=401)
+
+
+@api.route('/import/<kind>', methods=['POST'])
+def import_file(kind):
+    if not current_user.is_authenticated:
+        return _unauthorized()
+    if kind not in IMPORT_RUNNERS:
+        return _result(False, "Tipo de importación desconocido.", status=404)
+
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return _result(False, "No se recibió ningún archivo.", status=400)
+    suffix = os.path.splitext(upload.filename)[1].lower()
+    if suffix not in ('.xlsx', '.xlsm', '.csv'):
+        return _result(False, "Formato incorrecto. Usa .xlsx o .csv", status=400)
+
+    # Werkzeug ya vuelca a disco los archivos grandes; save() copia por bloques
+    fd, path = tempfile.mkstemp(prefix='emprend_import_', suffix=suffix)
+    os.close(fd)
+    try:
+        upload.save(path)
+        options = {'update_stock': request.form.get('update_stock') == 'true'}
+        job_id = submit_import_job(kind, path, upload.filename, int(current_user.id), options,
+                                   idempotency_key=request.form.get('idempotency_key') or None)
+    except Exception as e:
+        os.remove(path)
+        return _result(False, f"Error recibiendo el archivo: {e}", status=500)
+    return _result(True, "Importación en curso...", level="info", job_id=job_id, status=202)
+
+
+@api.route('/import/jobs/<int:job_id>', methods=['GET'])
+def import_job_status(job_id):
+    if not current_user.is_authenticated:
+        return _unauthorized()
+    job = get_import_job(job_id, int(current_user.id))
+    if job is None:
+        return _result(False, "Importación no encontrada.", status=404)
+    return jsonify(job)
+
+
+@api.route('/import/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_import_job(job_id):
+    if not current_user.is_authenticated:
+        return _unauthorized()
+    if request_import_job_cancel(job_id, int(current_user.id)):
+        return _result(True, "Cancelando importación...", level="warning")
+    return _result(False, "La importación ya terminó o no existe.", level="warning", status=409)
+
+
+def _bearer_user_id():
+    """user_id del token 'Authorization: Bearer <token>', o None."""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer':
+        return None
+    return get_api_token_user(token.strip())
+
+
+@api.route('/pos/sales', methods=['POST'])
+def pos_sales():
+    """
+    Recibe {"sales": [{"idempotency_key", "product_id", "quantity", "sale_date"?}, ...]}.
+    Responde un resultado por línea; reenviar el mismo lote no duplica ventas.
+    """
+    user_id = _bearer_user_id()
+    if user_id is None:
+        return _result(False, "Token de API inválido o ausente.", status=401)
+    payload = request.get_json(silent=True)
+    lines = payload.get('sales') if isinstance(payload, dict) else None
+    if not isinstance(lines, list) or not lines:
+        return _result(False, 'Se esperaba un JSON {"sales": [...]} con al menos una línea.', status=400)
+    if len(lines) > POS_MAX_LINES:
+        return _result(False, f"Máximo {POS_MAX_LINES} líneas por lote.", status=413)
+
+    try:
+        results = record_pos_sales(lines, user_id)
+    except Exception as e:
+        return _result(False, f"Error registrando las ventas: {e}", status=500)
+    counts = {status: sum(1 for r in results if r['status'] == status) for status in ('created', 'duplicate', 'rejected')}
+    message = f"{counts['created']} ventas registradas, {counts['duplicate']} duplicadas, {counts['rejected']} rechazadas."
+    level = "success" if not counts['rejected'] else "warning"
+    return _result(True, message, level=level, results=results, **counts)
@@ -0,0 +1,20 @@
+// Claves de idempotencia generadas en el navegador para los formularios de registro.
+// La clave se renueva cuando cambia la señal del dominio (después de cada escritura
+// exitosa): un doble clic o un reintento reenvían la misma clave y el servidor ignora
+// el duplicado con INSERT ... ON CONFLICT DO NOTHING.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    idempotency: {
+        fresh: function () {
+            return newIdempotencyKey();
+        }
+    }
+});
+
+function newIdempotencyKey() {
+    if (window.crypto && window.crypto.randomUUID) {
+        return window.crypto.randomUUID();
+    }
+    // randomUUID solo existe en contextos seguros (https o localhost)
+    var bytes = window.crypto.getRandomValues(new Uint8Array(16));
+    return Array.prototype.map.call(bytes, function (b) { return ('0' + b.toString(16)).slice(-2); }).join('');
+}
@@ -0,0 +1,26 @@
+// Carrito de ventas: agrega líneas a la tabla 'sale-cart-table' sin ir al servidor.
+// Si el producto ya está en el carrito se suma la cantidad a su línea.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    cart: {
+        add: function (nClicks, productId, quantity, options, rows) {
+            var qty = parseInt(quantity, 10);
+            if (!nClicks || productId === null || productId === undefined || !(qty > 0)) {
+                return window.dash_clientside.no_update;
+            }
+            var option = (options || []).find(function (o) { return o.value === productId; });
+            // La etiqueta del dropdown incluye el stock del momento; en el carrito no se muestra
+            var label = option ? String(option.label).replace(/ \(Stock: [^)]*\)$/, '') : String(productId);
+
+            var found = false;
+            var next = (rows || []).map(function (row) {
+                if (row.product_id !== productId) { return row; }
+                found = true;
+                return Object.assign({}, row, {quantity: row.quantity + qty});
+            });
+            if (!found) {
+                next.push({product_id: productId, label: label, quantity: qty});
+            }
+            return next;
+        }
+    }
+});
@@ -0,0 +1,37 @@
+// Envía los archivos de importación a /api/import/<tipo> con fetch (multipart).
+// El contenido base64 de dcc.Upload se convierte a Blob en el navegador, así el
+// servidor nunca recibe el archivo dentro del payload de un callback de Dash.
+// Cada subida lleva una clave de idempotencia: si la red falla se reintenta una vez con
+// la misma clave y el servidor devuelve el trabajo ya creado en lugar de importar dos veces.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    uploads: {
+        sales: function (contents, filename, updateStock) {
+            return postUpload('/api/import/sales', contents, filename, {update_stock: updateStock ? 'true' : 'false'});
+        },
+        expenses: function (contents, filename) {
+            return postUpload('/api/import/expenses', contents, filename, {});
+        }
+    }
+});
+
+function postUpload(url, contents, filename, fields) {
+    if (!contents) {
+        return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+    }
+    return fetch(contents)
+        .then(function (response) { return response.blob(); })
+        .then(function (blob) {
+            var form = new FormData();
+            form.append('file', blob, filename);
+            form.append('idempotency_key', newIdempotencyKey());
+            Object.keys(fields).forEach(function (key) { form.append(key, fields[key]); });
+            var send = function () { return fetch(url, {method: 'POST', body: form, credentials: 'same-origin'}); };
+            return send().catch(send);
+        })
+        .then(function (response) { return response.json(); })
+        .catch(function (error) {
+            return {success: false, level: 'danger', message: 'Error subiendo el archivo: ' + error, errors: []};
+        })
+        // Limpia contents: libera el base64 del navegador y permite volver a subir el mismo archivo
+        .then(function (result) { return [result, null]; });
+}
@@ -1,75 +1,144 @@
-from flask_login import UserMixin, LoginManager
+from flask import session, has_request_context
+from flask_login import LoginManager
 from werkzeug.security import generate_password_hash, check_password_hash
 from database import engine
-import pandas as pd
+from cache import LRUCache
 from sqlalchemy import text
-from datetime import date # <-- Añadido
+from datetime import date, datetime # <-- Añadido
+import os
+import time
 
 login_manager = LoginManager()
 
-class User(UserMixin):
+# --- USUARIO AUTENTICADO EN CACHÉ ---
+# En Dash cada callback es un request HTTP y Flask-Login llama a user_loader en todos.
+# Orden de búsqueda: caché del proceso -> copia firmada en la cookie de sesión -> base de datos.
+# Las acciones de admin/login invalidan la caché del proceso; en los demás workers
+# (y en la sesión del propio usuario afectado) el cambio se ve al vencer el TTL.
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
+_user_cache = LRUCache(max_entries=1024, ttl=USER_CACHE_TTL_SECONDS) # user_id -> User (o None)
+_SESSION_KEY = '_user_snapshot'
+
+class User:
+    """Registro liviano del usuario (compatible con Flask-Login, sin UserMixin)."""
+    __slots__ = ('id', 'username', 'password', 'must_change_password', 'is_blocked',
+                 'first_login', 'is_admin', 'subscription_end_date')
+
+    # Lo que Flask-Login espera de un usuario autenticado
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
     # --- CORREGIDO: Añadido subscription_end_date ---
     def __init__(self, id, username, password, must_change_password, is_blocked, first_login, is_admin, subscription_end_date):
         self.id = id
         self.username = username
-        self.password = password
+        self.password = password # Solo lo trae find() (login); get() no carga el hash
         self.must_change_password = must_change_password
         self.is_blocked = is_blocked
         self.first_login = first_login
         self.is_admin = is_admin
         self.subscription_end_date = subscription_end_date # <-- Añadido
 
+    def get_id(self):
+        return str(self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, User) and self.get_id() == other.get_id()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = object.__hash__
+
+    def snapshot(self):
+        """Copia para la cookie de sesión (sin la contraseña)."""
+        return {
+            'id': int(self.id), 'username': self.username,
+            'must_change_password': bool(self.must_change_password), 'is_blocked': bool(self.is_blocked),
+            'first_login': self.first_login.isoformat() if self.first_login else None,
+            'is_admin': bool(self.is_admin),
+            'subscription_end_date': self.subscription_end_date.isoformat() if self.subscription_end_date else None,
+            'loaded_at': time.time(),
+        }
+
+    @staticmethod
+    def from_snapshot(data):
+        return User(
+            id=data['id'], username=data['username'], password=None,
+            must_change_password=data['must_change_password'], is_blocked=data['is_blocked'],
+            first_login=datetime.fromisoformat(data['first_login']) if data['first_login'] else None,
+            is_admin=data['is_admin'],
+            subscription_end_date=date.fromisoformat(data['subscription_end_date']) if data['subscription_end_date'] else None,
+        )
+
+    @staticmethod
+    def _fetch(where, value, with_password):
+        """Una fila de users (fetch directo, sin DataFrame) como User, o None."""
+        password = "password" if with_password else "NULL AS password"
+        query = text(f"""
+            SELECT id, username, {password}, must_change_password, is_blocked, first_login, is_admin, subscription_end_date
+            FROM users WHERE {where} = :value
+        """)
+        with engine.connect() as connection:
+            row = connection.execute(query, {"value": value}).fetchone()
+        if row is None: return None
+        sub_end = row.subscription_end_date
+        if sub_end is not None and not isinstance(sub_end, date): sub_end = date.fromisoformat(str(sub_end)[:10])
+        return User(
+            id=row.id, username=row.username, password=row.password,
+            must_change_password=row.must_change_password, is_blocked=row.is_blocked,
+            first_login=row.first_login, is_admin=row.is_admin, subscription_end_date=sub_end,
+        )
+
     @staticmethod
     def get(user_id):
-        # --- CORREGIDO: Obtener y pasar subscription_end_date ---
-        query = text("SELECT * FROM users WHERE id = :user_id")
-        try:
-            user_df = pd.read_sql(query, engine, params={"user_id": int(user_id)})
-            if not user_df.empty:
-                user_data = user_df.iloc[0]
-                # Convertir a objeto date si no es None
-                sub_end = pd.to_datetime(user_data['subscription_end_date']).date() if pd.notna(user_data['subscription_end_date']) else None
-                return User(
-                    id=user_data['id'],
-                    username=user_data['username'],
-                    password=user_data['password'],
-                    must_change_password=user_data['must_change_password'],
-                    is_blocked=user_data['is_blocked'],
-                    first_login=user_data['first_login'],
-                    is_admin=user_data['is_admin'],
-                    subscription_end_date=sub_end # <-- Añadido
-                )
-        except Exception as e:
-            print(f"Error getting user: {e}")
-        return None
+        user_id = int(user_id)
+        hit, user = _user_cache.get(user_id)
+        if hit: return user
+        user = _session_user(user_id)
+        if user is None:
+            try:
+                user = User._fetch("id", user_id, with_password=False)
+            except Exception as e:
+                print(f"Error getting user: {e}")
+                return None # Sin caché: el próximo request reintenta
+            if user is not None and has_request_context():
+                session[_SESSION_KEY] = user.snapshot()
+        _user_cache.set(user_id, user)
+        return user
 
     @staticmethod
     def find(username):
-        # --- CORREGIDO: Obtener y pasar subscription_end_date ---
-        query = text("SELECT * FROM users WHERE username = :username")
+        # Login: siempre va a la base (necesita el hash y el estado actual de bloqueo)
         try:
-            user_df = pd.read_sql(query, engine, params={"username": username})
-            if not user_df.empty:
-                user_data = user_df.iloc[0]
-                # Convertir a objeto date si no es None
-                sub_end = pd.to_datetime(user_data['subscription_end_date']).date() if pd.notna(user_data['subscription_end_date']) else None
-                return User(
-                    id=user_data['id'],
-                    username=user_data['username'],
-                    password=user_data['password'],
-                    must_change_password=user_data['must_change_password'],
-                    is_blocked=user_data['is_blocked'],
-                    first_login=user_data['first_login'],
-                    is_admin=user_data['is_admin'],
-                    subscription_end_date=sub_end # <-- Añadido
-                )
+            return User._fetch("username", username, with_password=True)
         except Exception as e:
             print(f"Error finding user: {e}")
         return None
 
+def _session_user(user_id):
+    """User desde la copia de la cookie de sesión si es de este usuario y no venció."""
+    if not has_request_context(): return None
+    data = session.get(_SESSION_KEY)
+    if not data or data.get('id') != user_id: return None
+    if time.time() - data.get('loaded_at', 0) > USER_CACHE_TTL_SECONDS: return None
+    try:
+        return User.from_snapshot(data)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def invalidate_user(user_id):
+    """Descarta el usuario en caché tras bloquear, resetear, extender, eliminar o cambiar contraseña."""
+    _user_cache.pop(int(user_id))
+    if has_request_context():
+        data = session.get(_SESSION_KEY)
+        if data and data.get('id') == int(user_id):
+            session.pop(_SESSION_KEY, None)
+
 # (set_password y check_password sin cambios)
 def set_password(password):
     return generate_password_hash(password)
 
 def check_password(hashed_password, password):
-    return check_password_hash(hashed_password, password)
\ No newline at end of file
+    return check_password_hash(hashed_password, password)
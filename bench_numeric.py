@@ -0,0 +1,55 @@
+# bench_numeric.py
+# Mide cuánto cuesta decodificar NUMERIC al leer muchas filas (generadas en el servidor, no lee tablas):
+#   decimal -> pd.read_sql con engine: un Decimal por celda y luego pd.to_numeric (el camino anterior)
+#   float   -> pd.read_sql con analytics_engine: NUMERIC decodificado directo a float
+#   copy    -> read_frame_copy: COPY ... TO STDOUT y el lector CSV de pandas
+# Uso: python bench_numeric.py [filas] [repeticiones]   (por defecto 1000000 y 3)
+import sys
+import time
+import pandas as pd
+from sqlalchemy import text
+from database import engine, analytics_engine, read_frame_copy
+
+SQL = """
+    SELECT g AS sale_id,
+           (mod(g, 99991) / 100.0)::numeric(10, 2) AS total_amount,
+           (mod(g, 61333) / 100.0)::numeric(10, 2) AS cogs_total,
+           (mod(g, 8999) / 1000.0)::numeric(10, 3) AS current_stock
+    FROM generate_series(1, :rows) g
+"""
+NUMERIC_COLUMNS = ['total_amount', 'cogs_total', 'current_stock']
+
+def load_decimal(rows):
+    df = pd.read_sql(text(SQL), engine, params={"rows": rows})
+    for column in NUMERIC_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    return df
+
+def load_float(rows):
+    return pd.read_sql(text(SQL), analytics_engine, params={"rows": rows})
+
+def load_copy(rows):
+    return read_frame_copy(SQL, {"rows": rows}, {'sale_id': 'int32', **{column: 'float64' for column in NUMERIC_COLUMNS}})
+
+MODES = {'decimal': load_decimal, 'float': load_float, 'copy': load_copy}
+
+def bench(rows, repeat):
+    best = {}
+    for name, load in MODES.items():
+        load(1000) # Calienta el pool y la conexión
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            df = load(rows)
+            times.append(time.perf_counter() - start)
+        best[name] = min(times)
+        dtypes = ", ".join(str(df[column].dtype) for column in NUMERIC_COLUMNS)
+        print(f"{name:<8} {best[name]:7.2f} s (mejor de {repeat})  dtypes: {dtypes}  memoria: {df.memory_usage(deep=True).sum() / 1e6:.0f} MB")
+    for name in ('float', 'copy'):
+        print(f"{name}: {best['decimal'] / best[name]:.1f}x más rápido que decimal")
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    print(f"Leyendo {rows:,} filas con {len(NUMERIC_COLUMNS)} columnas NUMERIC...")
+    bench(rows, repeat)
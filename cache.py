@@ -0,0 +1,199 @@
+# cache.py
+# Caché de dos niveles para DataFrames y resultados calculados:
+#   1. Memoria del proceso (LRU acotado por entradas + TTL).
+#   2. Opcional, compartida entre workers de gunicorn: archivo SQLite local (CACHE_BACKEND=sqlite).
+# Las claves incluyen la versión de datos del usuario (tenant_data_version), así que
+# una escritura invalida sola las entradas viejas: nunca se sirven datos desactualizados.
+import hashlib
+import os
+import pickle
+import sqlite3
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 512))
+CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS', 600))
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory').lower() # 'memory' o 'sqlite'
+# Directorio propio de la app (no /tmp compartido): el archivo se lee con pickle.loads
+CACHE_SQLITE_PATH = os.environ.get('CACHE_SQLITE_PATH', os.path.join(os.path.expanduser('~'), '.cache', 'emprend', 'cache.sqlite'))
+CACHE_SQLITE_MAX_MB = float(os.environ.get('CACHE_SQLITE_MAX_MB', 256))
+
+
+class LRUCache:
+    """LRU acotado por número de entradas, con expiración (TTL) y seguro entre hilos."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict() # key -> (expira_en, valor)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Devuelve (True, valor) si la clave existe y no expiró; (False, None) en otro caso."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key) # Marcar como usado recientemente
+            return True, value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False) # Expulsar el menos usado
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """
+    Caché compartida entre procesos en un archivo SQLite local (modo WAL, sin servicios externos).
+    Los valores se guardan con pickle protocolo 5; el archivo se acota por tamaño total,
+    expulsando primero lo menos usado. Cualquier error de disco se trata como un 'miss'.
+    """
+
+    def __init__(self, path=CACHE_SQLITE_PATH, max_bytes=CACHE_SQLITE_MAX_MB * 1024 * 1024, ttl=CACHE_TTL_SECONDS):
+        self.path = path
+        self.max_bytes = int(max_bytes)
+        self.ttl = ttl
+        self._local = threading.local() # Una conexión SQLite por hilo
+
+    def _check_path(self):
+        """
+        Crea el directorio (0700) y el archivo (0600) si faltan, y se niega a usar uno que no
+        sea de este usuario o que otros puedan escribir: cargar un pickle ajeno ejecuta su código.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+        try:
+            file_stat = os.fstat(fd)
+        finally:
+            os.close(fd)
+        if not hasattr(os, 'getuid'): return # Windows: sin dueños/permisos POSIX
+        dir_stat = os.lstat(directory)
+        for label, st in (("directorio", dir_stat), ("archivo", file_stat)):
+            if st.st_uid != os.getuid():
+                raise PermissionError(f"El {label} de la caché no pertenece a este usuario: {self.path}")
+            if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                raise PermissionError(f"Otros usuarios pueden escribir el {label} de la caché: {self.path}")
+        if not stat.S_ISDIR(dir_stat.st_mode) or not stat.S_ISREG(file_stat.st_mode):
+            raise PermissionError(f"Ruta de caché inválida: {self.path}")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self._check_path()
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL, last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_last_access ON cache_entries (last_access)")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _hash_key(key):
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        hashed = self._hash_key(key)
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT value, expires_at FROM cache_entries WHERE key = ?", (hashed,)).fetchone()
+            if row is None:
+                return False, None
+            if row[1] < now:
+                conn.execute("DELETE FROM cache_entries WHERE key = ?", (hashed,))
+                return False, None
+            conn.execute("UPDATE cache_entries SET last_access = ? WHERE key = ?", (now, hashed))
+            return True, pickle.loads(row[0])
+        except (sqlite3.Error, OSError, pickle.UnpicklingError, EOFError) as e:
+            print(f"Advertencia: caché SQLite no disponible ({e}).")
+            return False, None
+
+    def set(self, key, value):
+        now = time.time()
+        try:
+            blob = pickle.dumps(value, protocol=5)
+            if len(blob) > self.max_bytes:
+                return # No cabe: no tiene sentido vaciar todo por una sola entrada
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (self._hash_key(key), sqlite3.Binary(blob), len(blob), now + self.ttl, now)
+            )
+            self._evict(conn, now)
+        except (sqlite3.Error, OSError, pickle.PicklingError) as e:
+            print(f"Advertencia: no se pudo escribir en la caché SQLite ({e}).")
+
+    def _evict(self, conn, now):
+        """Borra entradas expiradas y, si el archivo supera max_bytes, las menos usadas."""
+        conn.execute("DELETE FROM cache_entries WHERE expires_at < ?", (now,))
+        conn.execute("""
+            DELETE FROM cache_entries WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_access DESC) AS running_size FROM cache_entries
+                ) WHERE running_size > ?
+            )
+        """, (self.max_bytes,))
+
+    def clear(self):
+        try:
+            self._conn().execute("DELETE FROM cache_entries")
+        except (sqlite3.Error, OSError) as e:
+            print(f"Advertencia: no se pudo vaciar la caché SQLite ({e}).")
+
+
+memory_cache = LRUCache()
+shared_cache = SQLiteCache() if CACHE_BACKEND == 'sqlite' else None
+
+
+def copy_value(value):
+    """Copia DataFrames (también dentro de dicts) para no exponer la entrada cacheada."""
+    if isinstance(value, dict):
+        return {k: copy_value(v) for k, v in value.items()}
+    if hasattr(value, 'copy'):
+        return value.copy()
+    return value
+
+
+def get_or_load(key, loader):
+    """
+    Devuelve una COPIA del valor cacheado bajo 'key' (memoria -> disco compartido -> loader()).
+    La copia protege la entrada compartida: los callbacks modifican libremente sus frames.
+    """
+    hit, value = memory_cache.get(key)
+    if not hit and shared_cache is not None:
+        hit, value = shared_cache.get(key)
+        if hit:
+            memory_cache.set(key, value)
+    if not hit:
+        value = loader()
+        memory_cache.set(key, value)
+        if shared_cache is not None:
+            shared_cache.set(key, value)
+    return copy_value(value)
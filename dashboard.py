@@ -10,7 +10,8 @@ from datetime import date, timedelta
 from flask_login import current_user
 
 from app import app
-from database import load_products, load_categories, load_expense_categories, calculate_financials, load_raw_materials
+from database import load_products, load_expense_categories, calculate_financials, load_raw_materials, load_sales_rollup, load_expense_rollup, fetch_parallel
+from signals import signal_inputs
 
 today = date.today()
 start_of_month = today.replace(day=1)
@@ -145,54 +146,89 @@ def get_layout():
     ])
 
 
+# --- HELPERS DE PANELES ---
+# Cada panel es un callback independiente: los KPIs pintan sin esperar a los gráficos pesados
+# y el inventario (que no depende de fechas) no se vuelve a consultar al cambiar el rango.
+PERIOD_INPUTS = [
+    Input('dashboard-date-picker', 'start_date'),
+    Input('dashboard-date-picker', 'end_date'),
+    Input('dashboard-see-all-switch', 'value'),
+]
+
+def _period_inputs(view):
+    """Inputs del rango de fechas + solo las señales de datos que lee el panel."""
+    return PERIOD_INPUTS + signal_inputs(view)
+
+def _period(start_date, end_date, see_all):
+    """Rango a consultar: (None, None) = histórico completo."""
+    return (None, None) if see_all else (start_date, end_date)
+
+def _check_period_inputs(start_date, end_date):
+    if not current_user.is_authenticated or not all([start_date, end_date]):
+        raise PreventUpdate
+
+def _layout_style():
+    return dict(
+        paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)',
+        margin=dict(l=40, r=20, t=40, b=80), # Margen base
+        font=dict(family="Poppins, sans-serif")
+    )
+
+def _load_sales_rollup_for_charts(user_id, period):
+    # Los gráficos leen los resúmenes diarios (una fila por día y producto), no las ventas crudas
+    return load_sales_rollup(user_id, *period).rename(columns={'day': 'sale_date', 'qty': 'quantity', 'revenue': 'total_amount', 'cogs': 'cogs_total'})
+
+
 def register_callbacks(app):
+    # --- 1. KPIs DEL PERÍODO ---
     @app.callback(
         Output('kpi-total-revenue', 'children'), 
         Output('kpi-gross-profit', 'children'),
-        Output('kpi-total-expenses', 'children'), # <-- NUEVO OUTPUT
+        Output('kpi-total-expenses', 'children'),
         Output('kpi-net-profit', 'children'),
-        Output('kpi-net-profit', 'className'),    # <-- NUEVO OUTPUT (para el color)
+        Output('kpi-net-profit', 'className'),    # Color según signo
+        Output('dashboard-date-picker', 'disabled'),
+        _period_inputs('dashboard-kpis')
+    )
+    def update_dashboard_kpis(start_date, end_date, see_all, *signals):
+        _check_period_inputs(start_date, end_date)
+        results = calculate_financials(start_date, end_date, current_user.id, see_all=see_all, include_frames=False)
+        net_profit = results['net_profit']
+
+        # Lógica de color para Ganancia Neta
+        net_profit_class = "card-title fw-bold text-success" if net_profit >= 0 else "card-title fw-bold text-danger"
+
+        return (
+            f"${results['total_revenue']:,.2f}", 
+            f"${results['gross_profit']:,.2f}", 
+            f"${results['total_expenses']:,.2f}",
+            f"${net_profit:,.2f}",
+            net_profit_class,
+            see_all
+        )
+
+    # --- 2. INVENTARIO Y ALERTAS (NO DEPENDE DE FECHAS) ---
+    @app.callback(
         Output('kpi-product-investment', 'children'),   
         Output('kpi-material-investment', 'children'),  
         Output('low-stock-alerts-products', 'children'), 
         Output('low-stock-alerts-materials', 'children'),
-        Output('monthly-summary-chart', 'figure'),
-        Output('waterfall-profit-summary', 'figure'), 
-        Output('chart-sales-by-product', 'figure'),
-        Output('revenue-by-category-chart', 'figure'),
-        Output('sales-over-time-chart', 'figure'),
-        Output('dashboard-date-picker', 'disabled'),
-        [Input('dashboard-date-picker', 'start_date'),
-         Input('dashboard-date-picker', 'end_date'),
-         Input('dashboard-see-all-switch', 'value'),
-         Input('store-data-signal', 'data')]
+        [Input('main-tabs', 'active_tab'),
+         *signal_inputs('dashboard-inventory')]
     )
-    def update_dashboard_data(start_date, end_date, see_all, signal_data):
-        if not current_user.is_authenticated or not all([start_date, end_date]):
+    def update_inventory_panel(active_tab, *signals):
+        if not current_user.is_authenticated or active_tab != 'tab-dashboard':
             raise PreventUpdate
 
         user_id = current_user.id
-        results = calculate_financials(start_date, end_date, user_id, see_all=see_all)
-
-        total_revenue = results['total_revenue']
-        gross_profit = results['gross_profit']
-        total_cogs = results['total_cogs']
-        total_expenses = results['total_expenses']
-        net_profit = results['net_profit']
-        date_picker_disabled = see_all
-        merged_df = results['merged_df']
-        sales_df = results['sales_df']
-        expenses_df = results['expenses_df']
-
-        # Lógica de color para Ganancia Neta
-        net_profit_class = "card-title fw-bold text-success" if net_profit >= 0 else "card-title fw-bold text-danger"
+        data = fetch_parallel(
+            products=lambda: load_products(user_id, columns=['name', 'cost', 'stock', 'alert_threshold', 'is_active']),
+            raw_materials=lambda: load_raw_materials(user_id, columns=['name', 'unit_measure', 'current_stock', 'average_cost', 'alert_threshold']),
+        )
 
         # --- PRODUCTOS ---
-        products_df = load_products(user_id)
-        categories_df = load_categories(user_id)
-        products_with_cat_names = pd.merge(products_df, categories_df, on='category_id', how='left')
-        
-        total_product_investment = (products_with_cat_names['cost'] * products_with_cat_names['stock']).sum() if not products_with_cat_names.empty else 0
+        products_df = data['products']
+        total_product_investment = (products_df['cost'] * products_df['stock']).sum() if not products_df.empty else 0
         
         if 'is_active' in products_df.columns:
              # Convertir a booleanos reales por si vienen como 1/0 o True/False
@@ -224,7 +260,7 @@ def register_callbacks(app):
             )
 
         # --- INSUMOS ---
-        raw_materials_df = load_raw_materials(user_id)
+        raw_materials_df = data['raw_materials']
         total_material_investment = 0
         
         if not raw_materials_df.empty:
@@ -248,15 +284,30 @@ def register_callbacks(app):
                 )
         else:
              material_alerts = html.Div("Sin datos", className="text-muted small")
-        
-        # --- ESTILOS GRÁFICOS ---
-        layout_style = dict(
-            paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)',
-            margin=dict(l=40, r=20, t=40, b=80), # Margen base
-            font=dict(family="Poppins, sans-serif")
+
+        return (
+            f"${total_product_investment:,.2f}",   
+            f"${total_material_investment:,.2f}",  
+            product_alerts,                        
+            material_alerts
         )
 
-# --- WATERFALL (SOLO MONTOS) ---
+    # --- 3. WATERFALL (SOLO MONTOS) ---
+    @app.callback(
+        Output('waterfall-profit-summary', 'figure'),
+        _period_inputs('dashboard-waterfall')
+    )
+    def update_waterfall_chart(start_date, end_date, see_all, *signals):
+        _check_period_inputs(start_date, end_date)
+        # Misma llamada que los KPIs: sale de la caché por versión de datos
+        results = calculate_financials(start_date, end_date, current_user.id, see_all=see_all, include_frames=False)
+
+        total_revenue = results['total_revenue']
+        gross_profit = results['gross_profit']
+        total_cogs = results['total_cogs']
+        total_expenses = results['total_expenses']
+        net_profit = results['net_profit']
+
         waterfall_x = ["Inicio", "Ingresos", "Costo Ventas", "Gastos Op.", "Ganancia Neta"]
         waterfall_measures = ["absolute", "relative", "relative", "relative", "total"]
         
@@ -329,18 +380,25 @@ def register_callbacks(app):
         min_y = min(0, net_profit); max_y = max(total_revenue, gross_profit, net_profit, 0)
         padding_y = (max_y - min_y) * 0.1 if max_y > min_y else 50
         fig_waterfall.update_yaxes(range=[min_y - padding_y, max_y + padding_y])
+        return fig_waterfall
+
+    # --- 4. GRÁFICOS BARRAS (PRODUCTO / CATEGORÍA) ---
+    @app.callback(
+        Output('chart-sales-by-product', 'figure'),
+        Output('revenue-by-category-chart', 'figure'),
+        _period_inputs('dashboard-revenue-bars')
+    )
+    def update_revenue_bars(start_date, end_date, see_all, *signals):
+        _check_period_inputs(start_date, end_date)
+        merged_df = _load_sales_rollup_for_charts(current_user.id, _period(start_date, end_date, see_all))
+        layout_style = _layout_style()
 
-        # --- INICIALIZAR FIGURAS VACÍAS ---
         fig_sales_by_prod = px.bar(title="Ingresos por Producto", height=400)
         fig_revenue_by_cat = px.bar(title="Ingresos por Categoría", height=400)
-        fig_sales_over_time = px.line(title="Ingresos por Día", height=400)
-        fig_monthly = px.bar(title="Resumen Financiero Mensual", height=400)
 
-        # --- GRÁFICOS BARRAS ---
         if not merged_df.empty:
-            revenue_by_product = merged_df.groupby('name')['total_amount'].sum().reset_index()
-            merged_df_with_cat = pd.merge(merged_df, categories_df, on='category_id', how='left').rename(columns={'name_y': 'category_name'})
-            revenue_by_category = merged_df_with_cat.groupby('category_name')['total_amount'].sum().reset_index()
+            revenue_by_product = merged_df.groupby('name', observed=True)['total_amount'].sum().reset_index()
+            revenue_by_category = merged_df.groupby('category_name', observed=True)['total_amount'].sum().reset_index()
 
             fig_sales_by_prod = px.bar(revenue_by_product, x='name', y='total_amount', title="Ingresos por Producto",
                                          labels={'name': 'Producto', 'total_amount': 'Ingresos'},
@@ -352,31 +410,63 @@ def register_callbacks(app):
                                          labels={'category_name': 'Categoría', 'total_amount': 'Ingresos'},
                                          color_discrete_sequence=['#2c3e50'])
             fig_revenue_by_cat.update_layout(**layout_style, xaxis_tickangle=-45)
-            
-            # --- GRÁFICO LÍNEA (CORRECCIÓN OVERLAP) ---
-            sales_by_day = merged_df.groupby(merged_df['sale_date'].dt.date)['total_amount'].sum().reset_index()
-            fig_sales_over_time = px.line(sales_by_day, x='sale_date', y='total_amount', title='Ingresos por Día',
-                                              labels={'sale_date': 'Fecha', 'total_amount': 'Ingresos'}, markers=True, height=400,
-                                              color_discrete_sequence=['#32a852'])
-            
-            # Aumentamos el margen superior (t=80) para que el título no choque con los botones
-            line_layout = layout_style.copy()
-            line_layout['margin'] = dict(l=40, r=20, t=80, b=40) # <-- CORRECCIÓN AQUÍ
-            fig_sales_over_time.update_layout(**line_layout)
-            
-            fig_sales_over_time.update_xaxes(
-                tickformat="%Y-%m-%d",
-                rangeselector=dict(
-                    buttons=list([
-                        dict(count=1, label="1m", step="month", stepmode="backward"),
-                        dict(count=6, label="6m", step="month", stepmode="backward"),
-                        dict(count=1, label="YTD", step="year", stepmode="todate"),
-                        dict(step="all", label="Todo")
-                    ])
-                )
+
+        return fig_sales_by_prod, fig_revenue_by_cat
+
+    # --- 5. GRÁFICO LÍNEA (INGRESOS POR DÍA) ---
+    @app.callback(
+        Output('sales-over-time-chart', 'figure'),
+        _period_inputs('dashboard-sales-over-time')
+    )
+    def update_sales_over_time(start_date, end_date, see_all, *signals):
+        _check_period_inputs(start_date, end_date)
+        merged_df = _load_sales_rollup_for_charts(current_user.id, _period(start_date, end_date, see_all))
+
+        fig_sales_over_time = px.line(title="Ingresos por Día", height=400)
+        if merged_df.empty:
+            return fig_sales_over_time
+
+        sales_by_day = merged_df.groupby(merged_df['sale_date'].dt.date)['total_amount'].sum().reset_index()
+        fig_sales_over_time = px.line(sales_by_day, x='sale_date', y='total_amount', title='Ingresos por Día',
+                                          labels={'sale_date': 'Fecha', 'total_amount': 'Ingresos'}, markers=True, height=400,
+                                          color_discrete_sequence=['#32a852'])
+        
+        # Aumentamos el margen superior (t=80) para que el título no choque con los botones
+        line_layout = _layout_style()
+        line_layout['margin'] = dict(l=40, r=20, t=80, b=40) # <-- CORRECCIÓN AQUÍ
+        fig_sales_over_time.update_layout(**line_layout)
+        
+        fig_sales_over_time.update_xaxes(
+            tickformat="%Y-%m-%d",
+            rangeselector=dict(
+                buttons=list([
+                    dict(count=1, label="1m", step="month", stepmode="backward"),
+                    dict(count=6, label="6m", step="month", stepmode="backward"),
+                    dict(count=1, label="YTD", step="year", stepmode="todate"),
+                    dict(step="all", label="Todo")
+                ])
             )
+        )
+        return fig_sales_over_time
+
+    # --- 6. GRÁFICO MENSUAL ---
+    @app.callback(
+        Output('monthly-summary-chart', 'figure'),
+        _period_inputs('dashboard-monthly')
+    )
+    def update_monthly_chart(start_date, end_date, see_all, *signals):
+        _check_period_inputs(start_date, end_date)
+        user_id = current_user.id
+        period = _period(start_date, end_date, see_all)
+        data = fetch_parallel(
+            sales=lambda: _load_sales_rollup_for_charts(user_id, period),
+            expenses=lambda: load_expense_rollup(user_id, *period).rename(columns={'day': 'expense_date'}),
+        )
+        sales_df = data['sales']
+        expenses_df = data['expenses']
+
+        fig_monthly = px.bar(title="Resumen Financiero Mensual", height=400)
 
-# --- GRÁFICO MENSUAL (CORREGIDO) ---
         if not sales_df.empty:
              sales_monthly = sales_df.resample('ME', on='sale_date').agg(Ingresos=('total_amount', 'sum'), COGS=('cogs_total', 'sum')).reset_index()
              sales_monthly['month'] = sales_monthly['sale_date'].dt.to_period('M')
@@ -426,7 +516,7 @@ def register_callbacks(app):
             # Limpieza de nombres en leyenda (quita ' Positivo'/' Negativo')
             fig_monthly.for_each_trace(lambda t: t.update(name=t.name.replace(' Positivo', '').replace(' Negativo', '')))
             
-            monthly_layout = layout_style.copy()
+            monthly_layout = _layout_style()
             # Ajustamos márgenes: reducimos 'b' (bottom) un poco ya que ganaremos espacio quitando el título
             monthly_layout['margin'] = dict(l=20, r=20, t=60, b=80)
             
@@ -445,20 +535,4 @@ def register_callbacks(app):
             # CAMBIO CLAVE: title=None elimina la palabra "Mes" y evita el overlap
             fig_monthly.update_xaxes(type='category', tickangle=-45, title=None)
 
-        return (
-            f"${total_revenue:,.2f}", 
-            f"${gross_profit:,.2f}", 
-            f"${total_expenses:,.2f}", # <-- GASTOS AGREGADO
-            f"${net_profit:,.2f}",
-            net_profit_class,           # <-- COLOR NETO AGREGADO
-            f"${total_product_investment:,.2f}",   
-            f"${total_material_investment:,.2f}",  
-            product_alerts,                        
-            material_alerts,                       
-            fig_monthly,                           
-            fig_waterfall,                         
-            fig_sales_by_prod,                     
-            fig_revenue_by_cat,                    
-            fig_sales_over_time,                   
-            date_picker_disabled                   
-        )
\ No newline at end of file
+        return fig_monthly
@@ -1,13 +1,25 @@
 # database.py
 import pandas as pd
-from sqlalchemy import create_engine, text, QueuePool
+import psycopg2.extensions
+from sqlalchemy import create_engine, event, text, QueuePool
 from datetime import datetime, timedelta, date 
+import hashlib
+import io
+import json
 import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
 from dotenv import load_dotenv  # <--- AGREGAR ESTO
 
 # 1. CARGA AUTOMÁTICA DEL ARCHIVO .ENV
 # override=True fuerza a recargar el archivo por si la terminal tiene basura vieja
 load_dotenv(override=True)
+from cache import get_or_load, copy_value, LRUCache # Después de load_dotenv: lee CACHE_* del entorno
 
 # 2. LEER URL
 DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -48,27 +60,296 @@ engine = create_engine(
     pool_recycle=60,      
     pool_pre_ping=True    
 )
+
+# --- LECTURAS ANALÍTICAS (NUMERIC COMO float) ---
+# psycopg2 convierte cada celda NUMERIC en un Decimal. Las lecturas que solo muestran o
+# suman montos usan analytics_engine (mismo pool, opción analytical=True): en sus cursores
+# NUMERIC se decodifica directo a float. Las escrituras siguen con engine y Decimal exacto.
+# Ver bench_numeric.py para medir la diferencia.
+def _numeric_to_float(value, cursor):
+    return float(value) if value is not None else None
+
+NUMERIC_AS_FLOAT = psycopg2.extensions.new_type(psycopg2.extensions.DECIMAL.values, 'NUMERIC_AS_FLOAT', _numeric_to_float)
+
+@event.listens_for(engine, 'before_cursor_execute')
+def _analytical_numeric(conn, cursor, statement, parameters, context, executemany):
+    if conn.get_execution_options().get('analytical'):
+        psycopg2.extensions.register_type(NUMERIC_AS_FLOAT, cursor) # Solo este cursor
+
+analytics_engine = engine.execution_options(analytical=True)
+
+# --- VERSIÓN DE DATOS POR USUARIO ---
+# tenant_data_version guarda un contador global por usuario y uno por dominio.
+# Toda escritura lo incrementa en SU MISMA transacción, así cualquier caché del servidor
+# (en cualquier worker) puede comparar la versión en vez de volver a consultar los datos.
+DATA_DOMAINS = ('sales', 'expenses', 'products', 'materials')
+
+def _version_column(domain):
+    if domain is None: return "version"
+    if domain not in DATA_DOMAINS:
+        raise ValueError(f"Dominio de datos desconocido: '{domain}'.")
+    return f"{domain}_version"
+
+def bump_data_version(connection, user_id, *domains):
+    """Incrementa la versión global del usuario y la de los dominios indicados (NO HACE COMMIT)."""
+    columns = ["version"] + [_version_column(d) for d in dict.fromkeys(domains)]
+    column_list = ", ".join(columns)
+    initial_values = ", ".join("1" for _ in columns)
+    updates = ", ".join(f"{col} = tenant_data_version.{col} + 1" for col in columns)
+    connection.execute(text(f"""
+        INSERT INTO tenant_data_version (user_id, {column_list}, updated_at)
+        VALUES (:user_id, {initial_values}, NOW())
+        ON CONFLICT (user_id) DO UPDATE SET {updates}, updated_at = NOW()
+    """), {"user_id": int(user_id)})
+
+def get_data_version(user_id, domain=None):
+    """Devuelve la versión actual (global o de un dominio) de los datos del usuario. 0 si nunca escribió."""
+    query = text(f"SELECT {_version_column(domain)} FROM tenant_data_version WHERE user_id = :user_id")
+    with engine.connect() as connection:
+        value = connection.execute(query, {"user_id": int(user_id)}).scalar()
+    return int(value or 0)
+
+# --- SINGLE-FLIGHT (UNA SOLA CONSULTA PARA CARGAS IDÉNTICAS CONCURRENTES) ---
+# Cuando varios callbacks piden lo mismo a la vez (misma función, argumentos y versión),
+# solo el primero consulta Postgres; el resto espera y recibe una copia del resultado.
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+def single_flight(key, loader):
+    """Ejecuta loader() una sola vez por 'key' entre los hilos que lo pidan al mismo tiempo."""
+    with _flights_lock:
+        flight = _flights.get(key)
+        is_leader = flight is None
+        if is_leader:
+            flight = _flights[key] = _Flight()
+        else:
+            flight.waiters += 1
+
+    if not is_leader:
+        flight.done.wait()
+        if flight.error is not None: raise flight.error
+        return copy_value(flight.result)
+
+    try:
+        flight.result = loader()
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key] # Desde aquí nadie más se une a este vuelo
+            shared = flight.waiters > 0
+        flight.done.set()
+    # Si hubo espera, el líder también devuelve una copia para no compartir el objeto
+    return copy_value(flight.result) if shared else flight.result
+
+def _key_part(value):
+    return tuple(value) if isinstance(value, (list, tuple)) else value # columns=[...] -> tupla hasheable
+
+def _load_key(user_id, table, domain, args, kwargs):
+    return (int(user_id), table, get_data_version(user_id, domain),
+            tuple(_key_part(a) for a in args), tuple(sorted((k, _key_part(v)) for k, v in kwargs.items())))
+
+def _cached(key, loader):
+    """Caché por versión + single-flight: ante un 'miss' concurrente, una sola consulta."""
+    return get_or_load(key, lambda: single_flight(key, loader))
+
+def versioned_cache(table, domain):
+    """Cachea un loader por (usuario, tabla, versión del dominio o global si domain=None, argumentos). Ver cache.py."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(user_id, *args, **kwargs):
+            key = _load_key(user_id, table, domain, args, kwargs)
+            return _cached(key, lambda: func(user_id, *args, **kwargs))
+        return wrapper
+    return decorator
+
+# --- CONSULTAS EN PARALELO ---
+# Hilos extra por proceso = pool_size: junto con el hilo del request no pasan de pool_size + max_overflow.
+PARALLEL_FETCH_WORKERS = engine.pool.size()
+_fetch_executor = ThreadPoolExecutor(max_workers=PARALLEL_FETCH_WORKERS, thread_name_prefix='fetch')
+_fetch_local = threading.local()
+
+def _run_fetch_task(func):
+    _fetch_local.in_worker = True
+    try:
+        return func()
+    finally:
+        _fetch_local.in_worker = False
+
+def fetch_parallel(**tasks):
+    """
+    Ejecuta cargas independientes a la vez y devuelve {nombre: resultado}.
+    Cada tarea es un callable sin argumentos (ej. lambda: load_products(uid)).
+    La primera corre en el hilo actual; si se llama desde una tarea, todo corre en secuencia
+    (evita que los hilos del pool esperen por sí mismos).
+    """
+    if len(tasks) < 2 or getattr(_fetch_local, 'in_worker', False):
+        return {name: func() for name, func in tasks.items()}
+
+    (first_name, first_func), *rest = tasks.items()
+    futures = {name: _fetch_executor.submit(_run_fetch_task, func) for name, func in rest}
+    results = {first_name: first_func()}
+    for name, future in futures.items():
+        results[name] = future.result() # Propaga la excepción de la tarea, si la hubo
+    return results
+
+def coalesced(table, domain):
+    """Sin caché, pero las cargas idénticas simultáneas comparten una sola consulta."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(user_id, *args, **kwargs):
+            key = _load_key(user_id, table, domain, args, kwargs)
+            return single_flight(key, lambda: func(user_id, *args, **kwargs))
+        return wrapper
+    return decorator
+
+# --- CARGA RÁPIDA (COPY ... TO STDOUT) ---
+# pd.read_sql arma una tupla de Python por fila y un Decimal por cada celda NUMERIC.
+# Para los DataFrames grandes la consulta sale con COPY en CSV y la parsea el lector en C
+# de pandas con dtypes fijos: NUMERIC llega directo como float64, sin pd.to_numeric después.
+COPY_SPOOL_BYTES = int(os.environ.get('COPY_SPOOL_BYTES', 32 * 1024 * 1024)) # Más grande: a disco
+
+def _pyformat(sql):
+    """Parámetros estilo text() (:nombre) a estilo psycopg2 (%(nombre)s); respeta los casts '::'."""
+    return re.sub(r"(?<![:\w]):([A-Za-z_]\w*)", r"%(\1)s", sql.replace('%', '%%'))
+
+def read_frame_copy(sql, params=None, dtypes=None):
+    """
+    Como pd.read_sql, pero con COPY (sql) TO STDOUT (CSV) y dtypes fijos {columna: dtype}
+    ('datetime64[ns]', 'bool' y 'category' incluidos; en 'str' el NULL queda como '').
+    sql debe listar sus columnas (sin SELECT *) para que dtypes coincida con el resultado.
+    El CSV pasa por un archivo temporal que se queda en memoria hasta COPY_SPOOL_BYTES.
+    """
+    dtypes = dict(dtypes or {})
+    parse_dates = [column for column, dtype in dtypes.items() if dtype == 'datetime64[ns]']
+    booleans = [column for column, dtype in dtypes.items() if dtype == 'bool']
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        try:
+            query = cursor.mogrify(_pyformat(sql), params or {}).decode('utf-8')
+            with tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_BYTES, mode='w+b') as buffer:
+                cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)", buffer)
+                buffer.seek(0)
+                df = pd.read_csv(
+                    buffer, dtype={c: t for c, t in dtypes.items() if c not in parse_dates and c not in booleans},
+                    true_values=['t'], false_values=['f'],
+                    keep_default_na=False, na_values=[''], # Solo el campo vacío es NULL (no 'NA', 'null'...)
+                )
+        finally:
+            cursor.close()
+    finally:
+        raw.close() # Vuelve al pool (rollback de la transacción de solo lectura)
+    for column in booleans:
+        df[column] = df[column].eq(True) # NULL -> False (astype(bool) lo volvería True)
+    for column in (c for c, t in dtypes.items() if t == 'str'):
+        df[column] = df[column].fillna('')
+    for column in parse_dates:
+        df[column] = pd.to_datetime(df[column], format='ISO8601')
+    return df
+
+def _projection(schema, columns=None):
+    """
+    Lista SELECT y dtypes de las columnas pedidas de un esquema {columna: (expresión SQL, dtype)}.
+    columns=None trae todas; una columna que no está en el esquema es un error (ValueError).
+    """
+    names = list(schema) if columns is None else list(columns)
+    unknown = [column for column in names if column not in schema]
+    if unknown or not names:
+        raise ValueError(f"Columnas inválidas: {', '.join(unknown) or '(ninguna)'}")
+    select = ", ".join(f"{schema[column][0]} AS {column}" for column in names)
+    return select, {column: schema[column][1] for column in names}
+
+# --- ESQUEMAS DE LOS DATAFRAMES ---
+# {columna: (expresión SQL, dtype)}. Ids y cantidades enteras sin NULL en int32; las que
+# pueden venir en NULL en Int32 (nullable) o float64 (FK), para que dropna() las siga viendo; los montos NUMERIC se convierten a float8 en SQL; los
+# nombres que se repiten fila a fila (categorías, conceptos, unidades) van como 'category'.
+PRODUCTS_SCHEMA = {
+    'product_id': ('product_id', 'int32'), 'name': ('name', 'str'), 'description': ('description', 'str'),
+    'category_id': ('category_id', 'float64'), 'price': ('price::float8', 'float64'), 'cost': ('cost::float8', 'float64'),
+    'stock': ('COALESCE(stock, 0)::int4', 'int32'), 'alert_threshold': ('COALESCE(alert_threshold, 0)::int4', 'int32'),
+    'user_id': ('user_id', 'int32'), 'is_active': ('COALESCE(is_active, FALSE)', 'bool'),
+}
+CATEGORIES_SCHEMA = {
+    'category_id': ('category_id', 'int32'), 'name': ('name', 'str'),
+    'user_id': ('user_id', 'int32'), 'is_active': ('COALESCE(is_active, FALSE)', 'bool'),
+}
+EXPENSE_CATEGORIES_SCHEMA = {
+    'expense_category_id': ('expense_category_id', 'int32'), 'name': ('name', 'str'),
+    'user_id': ('user_id', 'int32'), 'is_active': ('COALESCE(is_active, FALSE)', 'bool'),
+}
+SALES_SCHEMA = {
+    'sale_id': ('sale_id', 'int32'), 'product_id': ('product_id', 'float64'), 'quantity': ('quantity', 'Int32'),
+    'total_amount': ('total_amount::float8', 'float64'), 'cogs_total': ('cogs_total::float8', 'float64'),
+    'sale_date': ('sale_date', 'datetime64[ns]'), 'user_id': ('user_id', 'int32'),
+}
+EXPENSES_SCHEMA = {
+    'expense_id': ('expense_id', 'int32'), 'expense_concept_id': ('expense_concept_id', 'float64'),
+    'expense_category_id': ('expense_category_id', 'float64'), 'amount': ('amount::float8', 'float64'),
+    'expense_date': ('expense_date', 'datetime64[ns]'), 'user_id': ('user_id', 'int32'),
+}
+EXPENSES_DETAILED_SCHEMA = {
+    'expense_id': ('e.expense_id', 'int32'), 'amount': ('e.amount::float8', 'float64'),
+    'expense_date': ('e.expense_date', 'datetime64[ns]'),
+    'concepto': ("COALESCE(con.name, 'Gasto Antiguo')", 'category'),
+    'categoria': ("COALESCE(cat.name, 'Sin Categoría')", 'category'),
+    'expense_concept_id': ('e.expense_concept_id', 'float64'),
+}
+EXPENSE_CONCEPTS_SCHEMA = {
+    'concept_id': ('c.concept_id', 'int32'), 'concept_name': ('c.name', 'str'),
+    'category_name': ('cat.name', 'category'), 'expense_category_id': ('c.expense_category_id', 'int32'),
+}
+RAW_MATERIALS_SCHEMA = {
+    'material_id': ('material_id', 'int32'), 'name': ('name', 'str'), 'unit_measure': ('unit_measure', 'category'),
+    'current_stock': ('current_stock::float8', 'float64'), 'average_cost': ('average_cost::float8', 'float64'),
+    'alert_threshold': ('alert_threshold::float8', 'float64'), 'user_id': ('user_id', 'int32'), 'is_active': ('COALESCE(is_active, FALSE)', 'bool'),
+}
+SALES_ROLLUP_SCHEMA = {
+    'day': ('r.day', 'datetime64[ns]'), 'product_id': ('r.product_id', 'float64'),
+    'qty': ('r.qty::float8', 'float64'), 'revenue': ('r.revenue::float8', 'float64'), 'cogs': ('r.cogs::float8', 'float64'),
+    'name': ('p.name', 'category'), 'category_id': ('p.category_id', 'float64'), 'category_name': ('c.name', 'category'),
+}
+EXPENSE_ROLLUP_SCHEMA = {
+    'day': ('r.day', 'datetime64[ns]'), 'concept_id': ('r.concept_id', 'float64'), 'amount': ('r.amount::float8', 'float64'),
+    'concepto': ("COALESCE(con.name, 'Gasto Antiguo')", 'category'),
+    'categoria': ("COALESCE(cat.name, 'Sin Categoría')", 'category'),
+}
+
 # --- FUNCIONES DE CARGA ---
-def load_products(user_id):
+# columns=[...] limita el DataFrame a esas columnas del esquema (y a la consulta, a esas también).
+@versioned_cache('products', 'products')
+def load_products(user_id, columns=None):
     """Carga todos los productos (activos e inactivos) para un usuario."""
-    query = text("SELECT * FROM products WHERE user_id = :user_id")
-    # parse_dates informa a Pandas sobre columnas de fecha/hora si existen (aunque no hay en products)
-    return pd.read_sql(query, engine, params={"user_id": int(user_id)})
+    select, dtypes = _projection(PRODUCTS_SCHEMA, columns)
+    return read_frame_copy(f"SELECT {select} FROM products WHERE user_id = :user_id", {"user_id": int(user_id)}, dtypes)
 
-def load_categories(user_id):
+@versioned_cache('categories', 'products')
+def load_categories(user_id, columns=None):
     """Carga todas las categorías de productos (activas e inactivas) para un usuario."""
-    query = text("SELECT * FROM categories WHERE user_id = :user_id")
-    return pd.read_sql(query, engine, params={"user_id": int(user_id)})
+    select, dtypes = _projection(CATEGORIES_SCHEMA, columns)
+    return read_frame_copy(f"SELECT {select} FROM categories WHERE user_id = :user_id", {"user_id": int(user_id)}, dtypes)
 
-def load_expense_categories(user_id):
+@versioned_cache('expense_categories', 'expenses')
+def load_expense_categories(user_id, columns=None):
     """Carga todas las categorías de gastos (activas e inactivas) para un usuario."""
-    query = text("SELECT * FROM expense_categories WHERE user_id = :user_id")
-    return pd.read_sql(query, engine, params={"user_id": int(user_id)})
+    select, dtypes = _projection(EXPENSE_CATEGORIES_SCHEMA, columns)
+    return read_frame_copy(f"SELECT {select} FROM expense_categories WHERE user_id = :user_id", {"user_id": int(user_id)}, dtypes)
 
-def load_sales(user_id, start_date=None, end_date=None):
+@coalesced('sales', 'sales')
+def load_sales(user_id, start_date=None, end_date=None, columns=None):
     """Carga ventas para un usuario, opcionalmente filtradas por fecha."""
     params = {"user_id": int(user_id)}
-    sql = "SELECT * FROM sales WHERE user_id = :user_id"
+    select, dtypes = _projection(SALES_SCHEMA, columns)
+    base_sql = f"SELECT {select} FROM sales WHERE user_id = :user_id"
+    sql = base_sql
     if start_date and end_date:
         # Filtra entre start_date (inclusive) y el día SIGUIENTE a end_date (exclusivo)
         sql += " AND sale_date >= :start_date AND sale_date < :end_date_plus_one"
@@ -79,17 +360,18 @@ def load_sales(user_id, start_date=None, end_date=None):
             params["end_date_plus_one"] = end_date_dt + timedelta(days=1)
         except (TypeError, ValueError):
              print(f"Advertencia: Formato inválido de end_date '{end_date}' en load_sales. Cargando todas las ventas.")
-             sql = "SELECT * FROM sales WHERE user_id = :user_id" # Fallback
+             sql = base_sql # Fallback
              params = {"user_id": int(user_id)}
 
-    query = text(sql)
-    # Informar a Pandas que 'sale_date' es fecha/hora
-    return pd.read_sql(query, engine, params=params, parse_dates=['sale_date'])
+    return read_frame_copy(sql, params, dtypes)
 
-def load_expenses(user_id, start_date=None, end_date=None):
+@coalesced('expenses', 'expenses')
+def load_expenses(user_id, start_date=None, end_date=None, columns=None):
     """Carga gastos para un usuario, opcionalmente filtrados por fecha."""
     params = {"user_id": int(user_id)}
-    sql = "SELECT * FROM expenses WHERE user_id = :user_id"
+    select, dtypes = _projection(EXPENSES_SCHEMA, columns)
+    base_sql = f"SELECT {select} FROM expenses WHERE user_id = :user_id"
+    sql = base_sql
     if start_date and end_date:
         # Filtra entre start_date (inclusive) y el día SIGUIENTE a end_date (exclusivo)
         sql += " AND expense_date >= :start_date AND expense_date < :end_date_plus_one"
@@ -100,12 +382,10 @@ def load_expenses(user_id, start_date=None, end_date=None):
             params["end_date_plus_one"] = end_date_dt + timedelta(days=1)
         except (TypeError, ValueError):
              print(f"Advertencia: Formato inválido de end_date '{end_date}' en load_expenses. Cargando todos los gastos.")
-             sql = "SELECT * FROM expenses WHERE user_id = :user_id" # Fallback
+             sql = base_sql # Fallback
              params = {"user_id": int(user_id)}
 
-    query = text(sql)
-    # Informar a Pandas que 'expense_date' es fecha/hora
-    return pd.read_sql(query, engine, params=params, parse_dates=['expense_date'])
+    return read_frame_copy(sql, params, dtypes)
 
 
 # --- FUNCIONES DE ACTUALIZACIÓN Y BORRADO ---
@@ -113,6 +393,7 @@ def update_stock(product_id, new_stock, user_id):
     with engine.connect() as connection:
         query = text("UPDATE products SET stock = :stock WHERE product_id = :product_id AND user_id = :user_id")
         connection.execute(query, {"stock": int(new_stock), "product_id": int(product_id), "user_id": int(user_id)})
+        bump_data_version(connection, user_id, 'products')
         connection.commit()
 
 # EN database.py: REEMPLAZA esta función
@@ -132,6 +413,7 @@ def update_product(connection, product_id, data, user_id):
     data['product_id'] = int(product_id)
     data['user_id'] = int(user_id)
     connection.execute(query, data)
+    bump_data_version(connection, user_id, 'products')
     # NO HAY COMMIT
 
 def delete_product(product_id, user_id):
@@ -139,6 +421,7 @@ def delete_product(product_id, user_id):
     with engine.connect() as connection:
         query = text("UPDATE products SET is_active = FALSE WHERE product_id = :product_id AND user_id = :user_id")
         connection.execute(query, {"product_id": int(product_id), "user_id": int(user_id)})
+        bump_data_version(connection, user_id, 'products')
         connection.commit()
 
 def update_category(category_id, data, user_id):
@@ -147,6 +430,7 @@ def update_category(category_id, data, user_id):
         data['category_id'] = int(category_id)
         data['user_id'] = int(user_id)
         connection.execute(query, data)
+        bump_data_version(connection, user_id, 'products')
         connection.commit()
 
 def delete_category(category_id, user_id):
@@ -158,6 +442,7 @@ def delete_category(category_id, user_id):
         # Marcar categoría como inactiva
         query = text("UPDATE categories SET is_active = FALSE WHERE category_id = :category_id AND user_id = :user_id")
         connection.execute(query, {"category_id": int(category_id), "user_id": int(user_id)})
+        bump_data_version(connection, user_id, 'products')
         connection.commit()
 
 def update_sale(sale_id, data, user_id):
@@ -181,16 +466,46 @@ def update_sale(sale_id, data, user_id):
         data['product_id'] = data.get('product_id') # Puede ser None si se eliminó
         data['sale_id'] = int(sale_id)
         data['user_id'] = int(user_id)
+        old_days = _sale_days(connection, [sale_id], user_id)
         connection.execute(query, data)
+        refresh_sales_rollup(connection, user_id, old_days + [data.get('sale_date')])
+        bump_data_version(connection, user_id, 'sales')
         connection.commit()
 
 def delete_sale(sale_id, user_id):
     """Elimina permanentemente un registro de venta."""
     with engine.connect() as connection:
-        query = text("DELETE FROM sales WHERE sale_id = :sale_id AND user_id = :user_id")
-        connection.execute(query, {"sale_id": int(sale_id), "user_id": int(user_id)})
+        query = text("DELETE FROM sales WHERE sale_id = :sale_id AND user_id = :user_id RETURNING sale_date")
+        deleted = connection.execute(query, {"sale_id": int(sale_id), "user_id": int(user_id)}).fetchall()
+        refresh_sales_rollup(connection, user_id, [row.sale_date for row in deleted])
+        bump_data_version(connection, user_id, 'sales')
         connection.commit()
 
+def add_expense(concept_id, amount, user_id, expense_date=None, idempotency_key=None):
+    """
+    Registra un gasto. Con idempotency_key, un reintento (doble clic) con la misma clave
+    no inserta de nuevo (ON CONFLICT DO NOTHING). Devuelve (success, msg).
+    """
+    expense_date = expense_date or datetime.now() # Hora local del servidor
+    query = text("""
+        INSERT INTO expenses (expense_concept_id, amount, expense_date, user_id, idempotency_key)
+        VALUES (:concept_id, :amount, :expense_date, :user_id, :idempotency_key)
+        ON CONFLICT (user_id, idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+        RETURNING expense_id
+    """)
+    try:
+        with engine.begin() as connection:
+            expense_id = connection.execute(query, {
+                "concept_id": int(concept_id), "amount": float(amount), "expense_date": expense_date,
+                "user_id": int(user_id), "idempotency_key": idempotency_key,
+            }).scalar()
+            if expense_id is None: return True, "El gasto ya estaba registrado."
+            refresh_expense_rollup(connection, user_id, [expense_date])
+            bump_data_version(connection, user_id, 'expenses')
+        return True, "Gasto registrado."
+    except Exception as e:
+        return False, f"Error: {e}"
+
 def update_expense(expense_id, data, user_id):
      with engine.connect() as connection:
         # Asegurarse que la fecha esté en formato correcto para TIMESTAMP
@@ -209,14 +524,19 @@ def update_expense(expense_id, data, user_id):
         data['expense_category_id'] = data.get('expense_category_id') # Puede ser None
         data['expense_id'] = int(expense_id)
         data['user_id'] = int(user_id)
+        old_days = _expense_days(connection, [expense_id], user_id)
         connection.execute(query, data)
+        refresh_expense_rollup(connection, user_id, old_days + [data.get('expense_date')])
+        bump_data_version(connection, user_id, 'expenses')
         connection.commit()
 
 def delete_expense(expense_id, user_id):
     """Elimina permanentemente un registro de gasto."""
     with engine.connect() as connection:
-        query = text("DELETE FROM expenses WHERE expense_id = :expense_id AND user_id = :user_id")
-        connection.execute(query, {"expense_id": int(expense_id), "user_id": int(user_id)})
+        query = text("DELETE FROM expenses WHERE expense_id = :expense_id AND user_id = :user_id RETURNING expense_date")
+        deleted = connection.execute(query, {"expense_id": int(expense_id), "user_id": int(user_id)}).fetchall()
+        refresh_expense_rollup(connection, user_id, [row.expense_date for row in deleted])
+        bump_data_version(connection, user_id, 'expenses')
         connection.commit()
 
 def update_expense_category(category_id, data, user_id):
@@ -225,6 +545,7 @@ def update_expense_category(category_id, data, user_id):
         data['category_id'] = int(category_id)
         data['user_id'] = int(user_id)
         connection.execute(query, data)
+        bump_data_version(connection, user_id, 'expenses')
         connection.commit()
 
 def delete_expense_category(category_id, user_id):
@@ -233,9 +554,13 @@ def delete_expense_category(category_id, user_id):
         # Desvincular gastos de esta categoría
         update_expenses_query = text("UPDATE expenses SET expense_category_id = NULL WHERE expense_category_id = :category_id AND user_id = :user_id")
         connection.execute(update_expenses_query, {"category_id": int(category_id), "user_id": int(user_id)})
+        # Mismo cambio en el resumen diario (no cambian montos, solo la categoría de respaldo)
+        update_rollup_query = text("UPDATE expense_daily_rollup SET expense_category_id = NULL WHERE expense_category_id = :category_id AND user_id = :user_id")
+        connection.execute(update_rollup_query, {"category_id": int(category_id), "user_id": int(user_id)})
         # Marcar categoría como inactiva
         query = text("UPDATE expense_categories SET is_active = FALSE WHERE expense_category_id = :category_id AND user_id = :user_id")
         connection.execute(query, {"category_id": int(category_id), "user_id": int(user_id)})
+        bump_data_version(connection, user_id, 'expenses')
         connection.commit()
 
 def update_user_password(user_id, new_password_hash):
@@ -279,13 +604,82 @@ def get_expense_category_options(user_id):
         print(f"Error en get_expense_category_options: {e}")
         return []
 
+# --- KPIs AGREGADOS EN SQL ---
+def load_financial_kpis(user_id, start_date=None, end_date=None):
+    """Calcula ingresos, COGS, unidades, nº de ventas y gastos en una sola consulta agregada."""
+    params = {"user_id": int(user_id)}
+    sales_filter = ""
+    expenses_filter = ""
+    if start_date and end_date:
+        try:
+            # Mismo criterio que load_sales: [start_date, end_date + 1 día)
+            params["end_date_plus_one"] = pd.to_datetime(end_date).normalize() + timedelta(days=1)
+            params["start_date"] = start_date
+            sales_filter = " AND sale_date >= :start_date AND sale_date < :end_date_plus_one"
+            expenses_filter = " AND expense_date >= :start_date AND expense_date < :end_date_plus_one"
+        except (TypeError, ValueError):
+            print(f"Advertencia: Formato inválido de end_date '{end_date}' en load_financial_kpis. Usando todo el historial.")
+
+    # Los filtros IS NOT NULL replican el dropna() que hacía el cálculo en Pandas
+    query = text(f"""
+        WITH s AS (
+            SELECT COALESCE(SUM(total_amount), 0) AS total_revenue,
+                   COALESCE(SUM(cogs_total), 0) AS total_cogs,
+                   COALESCE(SUM(quantity), 0) AS unidades_vendidas,
+                   COUNT(*) AS num_sales
+            FROM sales
+            WHERE user_id = :user_id
+              AND quantity IS NOT NULL AND total_amount IS NOT NULL AND cogs_total IS NOT NULL{sales_filter}
+        ),
+        e AS (
+            SELECT COALESCE(SUM(amount), 0) AS total_expenses
+            FROM expenses
+            WHERE user_id = :user_id AND amount IS NOT NULL{expenses_filter}
+        )
+        SELECT s.total_revenue, s.total_cogs, s.unidades_vendidas, s.num_sales, e.total_expenses
+        FROM s CROSS JOIN e
+    """)
+    with analytics_engine.connect() as connection:
+        row = connection.execute(query, params).mappings().one()
+
+    return {
+        "total_revenue": float(row["total_revenue"]),
+        "total_cogs": float(row["total_cogs"]),
+        "unidades_vendidas": int(row["unidades_vendidas"]),
+        "num_sales": int(row["num_sales"]),
+        "total_expenses": float(row["total_expenses"]),
+    }
+
 # --- FUNCIÓN DE CÁLCULO FINANCIERO ---
-def calculate_financials(start, end, uid, see_all=False):
-    uid = int(uid); products = load_products(uid)
+def calculate_financials(start, end, uid, see_all=False, include_frames=True):
+    """
+    Calcula los KPIs financieros del período.
+    Con include_frames=False todo se agrega en Postgres y no se traen filas
+    (sales_df, expenses_df y merged_df vuelven vacíos).
+    Solo los KPIs se cachean por versión de datos del usuario (ver cache.py): con
+    include_frames=True los DataFrames de filas no se guardan (la caché en memoria se
+    acota por número de entradas, no por tamaño), como load_sales con @coalesced.
+    """
+    uid = int(uid)
+    if see_all: start = end = None # Con see_all las fechas no importan: misma entrada de caché
+    key = (uid, 'financials', get_data_version(uid), str(start), str(end), bool(see_all), bool(include_frames))
+    if include_frames:
+        return single_flight(key, lambda: _calculate_financials(start, end, uid, see_all, include_frames))
+    return _cached(key, lambda: _calculate_financials(start, end, uid, see_all, include_frames))
+
+def _calculate_financials(start, end, uid, see_all, include_frames):
+    if not include_frames:
+        kpis = load_financial_kpis(uid) if see_all else load_financial_kpis(uid, start, end)
+        res = {"gross_profit": 0, "net_profit": 0, "avg_ticket": 0, "net_margin": 0, "gross_margin": 0,
+               "sales_df": pd.DataFrame(), "expenses_df": pd.DataFrame(), "merged_df": pd.DataFrame(), **kpis}
+        res["gross_profit"] = res["total_revenue"] - res["total_cogs"]
+        return _finish_financials(res)
+
+    products = load_products(uid, columns=['product_id', 'name', 'category_id', 'price', 'cost', 'stock', 'alert_threshold'])
     if see_all:
         sales_df = load_sales(uid)
         # CAMBIO IMPORTANTE: Usamos load_expenses_detailed para tener nombres de categorías y conceptos
-        expenses_df = load_expenses_detailed(uid) 
+        expenses_df = load_expenses_detailed(uid)
     else:
         sales_df = load_sales(uid, start, end)
         expenses_df = load_expenses_detailed(uid, start, end) # CAMBIO AQUÍ TAMBIÉN
@@ -293,7 +687,6 @@ def calculate_financials(start, end, uid, see_all=False):
     res = {"total_revenue": 0, "gross_profit": 0, "total_cogs": 0, "net_profit": 0, "num_sales": 0, "avg_ticket": 0, "net_margin": 0, "total_expenses": 0, "unidades_vendidas": 0, "gross_margin": 0, "sales_df": sales_df, "expenses_df": expenses_df, "merged_df": pd.DataFrame()}
 
     if not sales_df.empty:
-        for c in ['quantity', 'total_amount', 'cogs_total']: sales_df[c] = pd.to_numeric(sales_df[c], errors='coerce')
         sales_df.dropna(subset=['quantity', 'total_amount', 'cogs_total'], inplace=True)
         res["num_sales"] = len(sales_df)
         res["unidades_vendidas"] = int(sales_df['quantity'].sum())
@@ -301,14 +694,16 @@ def calculate_financials(start, end, uid, see_all=False):
         res["total_revenue"] = float(sales_df['total_amount'].sum())
         res["gross_profit"] = res["total_revenue"] - res["total_cogs"]
         if not products.empty:
-            for c in ['price', 'cost', 'stock', 'alert_threshold']: products[c] = pd.to_numeric(products[c], errors='coerce')
             res["merged_df"] = pd.merge(sales_df, products, on='product_id', how='left')
 
     if not expenses_df.empty:
-         expenses_df['amount'] = pd.to_numeric(expenses_df['amount'], errors='coerce')
          expenses_df.dropna(subset=['amount'], inplace=True)
          res["total_expenses"] = float(expenses_df['amount'].sum())
 
+    return _finish_financials(res)
+
+def _finish_financials(res):
+    """Completa los indicadores derivados (ganancia neta, ticket y márgenes)."""
     res["net_profit"] = res["gross_profit"] - res["total_expenses"]
     res["avg_ticket"] = res["total_revenue"] / res["num_sales"] if res["num_sales"] > 0 else 0
     res["net_margin"] = (res["net_profit"] / res["total_revenue"] * 100) if res["total_revenue"] != 0 else 0
@@ -389,6 +784,7 @@ def reactivate_product_category(category_id, user_id):
     with engine.connect() as connection:
         query = text("UPDATE categories SET is_active = TRUE WHERE category_id = :category_id AND user_id = :user_id")
         connection.execute(query, {"category_id": int(category_id), "user_id": int(user_id)})
+        bump_data_version(connection, user_id, 'products')
         connection.commit()
 
 def reactivate_expense_category(category_id, user_id):
@@ -396,6 +792,7 @@ def reactivate_expense_category(category_id, user_id):
     with engine.connect() as connection:
         query = text("UPDATE expense_categories SET is_active = TRUE WHERE expense_category_id = :category_id AND user_id = :user_id")
         connection.execute(query, {"category_id": int(category_id), "user_id": int(user_id)})
+        bump_data_version(connection, user_id, 'expenses')
         connection.commit()
 
 # --- FUNCIÓN ATÓMICA PARA STOCK ---
@@ -415,9 +812,122 @@ def attempt_stock_deduction(product_id, quantity, user_id):
                 "product_id": int(product_id),
                 "user_id": int(user_id)
             })
+            if result.rowcount == 1:
+                bump_data_version(connection, user_id, 'products')
             # El commit es automático al salir del 'with connection.begin()' si no hay error
             return result.rowcount == 1 # True si 1 fila fue afectada (éxito)
 
+def record_sales_batch(items, user_id, sale_date=None, idempotency_key=None):
+    """
+    Registra varias líneas de venta (carrito) en UNA transacción.
+    items: lista de {'product_id', 'quantity'}. Bloquea los productos involucrados en orden
+    de product_id (orden determinista: dos carritos concurrentes no se bloquean mutuamente),
+    valida el stock de todas las líneas a la vez, inserta todas las líneas con un solo
+    INSERT ... SELECT FROM unnest y descuenta el stock de lo insertado en una sentencia.
+    idempotency_key: clave del carrito (cada línea guarda '<clave>:<n>'); si ya se registró,
+    el reintento no hace nada. Devuelve (success, msg).
+    """
+    lines = [(int(item['product_id']), int(item['quantity'])) for item in items]
+    if not lines: return False, "El carrito está vacío."
+    if any(qty <= 0 for _, qty in lines): return False, "Error: La cantidad debe ser mayor a cero."
+
+    totals = {}
+    for pid, qty in lines:
+        totals[pid] = totals.get(pid, 0) + qty
+    keys = [f"{idempotency_key}:{n}" for n in range(1, len(lines) + 1)] if idempotency_key else [None] * len(lines)
+    sale_date = sale_date or datetime.now() # Hora local del servidor
+    try:
+        with engine.begin() as connection:
+            locked = connection.execute(text("""
+                SELECT product_id, name, COALESCE(stock, 0) AS stock FROM products
+                WHERE user_id = :user_id AND product_id = ANY(:pids)
+                ORDER BY product_id
+                FOR UPDATE
+            """), {"user_id": int(user_id), "pids": sorted(totals)}).fetchall()
+            stock_map = {row.product_id: row for row in locked}
+            # Después del bloqueo: un reintento concurrente ya ve las ventas del primer intento
+            if idempotency_key and _sale_key_exists(connection, user_id, keys[0]):
+                return True, "La venta ya estaba registrada."
+
+            errors = []
+            for pid, qty in totals.items():
+                row = stock_map.get(pid)
+                if row is None: errors.append(f"Producto {pid} no encontrado.")
+                elif row.stock < qty: errors.append(f"Stock insuficiente para '{row.name}'. Solo quedan {row.stock}.")
+            if errors:
+                return False, "Error: " + " ".join(errors) # El with hace commit al salir, pero aún no se escribió nada
+
+            inserted = connection.execute(text("""
+                INSERT INTO sales (product_id, quantity, total_amount, cogs_total, sale_date, user_id, idempotency_key)
+                SELECT p.product_id, l.qty, p.price * l.qty, p.cost * l.qty, :sale_date, :user_id, l.idempotency_key
+                FROM unnest(CAST(:pids AS INTEGER[]), CAST(:qtys AS INTEGER[]), CAST(:keys AS TEXT[]))
+                     WITH ORDINALITY AS l(product_id, qty, idempotency_key, line)
+                JOIN products p ON p.product_id = l.product_id AND p.user_id = :user_id
+                ORDER BY l.line
+                ON CONFLICT (user_id, idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+                RETURNING product_id, quantity
+            """), {"pids": [pid for pid, _ in lines], "qtys": [qty for _, qty in lines], "keys": keys,
+                  "sale_date": sale_date, "user_id": int(user_id)}).fetchall()
+            if not inserted: return True, "La venta ya estaba registrada."
+            deducted = {}
+            for row in inserted:
+                deducted[row.product_id] = deducted.get(row.product_id, 0) + row.quantity
+            apply_stock_deductions(connection, user_id, deducted)
+            refresh_sales_rollup(connection, user_id, [sale_date])
+            bump_data_version(connection, user_id, 'sales')
+        units = sum(totals.values())
+        return True, f"¡Venta registrada! {len(lines)} líneas, {units} unidades."
+    except Exception as e:
+        return False, f"Error al registrar la venta: {e}"
+
+def _sale_key_exists(connection, user_id, idempotency_key):
+    query = text("SELECT 1 FROM sales WHERE user_id = :user_id AND idempotency_key = :idempotency_key")
+    return connection.execute(query, {"user_id": int(user_id), "idempotency_key": idempotency_key}).scalar() is not None
+
+def record_sale(product_id, quantity, user_id, sale_date=None, idempotency_key=None):
+    """
+    Registra una venta en UNA sentencia: el INSERT toma precio y costo del producto
+    bloqueado (FOR UPDATE, con guarda stock >= qty) y descuenta el stock solo si la venta
+    se insertó. Con idempotency_key, un reintento (doble clic) choca con el índice único
+    (ON CONFLICT DO NOTHING) y no descuenta nada. Devuelve (success, msg).
+    """
+    params = {
+        "product_id": int(product_id), "quantity": int(quantity), "user_id": int(user_id),
+        "sale_date": sale_date or datetime.now(), # Hora local del servidor
+        "idempotency_key": idempotency_key,
+    }
+    query = text("""
+        WITH inserted AS (
+            INSERT INTO sales (product_id, quantity, total_amount, cogs_total, sale_date, user_id, idempotency_key)
+            SELECT product_id, :quantity, price * :quantity, cost * :quantity, :sale_date, :user_id, :idempotency_key
+            FROM products
+            WHERE product_id = :product_id AND user_id = :user_id AND stock >= :quantity
+            FOR UPDATE
+            ON CONFLICT (user_id, idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+            RETURNING sale_id, product_id
+        ), deducted AS (
+            UPDATE products p SET stock = p.stock - :quantity
+            FROM inserted i
+            WHERE p.product_id = i.product_id AND p.user_id = :user_id
+        )
+        SELECT sale_id FROM inserted
+    """)
+    try:
+        with engine.begin() as connection:
+            sale_id = connection.execute(query, params).scalar()
+            if sale_id is None:
+                if idempotency_key and _sale_key_exists(connection, user_id, idempotency_key):
+                    return True, "La venta ya estaba registrada."
+                # Solo en el camino de error: distinguir producto inexistente de stock insuficiente
+                stock = connection.execute(text("SELECT stock FROM products WHERE product_id = :product_id AND user_id = :user_id"), params).scalar()
+                if stock is None: return False, "Error: Producto no encontrado."
+                return False, f"Error: Stock insuficiente. Solo quedan {stock}."
+            refresh_sales_rollup(connection, user_id, [params["sale_date"]])
+            bump_data_version(connection, user_id, 'sales', 'products')
+        return True, "¡Venta registrada!"
+    except Exception as e:
+        return False, f"Error al registrar la venta: {e}"
+
 # --- NUEVAS FUNCIONES DE CARGA DE MATERIA PRIMA ---
 # database.py
 # ... (existing imports and functions) ...
@@ -427,20 +937,19 @@ def attempt_stock_deduction(product_id, quantity, user_id):
 # --- NUEVAS FUNCIONES DE CARGA DE MATERIA PRIMA ---
 # --- NUEVAS FUNCIONES DE CARGA DE MATERIA PRIMA ---
 
-def load_raw_materials(user_id, include_inactive=False):
+@versioned_cache('raw_materials', 'materials')
+def load_raw_materials(user_id, include_inactive=False, columns=None):
     """Carga materias primas para un usuario. Por defecto, solo activas."""
     params = {"user_id": int(user_id)}
-    sql = "SELECT * FROM raw_materials WHERE user_id = :user_id"
+    select, dtypes = _projection(RAW_MATERIALS_SCHEMA, columns)
+    sql = f"SELECT {select} FROM raw_materials WHERE user_id = :user_id"
     if not include_inactive:
         sql += " AND is_active = TRUE"
     sql += " ORDER BY name"
-    query = text(sql)
-    # Convertir columnas NUMERIC a float en Pandas
-    df = pd.read_sql(query, engine, params=params)
-    numeric_cols = ['current_stock', 'average_cost', 'alert_threshold']
-    for col in numeric_cols:
-         if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    # Las columnas NUMERIC ya llegan como float64
+    df = read_frame_copy(sql, params, dtypes)
+    numeric_cols = [c for c in ('current_stock', 'average_cost', 'alert_threshold') if c in df.columns]
+    df[numeric_cols] = df[numeric_cols].fillna(0)
     return df
 
 def get_raw_material_options(user_id):
@@ -489,6 +998,7 @@ def add_raw_material(data, user_id):
                         """)
                         # 'data' tiene todos los valores nuevos del formulario
                         connection.execute(update_query, {**data, "material_id": material_id, "user_id": user_id})
+                        bump_data_version(connection, user_id, 'materials')
 
                         return True, f"Insumo '{material_name}' reactivado y actualizado exitosamente."
 
@@ -498,6 +1008,7 @@ def add_raw_material(data, user_id):
                     VALUES (:name, :unit_measure, :current_stock, :average_cost, :alert_threshold, :user_id, :is_active)
                 """)
                 connection.execute(insert_query, {**data, "user_id": user_id})
+                bump_data_version(connection, user_id, 'materials')
                 # Commit es automático
 
             return True, f"Insumo '{data['name']}' guardado exitosamente."
@@ -574,6 +1085,7 @@ def add_material_purchase(data, user_id):
                     "notes": data.get('notes'),
                     "user_id": user_id
                 })
+                bump_data_version(connection, user_id, 'materials')
                 # Commit automático
 
             return True, "Compra registrada y stock actualizado exitosamente."
@@ -652,6 +1164,7 @@ def update_raw_material(material_id, data, user_id):
             "material_id": int(material_id),
             "user_id": int(user_id)
         })
+        bump_data_version(connection, user_id, 'materials')
         connection.commit()
 
 def delete_raw_material(material_id, user_id):
@@ -659,6 +1172,7 @@ def delete_raw_material(material_id, user_id):
     with engine.connect() as connection:
         query = text("UPDATE raw_materials SET is_active = FALSE WHERE material_id = :material_id AND user_id = :user_id")
         connection.execute(query, {"material_id": int(material_id), "user_id": int(user_id)})
+        bump_data_version(connection, user_id, 'materials')
         connection.commit()
 
 def reactivate_raw_material(material_id, user_id):
@@ -666,6 +1180,7 @@ def reactivate_raw_material(material_id, user_id):
     with engine.connect() as connection:
         query = text("UPDATE raw_materials SET is_active = TRUE WHERE material_id = :material_id AND user_id = :user_id")
         connection.execute(query, {"material_id": int(material_id), "user_id": int(user_id)})
+        bump_data_version(connection, user_id, 'materials')
         connection.commit()
 
 # database.py
@@ -730,6 +1245,7 @@ def save_product_materials(connection, product_id, material_data_dict, user_id):
                              for mat_id, qty in material_data_dict.items()]
             connection.execute(insert_query, insert_params)
         
+        bump_data_version(connection, user_id, 'products')
         # Devolver éxito si todo fue bien
         return True, "Vinculación de insumos guardada."
 
@@ -847,6 +1363,7 @@ def deduct_materials_for_production(connection, product_id, quantity_produced, u
     final_params = [{**upd, 'user_id': user_id} for upd in updates_to_make]
     
     connection.execute(update_query, final_params)
+    bump_data_version(connection, user_id, 'materials')
     return True, "Stock de insumos deducido exitosamente."
 
 # --- INICIO DEL NUEVO BLOQUE: FUNCIONES DE BORRADO MASIVO ---
@@ -886,8 +1403,12 @@ def delete_sales_bulk(sale_ids, user_id):
                 connection.execute(update_stock_query, restore_params)
 
             # 3. Borrar las ventas
-            delete_query = text("DELETE FROM sales WHERE sale_id = ANY(:sale_ids) AND user_id = :user_id")
-            connection.execute(delete_query, {"sale_ids": sale_ids_int, "user_id": int(user_id)})
+            delete_query = text("DELETE FROM sales WHERE sale_id = ANY(:sale_ids) AND user_id = :user_id RETURNING sale_date")
+            deleted = connection.execute(delete_query, {"sale_ids": sale_ids_int, "user_id": int(user_id)}).fetchall()
+
+            # 4. Recalcular el resumen diario de los días afectados
+            refresh_sales_rollup(connection, user_id, [row.sale_date for row in deleted])
+            bump_data_version(connection, user_id, 'sales', 'products')
             
             # El commit es automático si no hay errores
     return True, f"{len(sale_ids_int)} ventas eliminadas y stock restaurado."
@@ -901,8 +1422,10 @@ def delete_expenses_bulk(expense_ids, user_id):
     expense_ids_int = [int(eid) for eid in expense_ids]
     
     with engine.connect() as connection:
-        query = text("DELETE FROM expenses WHERE expense_id = ANY(:expense_ids) AND user_id = :user_id")
-        connection.execute(query, {"expense_ids": expense_ids_int, "user_id": int(user_id)})
+        query = text("DELETE FROM expenses WHERE expense_id = ANY(:expense_ids) AND user_id = :user_id RETURNING expense_date")
+        deleted = connection.execute(query, {"expense_ids": expense_ids_int, "user_id": int(user_id)}).fetchall()
+        refresh_expense_rollup(connection, user_id, [row.expense_date for row in deleted])
+        bump_data_version(connection, user_id, 'expenses')
         connection.commit()
     return True, f"{len(expense_ids_int)} gastos eliminados."
 
@@ -917,6 +1440,7 @@ def delete_products_bulk(product_ids, user_id):
     with engine.connect() as connection:
         query = text("UPDATE products SET is_active = FALSE WHERE product_id = ANY(:product_ids) AND user_id = :user_id")
         connection.execute(query, {"product_ids": product_ids_int, "user_id": int(user_id)})
+        bump_data_version(connection, user_id, 'products')
         connection.commit()
     return True, f"{len(product_ids_int)} productos marcados como inactivos."
 
@@ -931,6 +1455,7 @@ def delete_materials_bulk(material_ids, user_id):
     with engine.connect() as connection:
         query = text("UPDATE raw_materials SET is_active = FALSE WHERE material_id = ANY(:material_ids) AND user_id = :user_id")
         connection.execute(query, {"material_ids": material_ids_int, "user_id": int(user_id)})
+        bump_data_version(connection, user_id, 'materials')
         connection.commit()
     return True, f"{len(material_ids_int)} insumos marcados como inactivos."
 
@@ -938,16 +1463,18 @@ def delete_materials_bulk(material_ids, user_id):
 
 # --- NUEVAS FUNCIONES PARA CONCEPTOS DE GASTO ---
 
-def load_expense_concepts(user_id):
+@versioned_cache('expense_concepts', 'expenses')
+def load_expense_concepts(user_id, columns=None):
     """Carga conceptos activos con el nombre de su categoría."""
-    query = text("""
-        SELECT c.concept_id, c.name as concept_name, cat.name as category_name, c.expense_category_id 
+    select, dtypes = _projection(EXPENSE_CONCEPTS_SCHEMA, columns)
+    sql = f"""
+        SELECT {select}
         FROM expense_concepts c
         JOIN expense_categories cat ON c.expense_category_id = cat.expense_category_id
         WHERE c.user_id = :user_id AND c.is_active = TRUE AND cat.is_active = TRUE
         ORDER BY cat.name, c.name
-    """)
-    return pd.read_sql(query, engine, params={"user_id": int(user_id)})
+    """
+    return read_frame_copy(sql, {"user_id": int(user_id)}, dtypes)
 
 def get_expense_concept_options(user_id):
     """Opciones para el dropdown de Añadir Gasto (Agrupado visualmente)."""
@@ -978,6 +1505,7 @@ def add_expense_concept(name, category_id, user_id):
                 else:
                     # Reactivar si estaba borrado
                     connection.execute(text("UPDATE expense_concepts SET is_active = TRUE, name = :name WHERE concept_id = :id"), {"name": clean_name, "id": existing.concept_id})
+                    bump_data_version(connection, user_id, 'expenses')
                     return True, f"Concepto '{clean_name}' reactivado exitosamente."
             
             # Crear nuevo
@@ -985,12 +1513,14 @@ def add_expense_concept(name, category_id, user_id):
                 INSERT INTO expense_concepts (name, expense_category_id, user_id, is_active)
                 VALUES (:name, :cid, :uid, TRUE)
             """), {"name": clean_name, "cid": category_id, "uid": user_id})
+            bump_data_version(connection, user_id, 'expenses')
             
             return True, f"Concepto '{clean_name}' creado exitosamente."
 
 def delete_expense_concept(concept_id, user_id):
     with engine.connect() as connection:
         connection.execute(text("UPDATE expense_concepts SET is_active = FALSE WHERE concept_id = :id AND user_id = :uid"), {"id": int(concept_id), "uid": int(user_id)})
+        bump_data_version(connection, user_id, 'expenses')
         connection.commit()
 
 # --- ACTUALIZAR FUNCIONES EXISTENTES ---
@@ -1009,19 +1539,20 @@ def add_expense_category_strict(name, user_id):
                 if existing.is_active: return False, f"La categoría '{clean_name}' ya existe."
                 else:
                     connection.execute(text("UPDATE expense_categories SET is_active = TRUE, name = :name WHERE expense_category_id = :id"), {"name": clean_name, "id": existing.expense_category_id})
+                    bump_data_version(connection, user_id, 'expenses')
                     return True, f"Categoría '{clean_name}' reactivada."
             
             connection.execute(text("INSERT INTO expense_categories (name, user_id, is_active) VALUES (:name, :uid, TRUE)"), {"name": clean_name, "uid": user_id})
+            bump_data_version(connection, user_id, 'expenses')
             return True, f"Categoría '{clean_name}' creada."
 
 # Modificar load_expenses para traer el nombre del concepto
-def load_expenses_detailed(user_id, start_date=None, end_date=None):
+@coalesced('expenses_detailed', 'expenses')
+def load_expenses_detailed(user_id, start_date=None, end_date=None, columns=None):
     params = {"user_id": int(user_id)}
-    sql = """
-        SELECT e.expense_id, e.amount, e.expense_date, 
-               COALESCE(con.name, 'Gasto Antiguo') as concepto, 
-               COALESCE(cat.name, 'Sin Categoría') as categoria,
-               e.expense_concept_id
+    select, dtypes = _projection(EXPENSES_DETAILED_SCHEMA, columns)
+    sql = f"""
+        SELECT {select}
         FROM expenses e
         LEFT JOIN expense_concepts con ON e.expense_concept_id = con.concept_id
         LEFT JOIN expense_categories cat ON con.expense_category_id = cat.expense_category_id
@@ -1036,7 +1567,7 @@ def load_expenses_detailed(user_id, start_date=None, end_date=None):
         except: pass
     
     sql += " ORDER BY e.expense_date DESC"
-    return pd.read_sql(text(sql), engine, params=params, parse_dates=['expense_date'])
+    return read_frame_copy(sql, params, dtypes)
 
 # --- AGREGAR AL FINAL DE database.py ---
 
@@ -1071,6 +1602,7 @@ def update_expense_concept(concept_id, new_name, new_category_id, user_id):
                 SET name = :name, expense_category_id = :cid
                 WHERE concept_id = :id AND user_id = :uid
             """), {"name": clean_name, "cid": new_category_id, "id": concept_id, "uid": user_id})
+            bump_data_version(connection, user_id, 'expenses')
 
 def update_expense_category_strict(category_id, new_name, user_id):
     """Actualiza nombre de categoría validando duplicados."""
@@ -1096,6 +1628,7 @@ def update_expense_category_strict(category_id, new_name, user_id):
                 UPDATE expense_categories SET name = :name 
                 WHERE expense_category_id = :id AND user_id = :uid
             """), {"name": clean_name, "id": category_id, "uid": user_id})
+            bump_data_version(connection, user_id, 'expenses')
 
 # --- AGREGAR AL FINAL DE database.py ---
 
@@ -1119,8 +1652,710 @@ def add_product_category_strict(name, user_id):
                 else:
                     # Reactivar
                     connection.execute(text("UPDATE categories SET is_active = TRUE, name = :name WHERE category_id = :id"), {"name": clean_name, "id": existing.category_id})
+                    bump_data_version(connection, user_id, 'products')
                     return True, f"Categoría '{clean_name}' reactivada exitosamente."
             
             # Crear nueva
             connection.execute(text("INSERT INTO categories (name, user_id, is_active) VALUES (:name, :uid, TRUE)"), {"name": clean_name, "uid": user_id})
-            return True, f"Categoría '{clean_name}' creada exitosamente."
\ No newline at end of file
+            bump_data_version(connection, user_id, 'products')
+            return True, f"Categoría '{clean_name}' creada exitosamente."
+
+
+# --- RESÚMENES DIARIOS (ROLLUPS) ---
+# sales_daily_rollup y expense_daily_rollup guardan una fila por (usuario, día, producto/concepto).
+# Cada escritura sobre sales/expenses recalcula SOLO los días que tocó, dentro de su misma transacción.
+
+def _normalize_days(days):
+    """Convierte fechas/strings/timestamps en una lista ordenada de fechas únicas (sin nulos)."""
+    parsed = pd.to_datetime(pd.Series(list(days), dtype=object), errors='coerce').dropna()
+    return sorted(set(parsed.dt.date))
+
+def _day_range_params(user_id, days):
+    """Parámetros comunes: lista de días y rango [primer día, último día + 1) para aprovechar índices."""
+    return {
+        "user_id": int(user_id),
+        "days": days,
+        "first_day": days[0],
+        "last_day_plus_one": days[-1] + timedelta(days=1),
+    }
+
+def _sale_days(connection, sale_ids, user_id):
+    """Devuelve las fechas actuales de las ventas indicadas (para recalcular sus días tras editar)."""
+    query = text("SELECT sale_date FROM sales WHERE sale_id = ANY(:ids) AND user_id = :user_id")
+    rows = connection.execute(query, {"ids": [int(i) for i in sale_ids], "user_id": int(user_id)}).fetchall()
+    return [row.sale_date for row in rows]
+
+def _expense_days(connection, expense_ids, user_id):
+    """Devuelve las fechas actuales de los gastos indicados (para recalcular sus días tras editar)."""
+    query = text("SELECT expense_date FROM expenses WHERE expense_id = ANY(:ids) AND user_id = :user_id")
+    rows = connection.execute(query, {"ids": [int(i) for i in expense_ids], "user_id": int(user_id)}).fetchall()
+    return [row.expense_date for row in rows]
+
+ROLLUP_LOCK_EPOCH = date(2000, 1, 1)
+
+def _lock_rollup_days(connection, user_id, days, table_slot):
+    """
+    pg_advisory_xact_lock por (usuario, día) antes del DELETE + INSERT de un resumen.
+    Sin esto, dos escrituras del mismo día en READ COMMITTED se pisan: el DELETE de la segunda
+    no ve las filas que la primera acaba de insertar y el día queda sumado dos veces.
+    Los días ya vienen ordenados (_normalize_days): el orden fijo evita bloqueos cruzados.
+    table_slot (0 ventas, 1 gastos) separa las claves de las dos tablas.
+    """
+    for day in days:
+        key = (day - ROLLUP_LOCK_EPOCH).days * 2 + table_slot
+        connection.execute(text("SELECT pg_advisory_xact_lock(:user_id, :key)"), {"user_id": int(user_id), "key": key})
+
+def refresh_sales_rollup(connection, user_id, days):
+    """Recalcula sales_daily_rollup para los días indicados usando una conexión existente."""
+    days = _normalize_days(days)
+    if not days: return
+    params = _day_range_params(user_id, days)
+    _lock_rollup_days(connection, user_id, days, 0) # Hasta el commit/rollback de la transacción
+    connection.execute(text("DELETE FROM sales_daily_rollup WHERE user_id = :user_id AND day = ANY(:days)"), params)
+    # Mismo criterio que los KPIs: se ignoran filas con cantidad/monto/costo nulos
+    connection.execute(text("""
+        INSERT INTO sales_daily_rollup (user_id, day, product_id, qty, revenue, cogs)
+        SELECT user_id, sale_date::date, product_id, SUM(quantity), SUM(total_amount), SUM(cogs_total)
+        FROM sales
+        WHERE user_id = :user_id
+          AND sale_date >= :first_day AND sale_date < :last_day_plus_one
+          AND sale_date::date = ANY(:days)
+          AND quantity IS NOT NULL AND total_amount IS NOT NULL AND cogs_total IS NOT NULL
+        GROUP BY user_id, sale_date::date, product_id
+    """), params)
+    # NO HAY COMMIT
+
+def refresh_expense_rollup(connection, user_id, days):
+    """Recalcula expense_daily_rollup para los días indicados usando una conexión existente."""
+    days = _normalize_days(days)
+    if not days: return
+    params = _day_range_params(user_id, days)
+    _lock_rollup_days(connection, user_id, days, 1)
+    connection.execute(text("DELETE FROM expense_daily_rollup WHERE user_id = :user_id AND day = ANY(:days)"), params)
+    # expense_category_id se conserva para los gastos antiguos que no tienen concepto
+    connection.execute(text("""
+        INSERT INTO expense_daily_rollup (user_id, day, concept_id, expense_category_id, amount)
+        SELECT user_id, expense_date::date, expense_concept_id, expense_category_id, SUM(amount)
+        FROM expenses
+        WHERE user_id = :user_id
+          AND expense_date >= :first_day AND expense_date < :last_day_plus_one
+          AND expense_date::date = ANY(:days)
+          AND amount IS NOT NULL
+        GROUP BY user_id, expense_date::date, expense_concept_id, expense_category_id
+    """), params)
+    # NO HAY COMMIT
+
+def rebuild_rollups(user_id=None):
+    """Reconstruye desde cero los resúmenes diarios de un usuario (o de todos si user_id es None)."""
+    params = {}
+    user_filter = "TRUE"
+    if user_id is not None:
+        params["user_id"] = int(user_id)
+        user_filter = "user_id = :user_id"
+    try:
+        with engine.begin() as connection:
+            # Las escrituras que refrescan días esperan a que termine la reconstrucción (y viceversa)
+            connection.execute(text("LOCK TABLE sales_daily_rollup, expense_daily_rollup IN EXCLUSIVE MODE"))
+            connection.execute(text(f"DELETE FROM sales_daily_rollup WHERE {user_filter}"), params)
+            connection.execute(text(f"DELETE FROM expense_daily_rollup WHERE {user_filter}"), params)
+            sales_rows = connection.execute(text(f"""
+                INSERT INTO sales_daily_rollup (user_id, day, product_id, qty, revenue, cogs)
+                SELECT user_id, sale_date::date, product_id, SUM(quantity), SUM(total_amount), SUM(cogs_total)
+                FROM sales
+                WHERE {user_filter}
+                  AND quantity IS NOT NULL AND total_amount IS NOT NULL AND cogs_total IS NOT NULL
+                GROUP BY user_id, sale_date::date, product_id
+            """), params).rowcount
+            expense_rows = connection.execute(text(f"""
+                INSERT INTO expense_daily_rollup (user_id, day, concept_id, expense_category_id, amount)
+                SELECT user_id, expense_date::date, expense_concept_id, expense_category_id, SUM(amount)
+                FROM expenses
+                WHERE {user_filter} AND amount IS NOT NULL
+                GROUP BY user_id, expense_date::date, expense_concept_id, expense_category_id
+            """), params).rowcount
+            if user_id is not None:
+                bump_data_version(connection, user_id, 'sales', 'expenses')
+            else:
+                connection.execute(text("""
+                    UPDATE tenant_data_version
+                    SET version = version + 1, sales_version = sales_version + 1,
+                        expenses_version = expenses_version + 1, updated_at = NOW()
+                """))
+        return True, f"Resúmenes reconstruidos: {sales_rows} filas de ventas, {expense_rows} filas de gastos."
+    except Exception as e:
+        return False, f"Error reconstruyendo resúmenes: {e}"
+
+def _rollup_date_filter(params, start_date, end_date, caller):
+    """Filtro por día para los resúmenes (mismo rango inclusivo que load_sales)."""
+    if not (start_date and end_date): return ""
+    try:
+        params["start_day"] = pd.to_datetime(start_date).date()
+        params["end_day"] = pd.to_datetime(end_date).date()
+        return " AND r.day >= :start_day AND r.day <= :end_day"
+    except (TypeError, ValueError):
+        print(f"Advertencia: Formato inválido de fechas en {caller}. Usando todo el historial.")
+        return ""
+
+@versioned_cache('sales_daily_rollup', None)
+def load_sales_rollup(user_id, start_date=None, end_date=None, columns=None):
+    """Carga el resumen diario de ventas por producto, con nombre de producto y categoría."""
+    params = {"user_id": int(user_id)}
+    date_filter = _rollup_date_filter(params, start_date, end_date, "load_sales_rollup")
+    select, dtypes = _projection(SALES_ROLLUP_SCHEMA, columns)
+    sql = f"""
+        SELECT {select}
+        FROM sales_daily_rollup r
+        LEFT JOIN products p ON r.product_id = p.product_id
+        LEFT JOIN categories c ON p.category_id = c.category_id
+        WHERE r.user_id = :user_id{date_filter}
+        ORDER BY r.day
+    """
+    return read_frame_copy(sql, params, dtypes)
+
+@versioned_cache('expense_daily_rollup', None)
+def load_expense_rollup(user_id, start_date=None, end_date=None, columns=None):
+    """Carga el resumen diario de gastos por concepto, con nombres de concepto y categoría."""
+    params = {"user_id": int(user_id)}
+    date_filter = _rollup_date_filter(params, start_date, end_date, "load_expense_rollup")
+    select, dtypes = _projection(EXPENSE_ROLLUP_SCHEMA, columns)
+    sql = f"""
+        SELECT {select}
+        FROM expense_daily_rollup r
+        LEFT JOIN expense_concepts con ON r.concept_id = con.concept_id
+        LEFT JOIN expense_categories cat ON cat.expense_category_id = COALESCE(con.expense_category_id, r.expense_category_id)
+        WHERE r.user_id = :user_id{date_filter}
+        ORDER BY r.day
+    """
+    return read_frame_copy(sql, params, dtypes)
+
+
+# --- TABLAS PAGINADAS EN SERVIDOR ---
+# Los DataTable con page_action/sort_action/filter_action='custom' piden una sola página.
+# El filter_query de Dash se traduce a SQL parametrizado y solo se aceptan las columnas
+# declaradas (lista blanca); las columnas de acción (editar/eliminar) se ignoran.
+_FILTER_PART = re.compile(r"^\{(?P<column>[^}]+)\}\s+(?P<operator>is (?:not )?blank|[<>!=]=?|\S+)\s*(?P<value>.*)$")
+_FILTER_OPERATORS = {
+    '=': '=', 'eq': '=', '!=': '<>', 'ne': '<>',
+    '<': '<', 'lt': '<', '<=': '<=', 'le': '<=',
+    '>': '>', 'gt': '>', '>=': '>=', 'ge': '>=',
+    'contains': 'contains', 'datestartswith': 'datestartswith',
+    'is blank': 'is blank', 'is not blank': 'is not blank',
+}
+
+def _filter_value(raw):
+    """Quita comillas y escapes del valor tal como lo escribe el DataTable."""
+    value = raw.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'`":
+        value = re.sub(r"\\(.)", r"\1", value[1:-1])
+    return value
+
+def _like_escape(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def build_filter_sql(filter_query, columns, params):
+    """
+    Traduce el filter_query de un DataTable a condiciones SQL parametrizadas.
+    columns: {column_id: {'sql': expresión, 'type': 'number' | 'text'}}.
+    Devuelve una lista de condiciones y añade los valores a params.
+    """
+    conditions = []
+    for i, part in enumerate((filter_query or '').split(' && ')):
+        match = _FILTER_PART.match(part.strip())
+        if not match or match.group('column') not in columns: continue
+        spec = columns[match.group('column')]
+        operator = match.group('operator')
+        case_insensitive = False
+        if operator not in _FILTER_OPERATORS and operator[:1] in ('i', 's') and operator[1:] in _FILTER_OPERATORS:
+            case_insensitive = operator[0] == 'i'
+            operator = operator[1:]
+        operator = _FILTER_OPERATORS.get(operator)
+        if operator is None: continue
+
+        expr = spec['sql']
+        if operator == 'is blank':
+            conditions.append(f"{expr} IS NULL"); continue
+        if operator == 'is not blank':
+            conditions.append(f"{expr} IS NOT NULL"); continue
+
+        name = f"filter_{i}"
+        value = _filter_value(match.group('value'))
+        if operator in ('contains', 'datestartswith'):
+            like = 'ILIKE' if case_insensitive else 'LIKE'
+            pattern = _like_escape(value)
+            params[name] = f"{pattern}%" if operator == 'datestartswith' else f"%{pattern}%"
+            conditions.append(f"CAST({expr} AS TEXT) {like} :{name}")
+        elif spec['type'] == 'number':
+            try: params[name] = float(value)
+            except ValueError:
+                conditions.append("FALSE"); continue # Igual que el filtro nativo: un número inválido no coincide con nada
+            conditions.append(f"{expr} {operator} :{name}")
+        else:
+            params[name] = value
+            if case_insensitive:
+                conditions.append(f"LOWER({expr}) {operator} LOWER(:{name})")
+            else:
+                conditions.append(f"{expr} {operator} :{name}")
+    return conditions
+
+def load_table_page(base_sql, params, columns, keyset, page_current=0, page_size=15,
+                    sort_by=None, filter_query=None, cursor=None, parse_dates=None):
+    """
+    Carga una página de un DataTable con filtro y orden en SQL.
+    keyset: {'column_id': columna de fecha visible, 'date': (expr, alias), 'id': (expr, alias)}.
+    Si el orden es por esa fecha (o no hay orden) y se recibe el cursor de la página anterior
+    [fecha ISO, id], se pagina por keyset: el costo no depende de cuántas páginas hay antes.
+    Cualquier otro orden usa LIMIT/OFFSET.
+    Devuelve (df, has_more, next_cursor); next_cursor es None fuera del modo keyset.
+    """
+    params = dict(params)
+    page_current = max(int(page_current or 0), 0)
+    page_size = max(int(page_size or 15), 1)
+    conditions = build_filter_sql(filter_query, columns, params)
+
+    sort_by = [s for s in (sort_by or []) if s.get('column_id') in columns]
+    date_expr, date_alias = keyset['date']
+    id_expr, id_alias = keyset['id']
+    use_keyset = not sort_by or (len(sort_by) == 1 and sort_by[0]['column_id'] == keyset['column_id'])
+
+    if use_keyset:
+        direction = 'ASC' if sort_by and sort_by[0].get('direction') == 'asc' else 'DESC'
+        order_sql = f"{date_expr} {direction}, {id_expr} {direction}"
+        if cursor and page_current > 0:
+            comparison = '>' if direction == 'ASC' else '<'
+            params["after_date"] = pd.to_datetime(cursor[0]).to_pydatetime()
+            params["after_id"] = int(cursor[1])
+            conditions.append(f"({date_expr}, {id_expr}) {comparison} (:after_date, :after_id)")
+            offset = 0
+        else:
+            offset = page_current * page_size
+    else:
+        order_sql = ", ".join(
+            f"{columns[s['column_id']].get('sort', columns[s['column_id']]['sql'])} {'ASC' if s.get('direction') == 'asc' else 'DESC'} NULLS LAST"
+            for s in sort_by
+        ) + f", {id_expr} DESC"
+        offset = page_current * page_size
+
+    sql = base_sql
+    if conditions:
+        sql += " AND " + " AND ".join(conditions)
+    # Se pide una fila de más para saber si existe una página siguiente sin hacer COUNT(*)
+    sql += f" ORDER BY {order_sql} LIMIT :limit OFFSET :offset"
+    params["limit"] = page_size + 1
+    params["offset"] = offset
+
+    df = pd.read_sql(text(sql), analytics_engine, params=params, parse_dates=parse_dates)
+    has_more = len(df) > page_size
+    df = df.iloc[:page_size]
+
+    next_cursor = None
+    if use_keyset and has_more:
+        last = df.iloc[-1]
+        next_cursor = [pd.Timestamp(last[date_alias]).isoformat(), int(last[id_alias])]
+    return df, has_more, next_cursor
+
+def prepare_page_cursors(cursors, page_current, sort_by, filter_query):
+    """
+    Normaliza el dcc.Store de cursores de una tabla paginada.
+    Los cursores solo valen para el mismo orden y filtro; si cambian se descartan
+    y se vuelve a la primera página. Devuelve (cursors, page_current).
+    """
+    cursors = cursors or {}
+    query_key = [sort_by or [], filter_query or '']
+    if cursors.get('query') != query_key:
+        return {'query': query_key, 'pages': {}}, 0
+    return cursors, page_current or 0
+
+SALES_TABLE_COLUMNS = {
+    'sale_id': {'sql': 's.sale_id', 'type': 'number'},
+    'category_name': {'sql': "COALESCE(c.name, 'Sin Categoría')", 'type': 'text'},
+    'product_name': {'sql': "COALESCE(p.name, 'Producto Eliminado')", 'type': 'text'},
+    'quantity': {'sql': 's.quantity', 'type': 'number'},
+    'total_amount': {'sql': 's.total_amount', 'type': 'number'},
+    'sale_date_display': {'sql': "to_char(s.sale_date, 'YYYY-MM-DD HH24:MI')", 'sort': 's.sale_date', 'type': 'text'},
+}
+
+def load_sales_page(user_id, page_current=0, page_size=15, sort_by=None, filter_query=None, cursor=None):
+    """Página del historial de ventas con nombres de producto y categoría (ver load_table_page)."""
+    base_sql = """
+        SELECT s.sale_id, s.product_id, s.quantity, s.total_amount, s.sale_date,
+               COALESCE(p.name, 'Producto Eliminado') AS product_name,
+               COALESCE(c.name, 'Sin Categoría') AS category_name
+        FROM sales s
+        LEFT JOIN products p ON s.product_id = p.product_id
+        LEFT JOIN categories c ON p.category_id = c.category_id
+        WHERE s.user_id = :user_id
+    """
+    keyset = {'column_id': 'sale_date_display', 'date': ('s.sale_date', 'sale_date'), 'id': ('s.sale_id', 'sale_id')}
+    return load_table_page(base_sql, {"user_id": int(user_id)}, SALES_TABLE_COLUMNS, keyset,
+                           page_current, page_size, sort_by, filter_query, cursor, parse_dates=['sale_date'])
+
+EXPENSES_TABLE_COLUMNS = {
+    'fecha_fmt': {'sql': "to_char(e.expense_date, 'YYYY-MM-DD')", 'sort': 'e.expense_date', 'type': 'text'},
+    'categoria': {'sql': "COALESCE(cat.name, 'Sin Categoría')", 'type': 'text'},
+    'concepto': {'sql': "COALESCE(con.name, 'Gasto Antiguo')", 'type': 'text'},
+    'amount': {'sql': 'e.amount', 'type': 'number'},
+}
+
+def load_expenses_page(user_id, page_current=0, page_size=15, sort_by=None, filter_query=None, cursor=None):
+    """Página del historial de gastos con concepto y categoría (ver load_table_page)."""
+    # Categoría: la del concepto, o la del gasto antiguo sin concepto (una fila por gasto)
+    base_sql = """
+        SELECT e.expense_id, e.amount, e.expense_date, e.expense_concept_id,
+               COALESCE(con.name, 'Gasto Antiguo') AS concepto,
+               COALESCE(cat.name, 'Sin Categoría') AS categoria
+        FROM expenses e
+        LEFT JOIN expense_concepts con ON e.expense_concept_id = con.concept_id
+        LEFT JOIN expense_categories cat ON cat.expense_category_id = COALESCE(con.expense_category_id, e.expense_category_id)
+        WHERE e.user_id = :user_id
+    """
+    keyset = {'column_id': 'fecha_fmt', 'date': ('e.expense_date', 'expense_date'), 'id': ('e.expense_id', 'expense_id')}
+    return load_table_page(base_sql, {"user_id": int(user_id)}, EXPENSES_TABLE_COLUMNS, keyset,
+                           page_current, page_size, sort_by, filter_query, cursor, parse_dates=['expense_date'])
+
+def get_sale(sale_id, user_id):
+    """Devuelve una venta (product_id, quantity, sale_date) o None si no existe."""
+    query = text("SELECT sale_id, product_id, quantity, sale_date FROM sales WHERE sale_id = :sale_id AND user_id = :user_id")
+    with engine.connect() as connection:
+        return connection.execute(query, {"sale_id": int(sale_id), "user_id": int(user_id)}).fetchone()
+
+
+# --- INGESTA MASIVA (COPY FROM STDIN) ---
+# Las importaciones de Excel envían todas las filas validadas en un solo COPY dentro de
+# una transacción (en vez de un INSERT por fila sobre SSL), junto con el recálculo de los
+# resúmenes diarios afectados y el cambio de versión de datos.
+SALES_INGEST_COLUMNS = ('product_id', 'quantity', 'total_amount', 'cogs_total', 'sale_date', 'user_id')
+EXPENSES_INGEST_COLUMNS = ('expense_concept_id', 'amount', 'expense_date', 'user_id')
+
+def copy_rows(connection, table, columns, df):
+    """Copia un DataFrame a la tabla con COPY ... FROM STDIN (CSV) usando la conexión de la transacción."""
+    buffer = io.StringIO()
+    # Celdas vacías (NaN/None) viajan como campo vacío sin comillas = NULL en COPY CSV
+    df.loc[:, list(columns)].to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d %H:%M:%S')
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+    # NO HAY COMMIT
+
+def _ingest_message(label, rows, elapsed):
+    rate = rows / elapsed if elapsed > 0 else float(rows)
+    return f"{rows} {label} importados en {elapsed:.2f}s ({rate:,.0f} filas/s)."
+
+def apply_stock_deductions(connection, user_id, quantities):
+    """
+    Descuenta stock de varios productos en UNA sentencia relativa (stock = stock - qty),
+    con guarda stock >= qty. Si algún producto no alcanza (p. ej. otra venta concurrente
+    se llevó el stock) lanza ValueError para deshacer la transacción completa.
+    """
+    quantities = {int(pid): int(qty) for pid, qty in quantities.items() if int(qty) > 0}
+    if not quantities: return
+    query = text("""
+        UPDATE products p SET stock = p.stock - d.qty
+        FROM unnest(CAST(:pids AS INTEGER[]), CAST(:qtys AS INTEGER[])) AS d(product_id, qty)
+        WHERE p.product_id = d.product_id AND p.user_id = :user_id AND p.stock >= d.qty
+    """)
+    updated = connection.execute(query, {"pids": list(quantities), "qtys": list(quantities.values()), "user_id": int(user_id)}).rowcount
+    if updated != len(quantities):
+        raise ValueError("Stock insuficiente: el inventario cambió durante la operación.")
+    bump_data_version(connection, user_id, 'products')
+    # NO HAY COMMIT
+
+def _ingest_chunks(table, columns, date_column, refresh_rollup, domain, label, chunks, user_id, progress=None, finalize=None):
+    """
+    Copia por tandas (DataFrames) dentro de UNA transacción: si el generador de tandas
+    lanza una excepción (p. ej. errores de validación o cancelación) no queda nada insertado.
+    progress(filas_copiadas) se llama después de cada tanda; finalize(connection) al final,
+    dentro de la misma transacción.
+    """
+    started = time.perf_counter()
+    total = 0
+    days = set()
+    try:
+        with engine.begin() as connection:
+            for rows in chunks:
+                if rows is None or len(rows) == 0: continue
+                df = pd.DataFrame(rows).assign(user_id=int(user_id))
+                copy_rows(connection, table, columns, df)
+                days.update(_normalize_days(df[date_column].unique()))
+                total += len(df)
+                if progress: progress(total)
+            if total:
+                refresh_rollup(connection, user_id, days)
+                bump_data_version(connection, user_id, domain)
+                if finalize: finalize(connection)
+    except Exception as e:
+        return False, f"Error importando {label}: {e}"
+    if not total: return False, f"No hay {label} para importar."
+    msg = _ingest_message(label, total, time.perf_counter() - started)
+    return True, msg
+
+def ingest_sales_chunks(chunks, user_id, progress=None, stock_deductions=None):
+    """
+    Como ingest_sales, pero recibe un iterable de tandas (importación en streaming).
+    stock_deductions: {product_id: cantidad} a descontar en la misma transacción; se lee
+    al terminar las tandas, así que puede ser el dict que la validación va llenando.
+    """
+    finalize = None
+    if stock_deductions is not None:
+        finalize = lambda connection: apply_stock_deductions(connection, user_id, stock_deductions)
+    return _ingest_chunks('sales', SALES_INGEST_COLUMNS, 'sale_date', refresh_sales_rollup, 'sales', "ventas",
+                          chunks, user_id, progress, finalize)
+
+def ingest_expenses_chunks(chunks, user_id, progress=None):
+    """Como ingest_expenses, pero recibe un iterable de tandas (importación en streaming)."""
+    return _ingest_chunks('expenses', EXPENSES_INGEST_COLUMNS, 'expense_date', refresh_expense_rollup, 'expenses', "gastos", chunks, user_id, progress)
+
+def ingest_sales(rows, user_id):
+    """
+    Inserta ventas ya validadas (product_id, quantity, total_amount, cogs_total, sale_date)
+    con COPY en una sola transacción. Devuelve (success, msg) con filas por segundo.
+    """
+    return ingest_sales_chunks([rows], user_id)
+
+def ingest_expenses(rows, user_id):
+    """
+    Inserta gastos ya validados (expense_concept_id, amount, expense_date)
+    con COPY en una sola transacción. Devuelve (success, msg) con filas por segundo.
+    """
+    return ingest_expenses_chunks([rows], user_id)
+
+
+# --- TRABAJOS DE IMPORTACIÓN EN SEGUNDO PLANO (tabla import_jobs) ---
+IMPORT_JOB_FIELDS = ('status', 'rows_validated', 'rows_inserted', 'success', 'level', 'message', 'errors')
+IMPORT_JOB_ACTIVE = ('queued', 'running')
+IMPORT_JOB_STALE_MINUTES = 10 # Sin latido por más que esto: el proceso dueño ya no existe
+
+def create_import_job(user_id, kind, filename, idempotency_key=None, worker_id=None):
+    """
+    Registra un trabajo de importación en cola a nombre del proceso worker_id. Devuelve
+    (job_id, created): si la clave de idempotencia ya existe (el navegador reintentó la
+    subida) devuelve el trabajo existente.
+    """
+    params = {"user_id": int(user_id), "kind": kind, "filename": filename, "idempotency_key": idempotency_key, "worker_id": worker_id}
+    query = text("""
+        INSERT INTO import_jobs (user_id, kind, filename, idempotency_key, worker_id)
+        VALUES (:user_id, :kind, :filename, :idempotency_key, :worker_id)
+        ON CONFLICT (user_id, idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+        RETURNING job_id
+    """)
+    with engine.begin() as connection:
+        job_id = connection.execute(query, params).scalar()
+        if job_id is not None: return job_id, True
+        existing = connection.execute(text("SELECT job_id FROM import_jobs WHERE user_id = :user_id AND idempotency_key = :idempotency_key"), params).scalar()
+        return existing, False
+
+def update_import_job(job_id, **fields):
+    """Actualiza estado/progreso/resultado de un trabajo (solo columnas de IMPORT_JOB_FIELDS)."""
+    fields = {k: v for k, v in fields.items() if k in IMPORT_JOB_FIELDS}
+    if not fields: return
+    if 'errors' in fields:
+        fields['errors'] = json.dumps(fields['errors'] or [])
+    assignments = ", ".join(f"{column} = :{column}" for column in fields)
+    with engine.begin() as connection:
+        connection.execute(text(f"UPDATE import_jobs SET {assignments}, updated_at = NOW() WHERE job_id = :job_id"),
+                           {**fields, "job_id": int(job_id)})
+
+def get_import_job(job_id, user_id):
+    """Estado de un trabajo del usuario como dict, o None si no existe."""
+    query = text("""
+        SELECT job_id, kind, filename, status, rows_validated, rows_inserted, cancel_requested,
+               success, level, message, errors
+        FROM import_jobs WHERE job_id = :job_id AND user_id = :user_id
+    """)
+    with engine.connect() as connection:
+        row = connection.execute(query, {"job_id": int(job_id), "user_id": int(user_id)}).mappings().fetchone()
+    if row is None: return None
+    job = dict(row)
+    job['errors'] = json.loads(job['errors']) if job['errors'] else []
+    return job
+
+def request_import_job_cancel(job_id, user_id):
+    """Marca un trabajo activo para cancelación. El trabajo se detiene en la siguiente tanda."""
+    query = text("""
+        UPDATE import_jobs SET cancel_requested = TRUE, updated_at = NOW()
+        WHERE job_id = :job_id AND user_id = :user_id AND status = ANY(:active)
+    """)
+    with engine.begin() as connection:
+        result = connection.execute(query, {"job_id": int(job_id), "user_id": int(user_id), "active": list(IMPORT_JOB_ACTIVE)})
+    return result.rowcount == 1
+
+def import_job_cancel_requested(job_id):
+    query = text("SELECT cancel_requested FROM import_jobs WHERE job_id = :job_id")
+    with engine.connect() as connection:
+        return bool(connection.execute(query, {"job_id": int(job_id)}).scalar())
+
+def touch_import_jobs(worker_id):
+    """Latido: renueva updated_at de los trabajos en cola o en curso de este proceso."""
+    query = text("UPDATE import_jobs SET updated_at = NOW() WHERE worker_id = :worker_id AND status = ANY(:active)")
+    with engine.begin() as connection:
+        return connection.execute(query, {"worker_id": worker_id, "active": list(IMPORT_JOB_ACTIVE)}).rowcount
+
+def fail_interrupted_import_jobs(worker_id):
+    """
+    Al arrancar el proceso: marca como fallidos los trabajos 'queued'/'running' de OTROS procesos
+    que dejaron de latir (ver touch_import_jobs). Los procesos vivos renuevan los suyos cada minuto,
+    así que solo quedan los de un proceso que se reinició o murió.
+    """
+    query = text("""
+        UPDATE import_jobs SET status = 'failed', success = FALSE, level = 'danger',
+               message = 'La importación se interrumpió (reinicio del servidor). Vuelve a subir el archivo.',
+               updated_at = NOW()
+        WHERE status = ANY(:active) AND worker_id IS DISTINCT FROM :worker_id
+          AND updated_at < NOW() - make_interval(mins => :stale_minutes)
+    """)
+    params = {"active": list(IMPORT_JOB_ACTIVE), "worker_id": worker_id, "stale_minutes": IMPORT_JOB_STALE_MINUTES}
+    with engine.begin() as connection:
+        return connection.execute(query, params).rowcount
+
+
+# --- API POS: TOKENS E IDEMPOTENCIA ---
+# Las terminales POS envían lotes de ventas por /api/pos/sales con un token Bearer.
+# Cada línea trae una idempotency_key propia: reenviar un lote (reintento por red) no duplica ventas.
+POS_MAX_LINES = 500
+_api_token_cache = LRUCache(max_entries=1024, ttl=60) # token -> user_id (un revocado deja de valer en <= 60s)
+
+def _token_hash(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def create_api_token(user_id, name=None):
+    """Crea un token de API para el usuario. Solo se guarda su hash: el texto se muestra una vez."""
+    token = secrets.token_urlsafe(32)
+    query = text("INSERT INTO api_tokens (token_hash, user_id, name) VALUES (:token_hash, :user_id, :name)")
+    with engine.begin() as connection:
+        connection.execute(query, {"token_hash": _token_hash(token), "user_id": int(user_id), "name": name})
+    return token
+
+def revoke_api_tokens(user_id):
+    """Elimina todos los tokens de API del usuario."""
+    with engine.begin() as connection:
+        deleted = connection.execute(text("DELETE FROM api_tokens WHERE user_id = :user_id"), {"user_id": int(user_id)}).rowcount
+    _api_token_cache.clear()
+    return deleted
+
+def get_api_token_user(token):
+    """user_id dueño de un token válido (usuario no bloqueado y con suscripción vigente), o None."""
+    if not token: return None
+    token_hash = _token_hash(token)
+    hit, user_id = _api_token_cache.get(token_hash)
+    if hit: return user_id
+    query = text("""
+        SELECT t.user_id FROM api_tokens t
+        JOIN users u ON u.id = t.user_id
+        WHERE t.token_hash = :token_hash AND NOT u.is_blocked
+          AND (u.subscription_end_date IS NULL OR u.subscription_end_date >= CURRENT_DATE)
+    """)
+    with engine.connect() as connection:
+        user_id = connection.execute(query, {"token_hash": token_hash}).scalar()
+    _api_token_cache.set(token_hash, user_id) # También los inválidos: no golpean la base en cada intento
+    return user_id
+
+@versioned_cache('pos_catalog', 'products')
+def load_pos_catalog(user_id):
+    """{product_id: is_active} del usuario, sin DataFrames (validación rápida del API POS)."""
+    query = text("SELECT product_id, is_active FROM products WHERE user_id = :user_id")
+    with engine.connect() as connection:
+        rows = connection.execute(query, {"user_id": int(user_id)}).fetchall()
+    return {row.product_id: bool(row.is_active) for row in rows}
+
+def _pos_line(line, seen, now):
+    """Valida una línea del lote. Devuelve (key, product_id, quantity, sale_date) o un mensaje de error."""
+    if not isinstance(line, dict): return "Línea inválida."
+    key = line.get('idempotency_key')
+    if not isinstance(key, str) or not key.strip() or len(key) > 100:
+        return "idempotency_key requerido (texto de hasta 100 caracteres)."
+    if key in seen: return "idempotency_key repetido en el lote."
+    seen.add(key)
+    try:
+        product_id = int(line.get('product_id'))
+        quantity = int(line.get('quantity'))
+        sale_date = datetime.fromisoformat(line['sale_date']) if line.get('sale_date') else now
+    except (TypeError, ValueError):
+        return "product_id, quantity o sale_date inválidos."
+    if quantity <= 0: return "La cantidad debe ser mayor a cero."
+    if sale_date.tzinfo is not None:
+        sale_date = sale_date.astimezone().replace(tzinfo=None) # A la hora local del servidor, como datetime.now()
+    return key, product_id, quantity, sale_date
+
+def record_pos_sales(lines, user_id):
+    """
+    Registra un lote de ventas del API POS en UNA transacción, sin DataFrames.
+    Cada línea: {'idempotency_key', 'product_id', 'quantity', 'sale_date' (ISO, opcional)}.
+    Devuelve un resultado por línea, en el mismo orden:
+      {'idempotency_key', 'status': 'created' | 'duplicate' | 'rejected', 'sale_id'?, 'error'?}.
+    Las líneas se aceptan en orden mientras alcance el stock; las que no, se rechazan solas.
+    """
+    catalog = load_pos_catalog(user_id)
+    now = datetime.now()
+    seen = set()
+    results, pending = [], []
+    for index, line in enumerate(lines):
+        key = line.get('idempotency_key') if isinstance(line, dict) else None
+        results.append({'idempotency_key': key})
+        parsed = _pos_line(line, seen, now)
+        if isinstance(parsed, str):
+            results[index].update(status='rejected', error=parsed); continue
+        if not catalog.get(parsed[1]):
+            results[index].update(status='rejected', error="Producto no encontrado o inactivo."); continue
+        pending.append((index,) + parsed)
+    if not pending: return results
+
+    with engine.begin() as connection:
+        existing = dict(connection.execute(
+            text("SELECT idempotency_key, sale_id FROM sales WHERE user_id = :user_id AND idempotency_key = ANY(:keys)"),
+            {"user_id": int(user_id), "keys": [entry[1] for entry in pending]}
+        ).fetchall())
+        new = []
+        for entry in pending:
+            if entry[1] in existing: results[entry[0]].update(status='duplicate', sale_id=existing[entry[1]])
+            else: new.append(entry)
+        if not new: return results
+
+        # Bloqueo en orden de product_id y asignación de stock línea por línea
+        stock = dict(connection.execute(text("""
+            SELECT product_id, COALESCE(stock, 0) AS stock FROM products
+            WHERE user_id = :user_id AND product_id = ANY(:pids)
+            ORDER BY product_id
+            FOR UPDATE
+        """), {"user_id": int(user_id), "pids": sorted({entry[2] for entry in new})}).fetchall())
+        accepted = []
+        for entry in new:
+            index, key, product_id, quantity, sale_date = entry
+            available = stock.get(product_id, 0)
+            if available < quantity:
+                results[index].update(status='rejected', error=f"Stock insuficiente. Solo quedan {available}."); continue
+            stock[product_id] = available - quantity
+            accepted.append(entry)
+        if not accepted: return results
+
+        # ON CONFLICT cubre el caso de dos lotes concurrentes con la misma clave
+        inserted = connection.execute(text("""
+            INSERT INTO sales (product_id, quantity, total_amount, cogs_total, sale_date, user_id, idempotency_key)
+            SELECT p.product_id, l.qty, p.price * l.qty, p.cost * l.qty, l.sale_date, :user_id, l.idempotency_key
+            FROM unnest(CAST(:pids AS INTEGER[]), CAST(:qtys AS INTEGER[]), CAST(:dates AS TIMESTAMP[]), CAST(:keys AS TEXT[]))
+                 WITH ORDINALITY AS l(product_id, qty, sale_date, idempotency_key, line)
+            JOIN products p ON p.product_id = l.product_id AND p.user_id = :user_id
+            ORDER BY l.line
+            ON CONFLICT (user_id, idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+            RETURNING sale_id, idempotency_key
+        """), {
+            "user_id": int(user_id),
+            "pids": [entry[2] for entry in accepted], "qtys": [entry[3] for entry in accepted],
+            "dates": [entry[4] for entry in accepted], "keys": [entry[1] for entry in accepted],
+        }).fetchall()
+        inserted = dict((row.idempotency_key, row.sale_id) for row in inserted)
+
+        totals, days = {}, []
+        for index, key, product_id, quantity, sale_date in accepted:
+            if key in inserted:
+                results[index].update(status='created', sale_id=inserted[key])
+                totals[product_id] = totals.get(product_id, 0) + quantity
+                days.append(sale_date)
+            else:
+                results[index].update(status='duplicate')
+        if totals:
+            apply_stock_deductions(connection, user_id, totals)
+            refresh_sales_rollup(connection, user_id, days)
+            bump_data_version(connection, user_id, 'sales')
+    return results
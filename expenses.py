@@ -1,12 +1,10 @@
 # expenses.py
 from dash import dcc, html, dash_table
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 from dash.exceptions import PreventUpdate
 from dash.dash_table.Format import Format, Scheme
 import pandas as pd
-import base64
-import io
 import dash
 from flask_login import current_user
 from datetime import datetime
@@ -14,18 +12,25 @@ from sqlalchemy import text
 
 from app import app
 from database import (
-    load_expenses_detailed, load_expense_categories, get_expense_category_options,
-    add_expense_category_strict, add_expense_concept, get_expense_concept_options,
+    load_expenses_page, prepare_page_cursors, load_expense_categories, get_expense_category_options,
+    add_expense, add_expense_category_strict, add_expense_concept, get_expense_concept_options,
     load_expense_concepts, delete_expense_concept, delete_expense, delete_expense_category,
-    delete_expenses_bulk, engine,
-    update_expense_concept, update_expense_category_strict
+    delete_expenses_bulk, refresh_expense_rollup, bump_data_version, engine,
+    update_expense_concept, update_expense_category_strict,
+    get_import_job, request_import_job_cancel
 )
+from signals import signal_inputs, signal_output, signal_state, SIGNAL_STORES
 
 def get_layout():
     return html.Div([
         # --- STORES ---
         dcc.Store(id='store-expense-id-to-delete'),
         dcc.Store(id='store-expense-id-to-edit'),
+        dcc.Store(id='store-expense-history-cursors'), # Cursores keyset por página del historial
+        dcc.Store(id='store-upload-expenses-result'), # Respuesta de /api/import/expenses
+        dcc.Store(id='store-upload-expenses-job'), # Trabajo de importación en curso
+        dcc.Store(id='store-expense-idempotency-key'), # Clave del próximo gasto a registrar
+        dcc.Interval(id='interval-upload-expenses', interval=1000, disabled=True),
         dcc.Store(id='store-concept-id-to-delete'),
         dcc.Store(id='store-concept-id-to-edit'),
         dcc.Store(id='store-exp-cat-id-to-delete'),
@@ -146,11 +151,12 @@ def get_layout():
                                     'borderWidth': '1px', 'borderStyle': 'dashed',
                                     'borderRadius': '5px', 'textAlign': 'center', 'margin': '10px 0'
                                 },
+                                accept='.xlsx,.csv',
                                 multiple=False
                             ),
                             dbc.Alert([
                                 html.H5("Formato Requerido:", className="alert-heading"),
-                                html.P("El archivo Excel debe tener las siguientes columnas:"),
+                                html.P("El archivo Excel (.xlsx) o CSV debe tener las siguientes columnas:"),
                                 html.Ul([
                                     html.Li([html.B("categoria"), " (Ej: 'Transporte')"]),
                                     html.Li([html.B("concepto"), " (Ej: 'Uber')"]),
@@ -158,6 +164,7 @@ def get_layout():
                                     html.Li([html.B("fecha"), " (Formato AAAA-MM-DD)"]),
                                 ]),
                             ], color="info", className="mt-2 small"),
+                            html.Div(id='upload-expenses-progress'),
                             html.Div(id='upload-expenses-output')
                         ],
                         title="Importar Historial de Gastos desde Excel"
@@ -186,7 +193,9 @@ def get_layout():
                             {"name": "Eliminar", "id": "eliminar"}
                         ],
                         data=[], page_size=15, row_selectable='multi', selected_rows=[],
-                        sort_action='native', filter_action='native',
+                        page_current=0, page_action='custom',
+                        sort_action='custom', sort_mode='single', filter_action='custom', filter_query='',
+                        sort_by=[{'column_id': 'fecha_fmt', 'direction': 'desc'}],
                         style_table={'overflowX': 'auto'},
                         style_cell={'textAlign': 'left', 'minWidth': '100px'},
                         style_cell_conditional=[
@@ -274,114 +283,153 @@ def register_callbacks(app):
     
     # --- 1. CARGA DE DATOS ---
     @app.callback(
-        Output('table-expenses-history', 'data'),
-        Output('table-concepts', 'data'),
-        Output('table-categories', 'data'),
         Output('dropdown-expense-concepts', 'options'),
         Output('dropdown-parent-category', 'options'),
         # Ahora 'dropdown-edit-concept' se llena desde aquí con TODOS los conceptos
         Output('dropdown-edit-concept', 'options'), 
         Output('dropdown-edit-con-cat', 'options'), 
-        [Input('expense-tabs', 'active_tab'), Input('store-data-signal', 'data')]
+        [Input('expense-tabs', 'active_tab'), *signal_inputs('expenses')]
     )
-    def refresh_data(tab, signal):
+    def refresh_data(tab, *signals):
         if not current_user.is_authenticated: raise PreventUpdate
         uid = int(current_user.id)
-        
-        expenses = load_expenses_detailed(uid)
+
+        concept_opts = get_expense_concept_options(uid)
+        cat_opts = get_expense_category_options(uid)
+
+        # Enviamos concept_opts a 'dropdown-edit-concept' también
+        return concept_opts, cat_opts, concept_opts, cat_opts
+
+    # --- 1b. HISTORIAL PAGINADO EN SERVIDOR (solo la página visible) ---
+    @app.callback(
+        Output('table-expenses-history', 'data'),
+        Output('table-expenses-history', 'page_count'),
+        Output('table-expenses-history', 'page_current'),
+        Output('store-expense-history-cursors', 'data'),
+        [Input('expense-tabs', 'active_tab'),
+         Input('table-expenses-history', 'page_current'),
+         Input('table-expenses-history', 'page_size'),
+         Input('table-expenses-history', 'sort_by'),
+         Input('table-expenses-history', 'filter_query'),
+         *signal_inputs('expenses')],
+        State('store-expense-history-cursors', 'data')
+    )
+    def refresh_expense_history(tab, page_current, page_size, sort_by, filter_query, *args):
+        if not current_user.is_authenticated or tab != 'tab-history': raise PreventUpdate
+        cursors, page_current = prepare_page_cursors(args[-1], page_current, sort_by, filter_query)
+
+        uid = int(current_user.id)
+        expenses, has_more, next_cursor = load_expenses_page(
+            uid, page_current, page_size, sort_by, filter_query,
+            cursor=cursors['pages'].get(str(page_current))
+        )
+        if next_cursor:
+            cursors['pages'][str(page_current + 1)] = next_cursor
+
         expenses['fecha_fmt'] = expenses['expense_date'].dt.strftime('%Y-%m-%d')
         expenses['eliminar'] = "🗑️"
         expenses['editar'] = "✏️"
         expenses['id'] = expenses['expense_id']
 
-        concepts = load_expense_concepts(uid)
+        # Sin COUNT(*): se habilita la página siguiente solo si existe
+        page_count = page_current + (2 if has_more else 1)
+        return expenses.to_dict('records'), page_count, page_current, cursors
+
+    # --- 1c. TABLAS DE CONCEPTOS Y CATEGORÍAS (solo con su pestaña activa) ---
+    @app.callback(
+        Output('table-concepts', 'data'),
+        [Input('expense-tabs', 'active_tab'), *signal_inputs('expenses')]
+    )
+    def refresh_concepts_table(tab, *signals):
+        if not current_user.is_authenticated or tab != 'tab-create-concept': raise PreventUpdate
+        concepts = load_expense_concepts(int(current_user.id))
         concepts['eliminar'] = "🗑️"
         concepts['editar'] = "✏️"
         concepts['id'] = concepts['concept_id']
+        return concepts.to_dict('records')
 
-        cats = load_expense_categories(uid)
+    @app.callback(
+        Output('table-categories', 'data'),
+        [Input('expense-tabs', 'active_tab'), *signal_inputs('expenses')]
+    )
+    def refresh_categories_table(tab, *signals):
+        if not current_user.is_authenticated or tab != 'tab-create-category': raise PreventUpdate
+        cats = load_expense_categories(int(current_user.id))
         active_cats = cats[cats['is_active']==True].copy() if not cats.empty and 'is_active' in cats.columns else cats
         active_cats['eliminar'] = "🗑️"
         active_cats['editar'] = "✏️"
         active_cats['id'] = active_cats['expense_category_id']
-
-        concept_opts = get_expense_concept_options(uid)
-        cat_opts = get_expense_category_options(uid)
-
-        # Enviamos concept_opts a 'dropdown-edit-concept' también
-        return (expenses.to_dict('records'), concepts.to_dict('records'), active_cats.to_dict('records'),
-                concept_opts, cat_opts, concept_opts, cat_opts)
+        return active_cats.to_dict('records')
 
     # --- 2. UPLOAD EXCEL (CON CATEGORÍA) ---
+    # El navegador envía el archivo a /api/import/expenses (ver api.py y assets/uploads.js),
+    # que encola un trabajo en segundo plano; aquí se consulta su progreso con un dcc.Interval.
+    app.clientside_callback(
+        ClientsideFunction(namespace='uploads', function_name='expenses'),
+        Output('store-upload-expenses-result', 'data'),
+        Output('upload-expenses-data', 'contents'),
+        Input('upload-expenses-data', 'contents'),
+        State('upload-expenses-data', 'filename'),
+        prevent_initial_call=True
+    )
+
     @app.callback(
         Output('upload-expenses-output', 'children'),
-        Output('store-data-signal', 'data', allow_duplicate=True),
-        Input('upload-expenses-data', 'contents'),
-        [State('upload-expenses-data', 'filename'), State('store-data-signal', 'data')],
+        Output('upload-expenses-progress', 'children'),
+        Output('interval-upload-expenses', 'disabled'),
+        Output('store-upload-expenses-job', 'data'),
+        signal_output('expenses'),
+        [Input('store-upload-expenses-result', 'data'),
+         Input('interval-upload-expenses', 'n_intervals')],
+        [State('store-upload-expenses-job', 'data'),
+         signal_state('expenses')],
         prevent_initial_call=True
     )
-    def upload_expenses(contents, filename, signal):
-        if not current_user.is_authenticated or not contents: raise PreventUpdate
-        uid = int(current_user.id)
-        content_type, content_string = contents.split(',')
-        decoded = base64.b64decode(content_string)
-        
-        try:
-            if 'xls' in filename: df = pd.read_excel(io.BytesIO(decoded))
-            else: return dbc.Alert("Formato incorrecto. Usa .xlsx", color="danger"), dash.no_update
-        except Exception as e: return dbc.Alert(f"Error leyendo archivo: {e}", color="danger"), dash.no_update
-
-        df.columns = [c.lower().strip() for c in df.columns]
-        required = ['categoria', 'concepto', 'monto', 'fecha']
-        missing = [col for col in required if col not in df.columns]
-        
-        if missing:
-            return dbc.Alert(f"Faltan columnas: {', '.join(missing)}.", color="danger"), dash.no_update
-
-        existing_concepts = load_expense_concepts(uid)
-        concept_map = {}
-        if not existing_concepts.empty:
-            for _, row in existing_concepts.iterrows():
-                key = (str(row['category_name']).strip().lower(), str(row['concept_name']).strip().lower())
-                concept_map[key] = row['concept_id']
-        
-        expenses_to_insert = []
-        errors = []
-
-        for i, row in df.iterrows():
-            cat_name = str(row['categoria']).strip()
-            con_name = str(row['concepto']).strip()
-            key = (cat_name.lower(), con_name.lower())
-            
-            if key in concept_map:
-                cid = concept_map[key]
-            else:
-                errors.append(f"Fila {i+2}: Concepto '{con_name}' en categoría '{cat_name}' no existe.")
-                continue
-            
-            try:
-                amt = float(row['monto'])
-                if amt <= 0: raise ValueError
-                dt = pd.to_datetime(row['fecha']).to_pydatetime()
-            except:
-                errors.append(f"Fila {i+2}: Monto o fecha inválidos.")
-                continue
-                
-            expenses_to_insert.append({'expense_concept_id': cid, 'amount': amt, 'expense_date': dt, 'user_id': uid})
+    def upload_expenses(result, n_intervals, job_id, signal):
+        """Sigue el trabajo en segundo plano (import_jobs) hasta que termina."""
+        if not current_user.is_authenticated: raise PreventUpdate
+        if dash.callback_context.triggered_id == 'store-upload-expenses-result':
+            if not result: raise PreventUpdate
+            if not result.get('job_id'): # Rechazado al subir (formato, sesión...)
+                return dbc.Alert(result['message'], color=result['level']), None, True, None, dash.no_update
+            job_id = result['job_id']
+        if not job_id: raise PreventUpdate
+
+        job = get_import_job(job_id, int(current_user.id))
+        if job is None:
+            return None, None, True, None, dash.no_update
+
+        if job['status'] in ('queued', 'running'):
+            label = f"Validadas: {job['rows_validated']} filas · Insertadas: {job['rows_inserted']}"
+            progress = html.Div([
+                dbc.Progress(value=100, striped=True, animated=True, label=label, className="mb-2"),
+                dbc.Button("Cancelar importación", id='cancel-upload-expenses', color="secondary", size="sm",
+                           disabled=job['cancel_requested'])
+            ])
+            return None, progress, False, job_id, dash.no_update
 
-        if errors:
-            return dbc.Alert([html.H5("Errores en la importación:")] + [html.P(e) for e in errors[:10]], color="danger"), dash.no_update
+        if job['errors']:
+            children = [html.H5(job['message'])] + [html.P(e) for e in job['errors']]
+        else:
+            children = job['message']
+        new_signal = (signal or 0) + 1 if job['success'] else dash.no_update
+        return dbc.Alert(children, color=job['level'] or "danger"), None, True, None, new_signal
 
-        if expenses_to_insert:
-            pd.DataFrame(expenses_to_insert).to_sql('expenses', engine, if_exists='append', index=False)
-            return dbc.Alert(f"¡Éxito! {len(expenses_to_insert)} gastos importados.", color="success"), (signal or 0) + 1
-        
-        return dbc.Alert("No se encontraron datos válidos.", color="warning"), dash.no_update
+    @app.callback(
+        Output('cancel-upload-expenses', 'disabled'),
+        Input('cancel-upload-expenses', 'n_clicks'),
+        State('store-upload-expenses-job', 'data'),
+        prevent_initial_call=True
+    )
+    def cancel_expenses_import(n, job_id):
+        if not n or not job_id or not current_user.is_authenticated: raise PreventUpdate
+        request_import_job_cancel(job_id, int(current_user.id))
+        return True
 
     # --- 3. CRUD (Create) ---
     @app.callback(
-        Output('alert-add-category', 'children'), Output('input-category-name', 'value'), Output('store-data-signal', 'data', allow_duplicate=True),
-        Input('btn-save-category', 'n_clicks'), State('input-category-name', 'value'), State('store-data-signal', 'data'), prevent_initial_call=True
+        Output('alert-add-category', 'children'), Output('input-category-name', 'value'), signal_output('expenses'),
+        Input('btn-save-category', 'n_clicks'), State('input-category-name', 'value'), signal_state('expenses'), prevent_initial_call=True
     )
     def save_cat(n, name, signal):
         if n is None or n == 0: raise PreventUpdate 
@@ -392,8 +440,8 @@ def register_callbacks(app):
         except Exception as e: return dbc.Alert(f"Error: {e}", color="danger"), dash.no_update, dash.no_update
 
     @app.callback(
-        Output('alert-add-concept', 'children'), Output('input-concept-name', 'value'), Output('dropdown-parent-category', 'value'), Output('store-data-signal', 'data', allow_duplicate=True),
-        Input('btn-save-concept', 'n_clicks'), [State('input-concept-name', 'value'), State('dropdown-parent-category', 'value'), State('store-data-signal', 'data')], prevent_initial_call=True
+        Output('alert-add-concept', 'children'), Output('input-concept-name', 'value'), Output('dropdown-parent-category', 'value'), signal_output('expenses'),
+        Input('btn-save-concept', 'n_clicks'), [State('input-concept-name', 'value'), State('dropdown-parent-category', 'value'), signal_state('expenses')], prevent_initial_call=True
     )
     def save_con(n, name, cat_id, signal):
         if not n: raise PreventUpdate
@@ -404,21 +452,27 @@ def register_callbacks(app):
             return dbc.Alert(msg, color="success" if success else "danger", dismissable=True), "" if success else dash.no_update, dash.no_update, (signal or 0)+1 if success else dash.no_update
         except Exception as e: return dbc.Alert(f"Error: {e}", color="danger"), dash.no_update, dash.no_update, dash.no_update
 
+    # Clave de idempotencia del navegador: nueva al cargar y después de cada gasto registrado
+    app.clientside_callback(
+        ClientsideFunction(namespace='idempotency', function_name='fresh'),
+        Output('store-expense-idempotency-key', 'data'),
+        Input(SIGNAL_STORES['expenses'], 'data')
+    )
+
     @app.callback(
-        Output('alert-add-expense', 'children'), Output('input-expense-amount', 'value'), Output('dropdown-expense-concepts', 'value'), Output('store-data-signal', 'data', allow_duplicate=True),
-        Input('btn-save-expense', 'n_clicks'), [State('dropdown-expense-concepts', 'value'), State('input-expense-amount', 'value'), State('store-data-signal', 'data')], prevent_initial_call=True
+        Output('alert-add-expense', 'children'), Output('input-expense-amount', 'value'), Output('dropdown-expense-concepts', 'value'), signal_output('expenses'),
+        Input('btn-save-expense', 'n_clicks'), [State('dropdown-expense-concepts', 'value'), State('input-expense-amount', 'value'), State('store-expense-idempotency-key', 'data'), signal_state('expenses')], prevent_initial_call=True
     )
-    def save_exp(n, con_id, amt, signal):
+    def save_exp(n, con_id, amt, idempotency_key, signal):
         if not n: raise PreventUpdate
         if not con_id: return dbc.Alert("Falta Concepto.", color="warning"), dash.no_update, dash.no_update, dash.no_update
         try:
             val = float(amt)
             if val <= 0: raise ValueError
         except: return dbc.Alert("Monto inválido.", color="danger"), dash.no_update, dash.no_update, dash.no_update
-        try:
-            pd.DataFrame([{'expense_concept_id': int(con_id), 'amount': val, 'expense_date': datetime.now(), 'user_id': int(current_user.id)}]).to_sql('expenses', engine, if_exists='append', index=False)
-            return dbc.Alert("Gasto registrado.", color="success", duration=3000), "", None, (signal or 0)+1
-        except Exception as e: return dbc.Alert(f"Error: {e}", color="danger"), dash.no_update, dash.no_update, dash.no_update
+        success, msg = add_expense(con_id, val, int(current_user.id), idempotency_key=idempotency_key)
+        if not success: return dbc.Alert(msg, color="danger"), dash.no_update, dash.no_update, dash.no_update
+        return dbc.Alert(msg, color="success", duration=3000), "", None, (signal or 0)+1
 
     # --- 4. MODALES ACCIÓN (Row ID) ---
     @app.callback(
@@ -480,25 +534,30 @@ def register_callbacks(app):
 
     # --- 5. GUARDAR EDICIONES (Updates) ---
     @app.callback(
-        Output('modal-edit-exp', 'is_open', allow_duplicate=True), Output('store-data-signal', 'data', allow_duplicate=True), Output('alert-edit-expense', 'children'),
+        Output('modal-edit-exp', 'is_open', allow_duplicate=True), signal_output('expenses'), Output('alert-edit-expense', 'children'),
         Input('save-edit-exp', 'n_clicks'),
-        [State('store-expense-id-to-edit', 'data'), State('dropdown-edit-concept', 'value'), State('input-edit-amount', 'value'), State('date-edit-expense', 'date'), State('store-data-signal', 'data')],
+        [State('store-expense-id-to-edit', 'data'), State('dropdown-edit-concept', 'value'), State('input-edit-amount', 'value'), State('date-edit-expense', 'date'), signal_state('expenses')],
         prevent_initial_call=True
     )
     def save_edit_exp(n, eid, cid, amt, dt, sig):
         if not n or not eid: raise PreventUpdate
         if not cid or not amt or not dt: return True, dash.no_update, dbc.Alert("Datos incompletos.", color="danger")
         try:
+            uid = int(current_user.id)
             with engine.connect() as connection:
                 with connection.begin():
-                    connection.execute(text("UPDATE expenses SET expense_concept_id=:cid, amount=:amt, expense_date=:dt WHERE expense_id=:eid"), {"cid":cid, "amt":amt, "dt":dt, "eid":eid})
+                    old_dt = connection.execute(text("SELECT expense_date FROM expenses WHERE expense_id=:eid AND user_id=:uid"), {"eid":eid, "uid":uid}).scalar()
+                    connection.execute(text("UPDATE expenses SET expense_concept_id=:cid, amount=:amt, expense_date=:dt WHERE expense_id=:eid AND user_id=:uid"), {"cid":cid, "amt":amt, "dt":dt, "eid":eid, "uid":uid})
+                    # Recalcular el día original y el nuevo
+                    refresh_expense_rollup(connection, uid, [old_dt, dt])
+                    bump_data_version(connection, uid, 'expenses')
             return False, (sig or 0)+1, None
         except Exception as e: return True, dash.no_update, dbc.Alert(f"Error: {e}", color="danger")
 
     @app.callback(
-        Output('modal-edit-con', 'is_open', allow_duplicate=True), Output('store-data-signal', 'data', allow_duplicate=True), Output('alert-edit-concept', 'children'),
+        Output('modal-edit-con', 'is_open', allow_duplicate=True), signal_output('expenses'), Output('alert-edit-concept', 'children'),
         Input('save-edit-con', 'n_clicks'),
-        [State('store-concept-id-to-edit', 'data'), State('input-edit-con-name', 'value'), State('dropdown-edit-con-cat', 'value'), State('store-data-signal', 'data')], prevent_initial_call=True
+        [State('store-concept-id-to-edit', 'data'), State('input-edit-con-name', 'value'), State('dropdown-edit-con-cat', 'value'), signal_state('expenses')], prevent_initial_call=True
     )
     def save_edit_con(n, cid, name, cat_id, sig):
         if not n or not cid: raise PreventUpdate
@@ -508,9 +567,9 @@ def register_callbacks(app):
         except Exception as e: return True, dash.no_update, dbc.Alert(str(e), color="danger")
 
     @app.callback(
-        Output('modal-edit-cat', 'is_open', allow_duplicate=True), Output('store-data-signal', 'data', allow_duplicate=True), Output('alert-edit-cat', 'children'),
+        Output('modal-edit-cat', 'is_open', allow_duplicate=True), signal_output('expenses'), Output('alert-edit-cat', 'children'),
         Input('save-edit-cat', 'n_clicks'),
-        [State('store-exp-cat-id-to-edit', 'data'), State('input-edit-cat-name', 'value'), State('store-data-signal', 'data')], prevent_initial_call=True
+        [State('store-exp-cat-id-to-edit', 'data'), State('input-edit-cat-name', 'value'), signal_state('expenses')], prevent_initial_call=True
     )
     def save_edit_cat(n, cid, name, sig):
         if not n or not cid: raise PreventUpdate
@@ -520,15 +579,15 @@ def register_callbacks(app):
         except Exception as e: return True, dash.no_update, dbc.Alert(str(e), color="danger")
 
     # --- 6. ELIMINACIONES ---
-    @app.callback(Output('modal-del-exp', 'is_open', allow_duplicate=True), Output('store-data-signal', 'data', allow_duplicate=True), Input('confirm-del-exp', 'n_clicks'), State('store-expense-id-to-delete', 'data'), State('store-data-signal', 'data'), prevent_initial_call=True)
+    @app.callback(Output('modal-del-exp', 'is_open', allow_duplicate=True), signal_output('expenses'), Input('confirm-del-exp', 'n_clicks'), State('store-expense-id-to-delete', 'data'), signal_state('expenses'), prevent_initial_call=True)
     def conf_del_exp(n, eid, sig):
         if n and eid: delete_expense(eid, current_user.id); return False, (sig or 0)+1
         raise PreventUpdate
-    @app.callback(Output('modal-del-con', 'is_open', allow_duplicate=True), Output('store-data-signal', 'data', allow_duplicate=True), Input('confirm-del-con', 'n_clicks'), State('store-concept-id-to-delete', 'data'), State('store-data-signal', 'data'), prevent_initial_call=True)
+    @app.callback(Output('modal-del-con', 'is_open', allow_duplicate=True), signal_output('expenses'), Input('confirm-del-con', 'n_clicks'), State('store-concept-id-to-delete', 'data'), signal_state('expenses'), prevent_initial_call=True)
     def conf_del_con(n, cid, sig):
         if n and cid: delete_expense_concept(cid, current_user.id); return False, (sig or 0)+1
         raise PreventUpdate
-    @app.callback(Output('modal-del-exp-cat', 'is_open', allow_duplicate=True), Output('store-data-signal', 'data', allow_duplicate=True), Input('confirm-del-cat', 'n_clicks'), State('store-exp-cat-id-to-delete', 'data'), State('store-data-signal', 'data'), prevent_initial_call=True)
+    @app.callback(Output('modal-del-exp-cat', 'is_open', allow_duplicate=True), signal_output('expenses'), Input('confirm-del-cat', 'n_clicks'), State('store-exp-cat-id-to-delete', 'data'), signal_state('expenses'), prevent_initial_call=True)
     def conf_del_cat(n, cid, sig):
         if n and cid: delete_expense_category(cid, current_user.id); return False, (sig or 0)+1
         raise PreventUpdate
@@ -550,11 +609,11 @@ def register_callbacks(app):
     # Bulk Delete (CORREGIDO: Limpieza de Selección)
     @app.callback(
         Output('output-bulk-del-exp', 'children'),
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('expenses'),
         Output('table-expenses-history', 'selected_rows'), # Clear Selection
         Output('table-expenses-history', 'selected_row_ids'), # Clear Selection
         Input('btn-bulk-del-exp', 'n_clicks'),
-        [State('table-expenses-history', 'selected_row_ids'), State('store-data-signal', 'data')],
+        [State('table-expenses-history', 'selected_row_ids'), signal_state('expenses')],
         prevent_initial_call=True
     )
     def bulk_del(n, ids, sig):
@@ -11,7 +11,8 @@ from datetime import date, timedelta
 from flask_login import current_user
 
 from app import app
-from database import calculate_financials, load_products
+from database import calculate_financials, load_sales_rollup, load_expense_rollup, fetch_parallel
+from signals import signal_inputs
 
 today = date.today()
 start_of_this_month = today.replace(day=1)
@@ -118,17 +119,19 @@ def register_callbacks(app):
          Input('finances-date-picker', 'start_date'),
          Input('finances-date-picker', 'end_date'),
          Input('finances-see-all-switch', 'value'),
-         Input('store-data-signal', 'data')]
+         *signal_inputs('finances-summary')]
     )
-    def update_finances_summary_tab(active_tab, start_date, end_date, see_all, signal_data):
+    def update_finances_summary_tab(active_tab, start_date, end_date, see_all, *signals):
         if not current_user.is_authenticated or active_tab != 'sub-tab-summary' or not all([start_date, end_date]):
             raise PreventUpdate
 
         user_id = current_user.id
-        results = calculate_financials(start_date, end_date, user_id, see_all=see_all)
-        
-        expenses_df = results['expenses_df']
-        merged_df = results['merged_df']
+        results = calculate_financials(start_date, end_date, user_id, see_all=see_all, include_frames=False)
+
+        # Desgloses desde los resúmenes diarios (ya traen nombres de producto/concepto/categoría)
+        period = (None, None) if see_all else (start_date, end_date)
+        expenses_df = load_expense_rollup(user_id, *period)
+        merged_df = load_sales_rollup(user_id, *period).rename(columns={'qty': 'quantity', 'revenue': 'total_amount', 'cogs': 'cogs_total'})
         date_picker_disabled = see_all
         
         pnl_data = [
@@ -151,11 +154,11 @@ def register_callbacks(app):
         
         if not expenses_df.empty:
             # 1. GRÁFICO (Agrupado por Categoría)
-            pie_data = expenses_df.groupby('categoria')['amount'].sum().reset_index()
+            pie_data = expenses_df.groupby('categoria', observed=True)['amount'].sum().reset_index()
             fig_expenses = px.pie(pie_data, names='categoria', values='amount', title="Gastos por Categoría", hole=.3)
             
             # 2. TABLA DETALLADA (Agrupada por Categoría y Concepto)
-            table_data = expenses_df.groupby(['categoria', 'concepto'])['amount'].sum().reset_index()
+            table_data = expenses_df.groupby(['categoria', 'concepto'], observed=True)['amount'].sum().reset_index()
             
             # Ordenar de mayor a menor
             table_data = table_data.sort_values(by='amount', ascending=False)
@@ -170,7 +173,7 @@ def register_callbacks(app):
 
         product_performance_data = []
         if not merged_df.empty:
-            prod_perf = merged_df.groupby('name').agg(unidades_vendidas=('quantity', 'sum'), ingresos_totales=('total_amount', 'sum'), costo_total=('cogs_total', 'sum')).reset_index()
+            prod_perf = merged_df.groupby('name', observed=True).agg(unidades_vendidas=('quantity', 'sum'), ingresos_totales=('total_amount', 'sum'), costo_total=('cogs_total', 'sum')).reset_index()
             prod_perf['ganancia_bruta'] = prod_perf['ingresos_totales'] - prod_perf['costo_total']
             prod_perf['rentabilidad_%'] = 0.0
             mask = prod_perf['ingresos_totales'] > 0
@@ -196,8 +199,15 @@ def register_callbacks(app):
             raise PreventUpdate
 
         user_id = current_user.id
-        data_a = calculate_financials(start_a, end_a, user_id)
-        data_b = calculate_financials(start_b, end_b, user_id)
+        # Solo KPIs: las tarjetas no necesitan filas, se agregan en Postgres.
+        # Ambos períodos y sus tops se consultan en paralelo.
+        fetched = fetch_parallel(
+            data_a=lambda: calculate_financials(start_a, end_a, user_id, include_frames=False),
+            data_b=lambda: calculate_financials(start_b, end_b, user_id, include_frames=False),
+            rollup_a=lambda: load_sales_rollup(user_id, start_a, end_a),
+            rollup_b=lambda: load_sales_rollup(user_id, start_b, end_b),
+        )
+        data_a, data_b = fetched['data_a'], fetched['data_b']
 
         def create_comparison_card(title, val_a, val_b, format_str, is_percent=False, invert_colors=False):
             diff = val_b - val_a
@@ -263,13 +273,10 @@ def register_callbacks(app):
             ], **col_width)
         ]
         
-        products_df = load_products(user_id)
-        
-        def create_top_products_chart(sales_df, title, color_hex):
-            if sales_df.empty:
+        def create_top_products_chart(rollup_df, title, color_hex):
+            if rollup_df.empty:
                 return px.bar(title=title).update_layout(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)')
-            merged = pd.merge(sales_df, products_df, on='product_id')
-            top_5 = merged.groupby('name')['quantity'].sum().nlargest(5).sort_values(ascending=True)
+            top_5 = rollup_df.groupby('name', observed=True)['qty'].sum().nlargest(5).sort_values(ascending=True)
             fig = px.bar(top_5, x=top_5.values, y=top_5.index, orientation='h', title=title, text_auto=True)
             fig.update_traces(marker_color=color_hex, textposition='outside')
             fig.update_layout(
@@ -279,7 +286,7 @@ def register_callbacks(app):
             )
             return fig
 
-        fig_a = create_top_products_chart(data_a['sales_df'], "Top 5 Productos (Período A)", "#95a5a6")
-        fig_b = create_top_products_chart(data_b['sales_df'], "Top 5 Productos (Período B)", "#32a852")
+        fig_a = create_top_products_chart(fetched['rollup_a'], "Top 5 Productos (Período A)", "#95a5a6")
+        fig_b = create_top_products_chart(fetched['rollup_b'], "Top 5 Productos (Período B)", "#32a852")
 
         return top_row, bottom_rows_layout, fig_a, fig_b
\ No newline at end of file
@@ -0,0 +1,316 @@
+# importaciones.py
+# Validación vectorizada de los archivos de importación de ventas y gastos.
+# Todo se resuelve por columnas (normalización con .str, merge para los IDs, parseo con
+# errors='coerce' y máscaras de error) en lugar de recorrer el archivo con iterrows().
+# Los mensajes conservan el formato "Fila N: ..." (N = fila de Excel, con encabezado).
+# También lee los archivos subidos por tandas (openpyxl read_only / CSV por chunks).
+import csv
+import os
+
+import pandas as pd
+from openpyxl import load_workbook
+
+
+def _clean_key(series):
+    """Normaliza un texto para comparar nombres: str, sin espacios extremos y en minúsculas."""
+    return series.astype(str).str.strip().str.lower()
+
+
+def _excel_rows(index):
+    """Número de fila en Excel (la fila 1 es el encabezado)."""
+    return index + 2
+
+
+def _parse_numbers(series):
+    """Números columna a columna; texto, vacíos e infinitos quedan como NaN."""
+    return pd.to_numeric(series, errors='coerce').replace([float('inf'), float('-inf')], float('nan'))
+
+
+def _parse_dates(series):
+    """Fechas columna a columna; cada celda puede tener su propio formato."""
+    return pd.to_datetime(series, errors='coerce', format='mixed')
+
+
+def _collect_errors(*error_series):
+    """Une series de mensajes (indexadas por fila) y las devuelve en orden de fila."""
+    non_empty = [s for s in error_series if not s.empty]
+    if not non_empty: return []
+    return pd.concat(non_empty).sort_index(kind='stable').tolist()
+
+
+def validate_sales_frame(df, products_db, categories_db, update_stock=False):
+    """
+    Valida un archivo de ventas (columnas categoria, nombre, cantidad, fecha).
+    Devuelve (rows, errors, stock_updates):
+      - rows: DataFrame listo para ingest_sales (product_id, quantity, total_amount, cogs_total, sale_date).
+      - errors: mensajes "Fila N: ..." en orden de fila.
+      - stock_updates: {product_id: stock_final} si update_stock está activo.
+    El stock se controla con una suma acumulada por producto; los productos donde no alcanza
+    se recorren fila a fila como antes (una fila rechazada no descuenta stock), así los
+    mensajes "Stock: N, Pedido: M" son los mismos que daba la validación anterior.
+    """
+    categories = categories_db[['category_id', 'name']].rename(columns={'name': 'cat_name'})
+    catalog = pd.merge(products_db[['product_id', 'name', 'category_id']], categories, on='category_id', how='left')
+    catalog = pd.DataFrame({
+        'cat_clean': catalog['cat_name'].fillna('').str.strip().str.lower(),
+        'prod_clean': catalog['name'].str.strip().str.lower(),
+        'product_id': catalog['product_id'],
+    }).drop_duplicates(['cat_clean', 'prod_clean'], keep='last')
+
+    keys = pd.DataFrame({'cat_clean': _clean_key(df['categoria']), 'prod_clean': _clean_key(df['nombre'])}, index=df.index)
+    product_id = keys.merge(catalog, on=['cat_clean', 'prod_clean'], how='left')['product_id']
+    product_id.index = df.index
+
+    missing = product_id.isna()
+    quantity = _parse_numbers(df['cantidad'])
+    sale_date = _parse_dates(df['fecha'])
+    invalid = ~missing & (quantity.isna() | (quantity.fillna(0).astype('int64') <= 0) | sale_date.isna())
+    valid = ~missing & ~invalid
+
+    quantity = quantity.where(valid).fillna(0).astype('int64') # int() trunca, igual que antes
+    product_id = product_id.where(valid).fillna(0).astype('int64')
+
+    missing_errors = pd.Series(
+        [f"Fila {r}: Producto '{n}' en categoría '{c}' no existe." for r, n, c in
+         zip(_excel_rows(df.index[missing]), df.loc[missing, 'nombre'], df.loc[missing, 'categoria'])],
+        index=df.index[missing], dtype=object
+    )
+    invalid_errors = pd.Series(
+        [f"Fila {r}: Cantidad o fecha inválidos." for r in _excel_rows(df.index[invalid])],
+        index=df.index[invalid], dtype=object
+    )
+
+    stock_errors = pd.Series(dtype=object)
+    stock_updates = {}
+    if update_stock:
+        stock = products_db.set_index('product_id')['stock']
+        valid_ids = product_id[valid]
+        ordered = quantity[valid].groupby(valid_ids).cumsum()
+        available = valid_ids.map(stock).fillna(0)
+        short_products = set(valid_ids[ordered > available])
+        totals = quantity[valid].groupby(valid_ids).sum()
+        stock_updates = {int(pid): int(stock.get(pid, 0)) - int(qty) for pid, qty in totals.items() if pid not in short_products}
+
+        # Solo los productos con algún faltante se revisan fila a fila, con la regla de siempre:
+        # una fila rechazada no consume stock, así que una fila posterior más chica puede pasar.
+        short_idx, short_messages = [], []
+        for pid in short_products:
+            remaining = int(stock.get(pid, 0))
+            for idx in valid_ids.index[valid_ids == pid]:
+                requested = int(quantity[idx])
+                if requested > remaining:
+                    short_idx.append(idx)
+                    short_messages.append(f"Fila {_excel_rows(idx)}: Stock insuficiente para '{df.at[idx, 'nombre']}'. Stock: {remaining}, Pedido: {requested}")
+                else:
+                    remaining -= requested
+            stock_updates[int(pid)] = remaining
+        stock_errors = pd.Series(short_messages, index=pd.Index(short_idx, dtype=df.index.dtype), dtype=object)
+        valid = valid & ~valid.index.isin(short_idx)
+
+    errors = _collect_errors(missing_errors, invalid_errors, stock_errors)
+
+    prices = products_db.set_index('product_id')['price']
+    costs = products_db.set_index('product_id')['cost']
+    rows = pd.DataFrame({
+        'product_id': product_id[valid],
+        'quantity': quantity[valid],
+        'total_amount': product_id[valid].map(prices).fillna(0) * quantity[valid],
+        'cogs_total': product_id[valid].map(costs).fillna(0) * quantity[valid],
+        'sale_date': sale_date[valid],
+    })
+    return rows, errors, stock_updates
+
+
+def validate_expenses_frame(df, concepts_db):
+    """
+    Valida un archivo de gastos (columnas categoria, concepto, monto, fecha).
+    Devuelve (rows, errors): rows listo para ingest_expenses (expense_concept_id, amount, expense_date)
+    y los mensajes "Fila N: ..." en orden de fila.
+    """
+    cat_name = df['categoria'].astype(str).str.strip()
+    con_name = df['concepto'].astype(str).str.strip()
+
+    if concepts_db.empty:
+        concept_id = pd.Series(float('nan'), index=df.index)
+    else:
+        catalog = pd.DataFrame({
+            'cat_clean': _clean_key(concepts_db['category_name']),
+            'con_clean': _clean_key(concepts_db['concept_name']),
+            'concept_id': concepts_db['concept_id'],
+        }).drop_duplicates(['cat_clean', 'con_clean'], keep='last')
+        keys = pd.DataFrame({'cat_clean': cat_name.str.lower(), 'con_clean': con_name.str.lower()})
+        concept_id = keys.merge(catalog, on=['cat_clean', 'con_clean'], how='left')['concept_id']
+        concept_id.index = df.index
+
+    missing = concept_id.isna()
+    amount = _parse_numbers(df['monto'])
+    expense_date = _parse_dates(df['fecha'])
+    invalid = ~missing & (amount.isna() | (amount <= 0) | expense_date.isna())
+    valid = ~missing & ~invalid
+
+    errors = _collect_errors(
+        pd.Series([f"Fila {r}: Concepto '{c}' en categoría '{k}' no existe." for r, c, k in
+                   zip(_excel_rows(df.index[missing]), con_name[missing], cat_name[missing])],
+                  index=df.index[missing], dtype=object),
+        pd.Series([f"Fila {r}: Monto o fecha inválidos." for r in _excel_rows(df.index[invalid])],
+                  index=df.index[invalid], dtype=object),
+    )
+
+    rows = pd.DataFrame({
+        'expense_concept_id': concept_id[valid].astype('int64'),
+        'amount': amount[valid].astype(float),
+        'expense_date': expense_date[valid],
+    })
+    return rows, errors
+
+
+# --- LECTURA EN STREAMING (ARCHIVOS SUBIDOS A /api/import) ---
+# El archivo ya está en disco; se lee por tandas para que la memoria no dependa del tamaño.
+IMPORT_CHUNK_ROWS = 5000
+SALES_REQUIRED_COLUMNS = ['categoria', 'nombre', 'cantidad', 'fecha']
+EXPENSES_REQUIRED_COLUMNS = ['categoria', 'concepto', 'monto', 'fecha']
+MAX_REPORTED_ERRORS = 10
+
+
+class ImportValidationError(Exception):
+    """Hay filas inválidas: la importación completa se deshace."""
+
+
+def _normalize_columns(columns):
+    return [str(c).lower().strip() if c is not None else '' for c in columns]
+
+
+def _check_columns(columns, required):
+    missing = [col for col in required if col not in columns]
+    if missing:
+        raise ValueError(f"Faltan columnas: {', '.join(missing)}.")
+
+
+def _excel_chunks(path, required, chunk_size):
+    """Abre un .xlsx en modo read_only (iter_rows) y devuelve un generador de DataFrames."""
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    rows = workbook.active.iter_rows(values_only=True)
+    columns = _normalize_columns(next(rows, None) or [])
+    try:
+        _check_columns(columns, required)
+    except ValueError:
+        workbook.close(); raise
+
+    def chunks():
+        try:
+            batch, positions = [], []
+            # El índice es la posición de datos (fila Excel - 2) para conservar "Fila N"
+            for position, values in enumerate(rows):
+                if all(v is None for v in values): continue # filas vacías (formato sin datos)
+                values = tuple(values[:len(columns)])
+                batch.append(values + (None,) * (len(columns) - len(values))); positions.append(position)
+                if len(batch) >= chunk_size:
+                    yield pd.DataFrame(batch, columns=columns, index=positions)
+                    batch, positions = [], []
+            if batch:
+                yield pd.DataFrame(batch, columns=columns, index=positions)
+        finally:
+            workbook.close()
+    return chunks()
+
+
+def _csv_chunks(path, required, chunk_size):
+    """Lee un .csv por tandas con el separador detectado (',' o ';' de Excel en español)."""
+    with open(path, newline='', encoding='utf-8-sig', errors='replace') as f:
+        sample = f.read(64 * 1024)
+    try: sep = csv.Sniffer().sniff(sample, delimiters=',;\t').delimiter
+    except csv.Error: sep = ','
+    reader = pd.read_csv(path, sep=sep, chunksize=chunk_size, encoding='utf-8-sig',
+                         encoding_errors='replace', skip_blank_lines=True)
+    first = next(reader, None)
+    columns = _normalize_columns(first.columns if first is not None else [])
+    try:
+        _check_columns(columns, required)
+    except ValueError:
+        reader.close(); raise
+
+    def chunks():
+        with reader:
+            # read_csv mantiene el índice continuo entre tandas: índice + 2 = fila del archivo
+            if first is not None:
+                first.columns = columns
+                yield first
+            for chunk in reader:
+                chunk.columns = columns
+                yield chunk
+    return chunks()
+
+
+def open_upload(path, filename, required, chunk_size=IMPORT_CHUNK_ROWS):
+    """
+    Valida el encabezado de un archivo subido (.xlsx o .csv) y devuelve un generador
+    de DataFrames de como máximo chunk_size filas. ValueError si el formato o las columnas no sirven.
+    """
+    suffix = os.path.splitext(filename or '')[1].lower()
+    if suffix in ('.xlsx', '.xlsm'):
+        return _excel_chunks(path, required, chunk_size)
+    if suffix == '.csv':
+        return _csv_chunks(path, required, chunk_size)
+    raise ValueError("Formato incorrecto. Usa .xlsx o .csv")
+
+
+class _ChunkImport:
+    """Acumula los errores de validación de todas las tandas (solo se guardan los primeros)."""
+
+    def __init__(self):
+        self.errors = []
+        self.error_count = 0
+
+    def _add_errors(self, errors):
+        self.error_count += len(errors)
+        self.errors.extend(errors[:MAX_REPORTED_ERRORS - len(self.errors)])
+
+    def _finish(self):
+        if self.error_count:
+            raise ImportValidationError(f"{self.error_count} filas con errores.")
+
+
+class SalesImport(_ChunkImport):
+    """
+    Valida tandas de ventas una a una (validate_sales_frame) arrastrando el stock entre tandas.
+    feed() entrega solo tandas válidas; si hubo errores sigue validando para reportarlos y al final
+    lanza ImportValidationError, lo que deshace la transacción de ingest_sales_chunks.
+    """
+
+    def __init__(self, products_db, categories_db, update_stock=False):
+        super().__init__()
+        self.products_db = products_db.copy()
+        self.categories_db = categories_db
+        self.update_stock = update_stock
+        self.stock_updates = {} # Stock final estimado (para validar la tanda siguiente)
+        self.sold_quantities = {} # Cantidad total por producto (descuento relativo al guardar)
+
+    def feed(self, frames):
+        for df in frames:
+            rows, errors, stock_updates = validate_sales_frame(df, self.products_db, self.categories_db, self.update_stock)
+            self._add_errors(errors)
+            if stock_updates:
+                self.stock_updates.update(stock_updates)
+                new_stock = self.products_db['product_id'].map(stock_updates)
+                self.products_db['stock'] = new_stock.fillna(self.products_db['stock']).astype(self.products_db['stock'].dtype)
+            if not self.error_count:
+                for pid, qty in rows.groupby('product_id')['quantity'].sum().items():
+                    self.sold_quantities[int(pid)] = self.sold_quantities.get(int(pid), 0) + int(qty)
+                yield rows
+        self._finish()
+
+
+class ExpensesImport(_ChunkImport):
+    """Igual que SalesImport, para gastos (validate_expenses_frame)."""
+
+    def __init__(self, concepts_db):
+        super().__init__()
+        self.concepts_db = concepts_db
+
+    def feed(self, frames):
+        for df in frames:
+            rows, errors = validate_expenses_frame(df, self.concepts_db)
+            self._add_errors(errors)
+            if not self.error_count:
+                yield rows
+        self._finish()
@@ -8,8 +8,10 @@ from datetime import date, timedelta
 
 # Importar la app, server y layouts/callbacks
 from app import app, server
-from auth import User, login_manager
+from auth import User, login_manager, invalidate_user
 from database import record_first_login
+from signals import signal_stores
+from api import api
 # Importar la función generadora y el layout del resumen
 from resumen_excel import generate_excel_summary, get_summary_layout 
 
@@ -27,6 +29,9 @@ from materia_prima import get_layout as get_material_layout, register_callbacks
 login_manager.init_app(server)
 login_manager.login_view = '/login'
 
+# --- Rutas Flask propias (importación de archivos) ---
+server.register_blueprint(api)
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.get(user_id)
@@ -54,7 +59,7 @@ def get_main_app_layout():
     username_display = current_user.username if current_user.is_authenticated else "Usuario"
 
     return html.Div([ 
-        dcc.Store(id='store-data-signal'),
+        *signal_stores(),
         dcc.Download(id="download-sales-excel"),
         dcc.Download(id="download-expenses-excel"),
         dcc.Download(id="download-summary-excel"), 
@@ -124,6 +129,7 @@ app.layout = html.Div([
 def display_page(pathname):
     if pathname == '/logout':
         if current_user.is_authenticated:
+            invalidate_user(current_user.id)
             logout_user()
         return get_login_layout()
 
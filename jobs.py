@@ -0,0 +1,148 @@
+# jobs.py
+# Importaciones en segundo plano. La ruta /api/import encola el trabajo y responde al
+# instante; un hilo del pool lo procesa por tandas y deja estado y progreso en la tabla
+# import_jobs (consultada por Dash con un dcc.Interval). La cancelación se revisa en cada tanda.
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from database import (
+    load_products, load_categories, load_expense_concepts,
+    ingest_sales_chunks, ingest_expenses_chunks,
+    create_import_job, update_import_job, import_job_cancel_requested,
+    touch_import_jobs, fail_interrupted_import_jobs
+)
+from importaciones import (
+    open_upload, SalesImport, ExpensesImport,
+    SALES_REQUIRED_COLUMNS, EXPENSES_REQUIRED_COLUMNS
+)
+
+IMPORT_JOB_WORKERS = int(os.environ.get('IMPORT_JOB_WORKERS', 1)) # Por proceso: el pool de conexiones es chico
+_job_executor = ThreadPoolExecutor(max_workers=IMPORT_JOB_WORKERS, thread_name_prefix='import-job')
+
+# Cada proceso firma sus trabajos y les da un latido periódico (los que esperan en cola incluidos):
+# así un trabajo largo o encolado nunca parece abandonado, y otro worker de gunicorn no toca los ajenos.
+IMPORT_JOB_HEARTBEAT_SECONDS = 60
+_worker_id = None
+_worker_lock = threading.Lock()
+
+
+def _heartbeat(worker_id):
+    while True:
+        time.sleep(IMPORT_JOB_HEARTBEAT_SECONDS)
+        try:
+            touch_import_jobs(worker_id)
+        except Exception as e:
+            print(f"Error en el latido de importaciones: {e}")
+
+
+def _current_worker():
+    """Id de este proceso; la primera vez limpia los trabajos huérfanos y arranca el latido."""
+    global _worker_id
+    with _worker_lock:
+        if _worker_id is None or not _worker_id.startswith(f"{socket.gethostname()}:{os.getpid()}:"):
+            worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}" # Sufijo al azar: un pid puede repetirse
+            fail_interrupted_import_jobs(worker_id)
+            threading.Thread(target=_heartbeat, args=(worker_id,), name='import-job-heartbeat', daemon=True).start()
+            _worker_id = worker_id
+        return _worker_id
+
+
+class ImportCancelled(Exception):
+    """El usuario canceló: se deshace la transacción de la importación."""
+
+
+def _result(success, message, level=None, errors=None):
+    return {"success": success, "message": message, "level": level or ("success" if success else "danger"), "errors": errors or []}
+
+
+def _tracked(job_id, frames):
+    """Pasa las tandas revisando la cancelación y registrando cuántas filas ya se validaron."""
+    validated = 0
+    for df in frames:
+        if import_job_cancel_requested(job_id):
+            raise ImportCancelled()
+        yield df
+        # Al pedir la siguiente tanda, la anterior ya se validó (y se copió si era válida)
+        validated += len(df)
+        update_import_job(job_id, rows_validated=validated)
+
+
+def _inserted_progress(job_id):
+    return lambda total: update_import_job(job_id, rows_inserted=total)
+
+
+def _run_sales_import(job_id, path, filename, user_id, options):
+    products_db = load_products(user_id, columns=['product_id', 'name', 'category_id', 'price', 'cost', 'stock'])
+    if products_db.empty:
+        return _result(False, "No hay productos registrados.", level="warning")
+    frames = open_upload(path, filename, SALES_REQUIRED_COLUMNS)
+
+    update_stock = options.get('update_stock', False)
+    importer = SalesImport(products_db, load_categories(user_id, columns=['category_id', 'name']), update_stock=update_stock)
+    # El stock se descuenta en la misma transacción que las ventas (relativo, con guarda)
+    success, msg = ingest_sales_chunks(
+        importer.feed(_tracked(job_id, frames)), user_id, progress=_inserted_progress(job_id),
+        stock_deductions=importer.sold_quantities if update_stock else None
+    )
+    if importer.error_count:
+        return _result(False, "Errores encontrados:", errors=importer.errors)
+    if not success:
+        return _result(False, msg, level="warning" if msg.startswith("No hay") else "danger")
+
+    alert_msg = f"¡Éxito! {msg}"
+    if update_stock and importer.sold_quantities:
+        alert_msg += " Stock actualizado."
+    return _result(True, alert_msg)
+
+
+def _run_expenses_import(job_id, path, filename, user_id, options):
+    frames = open_upload(path, filename, EXPENSES_REQUIRED_COLUMNS)
+
+    importer = ExpensesImport(load_expense_concepts(user_id))
+    success, msg = ingest_expenses_chunks(importer.feed(_tracked(job_id, frames)), user_id, progress=_inserted_progress(job_id))
+    if importer.error_count:
+        return _result(False, "Errores en la importación:", errors=importer.errors)
+    if not success:
+        return _result(False, msg, level="warning" if msg.startswith("No hay") else "danger")
+    return _result(True, f"¡Éxito! {msg}")
+
+
+IMPORT_RUNNERS = {'sales': _run_sales_import, 'expenses': _run_expenses_import}
+
+
+def _run_job(job_id, kind, path, filename, user_id, options):
+    try:
+        if import_job_cancel_requested(job_id):
+            raise ImportCancelled()
+        update_import_job(job_id, status='running')
+        result = IMPORT_RUNNERS[kind](job_id, path, filename, user_id, options)
+        # ingest_* atrapa las excepciones: una cancelación a mitad de camino llega como mensaje de error
+        if not result['success'] and import_job_cancel_requested(job_id):
+            raise ImportCancelled()
+        update_import_job(job_id, status='done' if result['success'] else 'failed', **result)
+    except ImportCancelled:
+        update_import_job(job_id, status='cancelled', rows_inserted=0, **_result(False, "Importación cancelada. No se guardó ningún dato.", level="warning"))
+    except ValueError as e: # Formato o columnas del archivo
+        update_import_job(job_id, status='failed', **_result(False, str(e)))
+    except Exception as e:
+        update_import_job(job_id, status='failed', **_result(False, f"Error procesando el archivo: {e}"))
+    finally:
+        os.remove(path)
+
+
+def submit_import_job(kind, path, filename, user_id, options=None, idempotency_key=None):
+    """
+    Encola la importación de un archivo ya guardado en disco (el trabajo lo borra al terminar).
+    Si la clave de idempotencia ya tiene un trabajo (subida reintentada) devuelve ese job_id
+    y descarta el archivo, sin importar dos veces.
+    """
+    job_id, created = create_import_job(user_id, kind, filename, idempotency_key, worker_id=_current_worker())
+    if not created:
+        os.remove(path)
+        return job_id
+    _job_executor.submit(_run_job, job_id, kind, path, filename, int(user_id), options or {})
+    return job_id
@@ -8,7 +8,7 @@ from datetime import date, timedelta
 import random
 
 from app import app
-from auth import User, check_password, set_password
+from auth import User, check_password, set_password, invalidate_user
 from database import update_user_password, record_first_login
 
 # --- TUS FRASES SELECCIONADAS ---
@@ -226,6 +226,7 @@ def register_login_callbacks(app):
             today = date.today()
             if not user.is_admin and user.subscription_end_date and today > user.subscription_end_date:
                 return no_url_update, dbc.Alert("Tu suscripción ha expirado.", color="warning", dismissable=True, className="shadow-sm")
+            invalidate_user(user.id) # Sesión nueva: nada de copias previas del usuario
             login_user(user)
             if user.first_login is None: record_first_login(user.id)
             if user.must_change_password: return '/change-password', None
@@ -247,4 +248,5 @@ def register_login_callbacks(app):
         if len(new_pass) < 4: return dbc.Alert("Contraseña muy corta.", color="warning", dismissable=True, className="shadow-sm"), dash.no_update, False
         hashed_password = set_password(new_pass)
         update_user_password(current_user.id, hashed_password)
+        invalidate_user(current_user.id) # Ya no debe cambiar la contraseña
         return dbc.Alert("¡Listo! Redirigiendo...", color="success", className="shadow-sm"), "/", True
\ No newline at end of file
@@ -15,6 +15,7 @@ from database import (
     add_material_purchase, update_raw_material, delete_raw_material,
     delete_materials_bulk
 )
+from signals import signal_inputs, signal_output, signal_state, is_signal_trigger
 
 # --- Layout ---
 # --- Layout ---
@@ -236,7 +237,7 @@ def register_callbacks(app):
 
     @app.callback(
         Output('add-material-alert', 'children'),
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('materials'),
         Output('material-name-input', 'value'),
         Output('material-unit-dropdown', 'value'),
         Output('material-stock-input', 'value'),
@@ -248,7 +249,7 @@ def register_callbacks(app):
          State('material-stock-input', 'value'),
          State('material-cost-input', 'value'),
          State('material-alert-input', 'value'),
-         State('store-data-signal', 'data')],
+         signal_state('materials')],
         prevent_initial_call=True
     )
     def handle_add_material(n_clicks, name, unit, stock, cost, alert, signal_data):
@@ -292,20 +293,18 @@ def register_callbacks(app):
     @app.callback(
         Output('material-inventory-table', 'data'), 
         [Input('material-sub-tabs', 'active_tab'),
-         Input('store-data-signal', 'data')]
+         *signal_inputs('materials')]
     )
-    def update_material_inventory_table(active_sub_tab, signal_data):
+    def update_material_inventory_table(active_sub_tab, *signals):
         if not current_user.is_authenticated: raise PreventUpdate
-        if active_sub_tab != 'sub-tab-material-inventory' and dash.callback_context.triggered_id != 'store-data-signal':
+        if active_sub_tab != 'sub-tab-material-inventory' and not is_signal_trigger():
              raise PreventUpdate
 
         user_id = int(current_user.id)
         materials_df = load_raw_materials(user_id, include_inactive=False)
 
         if not materials_df.empty:
-             numeric_cols = ['current_stock', 'average_cost', 'alert_threshold']
-             for col in numeric_cols:
-                  materials_df[col] = pd.to_numeric(materials_df[col], errors='coerce').fillna(0)
+             # current_stock, average_cost y alert_threshold ya llegan como float64 sin NULL
              materials_df['valor_inventario'] = materials_df['current_stock'] * materials_df['average_cost']
              materials_df['editar'] = "✏️"
              materials_df['eliminar'] = "🗑️"
@@ -318,11 +317,11 @@ def register_callbacks(app):
     @app.callback(
         Output('purchase-material-dropdown', 'options'),
         [Input('material-sub-tabs', 'active_tab'),
-         Input('store-data-signal', 'data')]
+         *signal_inputs('materials')]
     )
-    def update_purchase_dropdown(active_sub_tab, signal_data):
+    def update_purchase_dropdown(active_sub_tab, *signals):
         if not current_user.is_authenticated: raise PreventUpdate
-        if active_sub_tab != 'sub-tab-add-purchase' and dash.callback_context.triggered_id != 'store-data-signal':
+        if active_sub_tab != 'sub-tab-add-purchase' and not is_signal_trigger():
              raise PreventUpdate
 
         user_id = int(current_user.id)
@@ -334,7 +333,7 @@ def register_callbacks(app):
     # Callback actualizado: SIN PROVEEDOR
     @app.callback(
         Output('add-purchase-alert', 'children', allow_duplicate=True),
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('materials'),
         Output('purchase-material-dropdown', 'value', allow_duplicate=True), 
         Output('purchase-quantity-input', 'value', allow_duplicate=True),
         Output('purchase-cost-input', 'value', allow_duplicate=True), 
@@ -343,7 +342,7 @@ def register_callbacks(app):
         [State('purchase-material-dropdown', 'value'), State('purchase-quantity-input', 'value'),
          State('purchase-cost-input', 'value'), State('purchase-date-picker', 'date'),
          State('purchase-notes-input', 'value'), # <-- Ya no pedimos supplier
-         State('store-data-signal', 'data')],
+         signal_state('materials')],
         prevent_initial_call=True
     )
     def handle_add_purchase(n_clicks, material_id, quantity, cost, date_str, notes, signal_data):
@@ -421,7 +420,7 @@ def register_callbacks(app):
 
     @app.callback(
         Output('material-edit-modal', 'is_open', allow_duplicate=True),
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('materials'),
         Output('edit-material-alert', 'children', allow_duplicate=True),
         Input('save-edited-material-button', 'n_clicks'),
         [State('store-material-id-to-edit', 'data'), 
@@ -430,7 +429,7 @@ def register_callbacks(app):
          State('edit-material-alert-input', 'value'),  
          State('edit-material-stock-input', 'value'),  
          State('edit-material-cost-input', 'value'),   
-         State('store-data-signal', 'data')],           
+         signal_state('materials')],           
         prevent_initial_call=True
     )
     def save_edited_material(n_clicks, material_id, name, unit, alert, stock, cost, signal_data):
@@ -469,9 +468,9 @@ def register_callbacks(app):
 
     @app.callback(
         Output('material-delete-confirm-modal', 'is_open', allow_duplicate=True),
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('materials'),
         Input('confirm-delete-material-button', 'n_clicks'),
-        [State('store-material-id-to-delete', 'data'), State('store-data-signal', 'data')],
+        [State('store-material-id-to-delete', 'data'), signal_state('materials')],
         prevent_initial_call=True
     )
     def confirm_delete_material(n_clicks, material_id, signal_data):
@@ -501,10 +500,10 @@ def register_callbacks(app):
     # Borrado Masivo
     @app.callback(
         Output('bulk-delete-materials-output', 'children'),
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('materials'),
         Input('delete-selected-materials-btn', 'n_clicks'),
         [State('material-inventory-table', 'selected_row_ids'),
-         State('store-data-signal', 'data')],
+         signal_state('materials')],
         prevent_initial_call=True
     )
     def delete_selected_materials(n_clicks, selected_ids, signal_data):
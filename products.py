@@ -15,8 +15,9 @@ from database import (
     update_stock, update_product, delete_product, update_category, delete_category,
     reactivate_product_category, get_raw_material_options, get_linked_material_quantities,
     save_product_materials, get_material_costs_map, engine, deduct_materials_for_production,
-    delete_products_bulk, add_product_category_strict
+    delete_products_bulk, add_product_category_strict, bump_data_version
 )
+from signals import signal_inputs, signal_output, signal_state
 
 def get_layout():
     try:
@@ -214,7 +215,7 @@ def register_callbacks(app):
     # 1. AÑADIR PRODUCTO
     @app.callback(
         Output('add-product-alert', 'children'),
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('catalog'),
         Input('save-product-button', 'n_clicks'),
         [State('product-name-input', 'value'), State('product-desc-input', 'value'),
          State('product-category-dropdown', 'value'), State('product-price-input', 'value'),
@@ -224,7 +225,7 @@ def register_callbacks(app):
          State('add-product-materials-dropdown', 'options'),
          State({'type': 'add-material-quantity', 'index': ALL}, 'value'),
          State({'type': 'add-material-quantity', 'index': ALL}, 'id'),
-         State('store-data-signal', 'data')],
+         signal_state('catalog')],
         prevent_initial_call=True
     )
     def add_product(n, name, desc, cat_id, price, cost, stock, alert,
@@ -303,6 +304,7 @@ def register_callbacks(app):
                     """)
                     result = connection.execute(insert_prod_query, product_data)
                     new_product_id = result.scalar_one_or_none()
+                    bump_data_version(connection, user_id, 'products')
                     
                     if material_data_to_save:
                         success, msg = save_product_materials(connection, new_product_id, material_data_to_save, user_id)
@@ -320,10 +322,10 @@ def register_callbacks(app):
     # 2. AÑADIR STOCK
     @app.callback(
         Output('add-stock-alert', 'children'),
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('catalog'),
         Input('submit-add-stock-button', 'n_clicks'),
         [State('add-stock-product-dropdown', 'value'), State('add-stock-quantity-input', 'value'),
-        State('store-data-signal', 'data')],
+        signal_state('catalog')],
         prevent_initial_call=True
     )
     def add_stock(n, prod_id, qty, signal_data):
@@ -345,6 +347,7 @@ def register_callbacks(app):
                     
                     connection.execute(text("UPDATE products SET stock = stock + :q WHERE product_id = :pid AND user_id = :uid"), 
                                        {"q": qty_int, "pid": prod_id, "uid": user_id})
+                    bump_data_version(connection, user_id, 'products')
             
             return dbc.Alert(f"¡Stock actualizado! Insumos descontados.", color="success", dismissable=True), (signal_data or 0) + 1
         except Exception as e:
@@ -353,9 +356,9 @@ def register_callbacks(app):
     # 3. AÑADIR CATEGORÍA
     @app.callback(
         Output('add-category-alert', 'children'),
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('catalog'),
         Input('save-category-button', 'n_clicks'),
-        [State('category-name-input', 'value'), State('store-data-signal', 'data')],
+        [State('category-name-input', 'value'), signal_state('catalog')],
         prevent_initial_call=True
     )
     def add_category(n, name, signal_data):
@@ -377,12 +380,13 @@ def register_callbacks(app):
         Output('add-stock-product-dropdown', 'options'), 
         Output('product-category-dropdown', 'options'),
         Output('add-product-materials-dropdown', 'options'),
-        [Input('product-sub-tabs', 'active_tab'), Input('store-data-signal', 'data')]
+        [Input('product-sub-tabs', 'active_tab'), *signal_inputs('products')]
     )
-    def refresh_products_components(sub_tab, signal_data):
+    def refresh_products_components(sub_tab, *signals):
         if not current_user.is_authenticated: raise PreventUpdate
         user_id = int(current_user.id) 
-        products_df = load_products(user_id); categories_df = load_categories(user_id)
+        products_df = load_products(user_id, columns=['product_id', 'name', 'description', 'category_id', 'price', 'cost', 'stock', 'alert_threshold', 'is_active'])
+        categories_df = load_categories(user_id, columns=['category_id', 'name', 'is_active'])
         category_options = get_category_options(user_id)
         material_options = get_raw_material_options(user_id)
         
@@ -393,17 +397,16 @@ def register_callbacks(app):
         if not products_df.empty:
             active_prods = products_df[products_df['is_active'] == True].copy() if 'is_active' in products_df.columns else products_df.copy()
             if not active_prods.empty:
-                merged = pd.merge(active_prods, categories_df, on='category_id', how='left')
-                merged['cat_name'] = merged['name_y'].fillna('Sin Categoría')
-                merged['prod_name'] = merged['name_x']
+                merged = pd.merge(active_prods, categories_df[['category_id', 'name']].rename(columns={'name': 'cat_name'}), on='category_id', how='left')
+                merged['cat_name'] = merged['cat_name'].fillna('Sin Categoría')
+                merged['prod_name'] = merged['name']
                 add_stock_options = [{'label': f"{row['cat_name']} - {row['prod_name']} (Actual: {row['stock']})", 'value': row['product_id']} for _, row in merged.iterrows()]
 
         display_df = pd.DataFrame()
         if not products_df.empty:
             df_active = products_df[products_df['is_active'] == True].copy() if 'is_active' in products_df.columns else products_df.copy()
-            for col in ['cost', 'price']: df_active[col] = pd.to_numeric(df_active[col], errors='coerce')
-            df = pd.merge(df_active, categories_df, on='category_id', how='left').fillna("Sin Categoría")
-            df = df.rename(columns={'name_x': 'Nombre', 'name_y': 'Categoría'})
+            df_active = df_active.rename(columns={'name': 'Nombre'})
+            df = pd.merge(df_active, categories_df[['category_id', 'name']].rename(columns={'name': 'Categoría'}), on='category_id', how='left').fillna("Sin Categoría")
             df['editar'] = "✏️"; df['eliminar'] = "🗑️"; df['id'] = df['product_id']
             display_df = df
         products_table_data = display_df.to_dict('records')
@@ -471,14 +474,14 @@ def register_callbacks(app):
 
     # Guardar Edición
     @app.callback(
-        Output('product-edit-modal', 'is_open', allow_duplicate=True), Output('store-data-signal', 'data', allow_duplicate=True), Output('edit-product-alert', 'children'),
+        Output('product-edit-modal', 'is_open', allow_duplicate=True), signal_output('catalog'), Output('edit-product-alert', 'children'),
         Input('save-edited-product-button', 'n_clicks'),
         [State('store-product-id-to-edit', 'data'), State('edit-product-name', 'value'), State('edit-product-desc', 'value'),
          State('edit-product-category', 'value'), State('edit-product-price', 'value'), State('edit-product-cost', 'value'),
          State('edit-product-stock', 'value'), State('edit-product-alert', 'value'),
          State('edit-product-materials-dropdown', 'value'), State('edit-product-materials-dropdown', 'options'),
          State({'type': 'edit-material-quantity', 'index': ALL}, 'value'), State({'type': 'edit-material-quantity', 'index': ALL}, 'id'),
-         State('store-data-signal', 'data')], prevent_initial_call=True
+         signal_state('catalog')], prevent_initial_call=True
     )
     def save_edit(n, pid, name, desc, cat, price, cost, stock, alert, mids, mopts, mquants, mids_ids, sig):
         if not n or not pid: raise PreventUpdate
@@ -507,7 +510,7 @@ def register_callbacks(app):
         except Exception as e: return True, dash.no_update, dbc.Alert(f"Error: {e}", color="danger")
 
     # Eliminar Producto
-    @app.callback(Output('product-delete-confirm-modal', 'is_open', allow_duplicate=True), Output('store-data-signal', 'data', allow_duplicate=True), Input('confirm-delete-product-button', 'n_clicks'), State('store-product-id-to-delete', 'data'), State('store-data-signal', 'data'), prevent_initial_call=True)
+    @app.callback(Output('product-delete-confirm-modal', 'is_open', allow_duplicate=True), signal_output('catalog'), Input('confirm-delete-product-button', 'n_clicks'), State('store-product-id-to-delete', 'data'), signal_state('catalog'), prevent_initial_call=True)
     def del_prod(n, pid, sig):
         if n and pid: delete_product(pid, int(current_user.id)); return False, (sig or 0)+1
         raise PreventUpdate
@@ -522,12 +525,12 @@ def register_callbacks(app):
         elif col == "eliminar": return False, True, None, cid, dash.no_update
         raise PreventUpdate
 
-    @app.callback(Output('category-edit-modal', 'is_open', allow_duplicate=True), Output('store-data-signal', 'data', allow_duplicate=True), Input('save-edited-category-button', 'n_clicks'), [State('store-category-id-to-edit', 'data'), State('edit-category-name', 'value'), State('store-data-signal', 'data')], prevent_initial_call=True)
+    @app.callback(Output('category-edit-modal', 'is_open', allow_duplicate=True), signal_output('catalog'), Input('save-edited-category-button', 'n_clicks'), [State('store-category-id-to-edit', 'data'), State('edit-category-name', 'value'), signal_state('catalog')], prevent_initial_call=True)
     def save_cat_edit(n, cid, name, sig):
         if n and cid and name: update_category(cid, {"name": name.strip()}, int(current_user.id)); return False, (sig or 0)+1
         raise PreventUpdate
 
-    @app.callback(Output('category-delete-confirm-modal', 'is_open', allow_duplicate=True), Output('store-data-signal', 'data', allow_duplicate=True), Input('confirm-delete-category-button', 'n_clicks'), State('store-category-id-to-delete', 'data'), State('store-data-signal', 'data'), prevent_initial_call=True)
+    @app.callback(Output('category-delete-confirm-modal', 'is_open', allow_duplicate=True), signal_output('catalog'), Input('confirm-delete-category-button', 'n_clicks'), State('store-category-id-to-delete', 'data'), signal_state('catalog'), prevent_initial_call=True)
     def del_cat(n, cid, sig):
         if n and cid: delete_category(cid, int(current_user.id)); return False, (sig or 0)+1
         raise PreventUpdate
@@ -543,7 +546,7 @@ def register_callbacks(app):
     def c4(n): return False
 
     # Borrado Masivo
-    @app.callback(Output('bulk-delete-products-output', 'children'), Output('store-data-signal', 'data', allow_duplicate=True), Output('products-table', 'selected_rows'), Output('products-table', 'selected_row_ids'), Input('delete-selected-products-btn', 'n_clicks'), [State('products-table', 'selected_row_ids'), State('store-data-signal', 'data')], prevent_initial_call=True)
+    @app.callback(Output('bulk-delete-products-output', 'children'), signal_output('catalog'), Output('products-table', 'selected_rows'), Output('products-table', 'selected_row_ids'), Input('delete-selected-products-btn', 'n_clicks'), [State('products-table', 'selected_row_ids'), signal_state('catalog')], prevent_initial_call=True)
     def bulk_del(n, ids, sig):
         if not n or not ids: raise PreventUpdate
         success, msg = delete_products_bulk(ids, int(current_user.id))
@@ -0,0 +1,13 @@
+# rebuild_rollups.py
+# Reconstruye las tablas sales_daily_rollup y expense_daily_rollup desde sales/expenses.
+# Uso: python rebuild_rollups.py            (todos los usuarios)
+#      python rebuild_rollups.py <user_id>  (solo un usuario)
+import sys
+from database import rebuild_rollups
+
+if __name__ == "__main__":
+    user_id = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    print("Reconstruyendo resúmenes diarios" + (f" del usuario {user_id}..." if user_id is not None else " de todos los usuarios..."))
+    success, msg = rebuild_rollups(user_id)
+    print(msg)
+    sys.exit(0 if success else 1)
@@ -9,7 +9,8 @@ from dash import html, dcc
 # Importar las funciones de base de datos ACTUALIZADAS
 from database import (
     load_sales, load_expenses_detailed, load_products, load_categories,
-    load_expense_categories, load_raw_materials, calculate_financials
+    load_expense_categories, load_raw_materials, calculate_financials,
+    load_sales_rollup, load_expense_rollup, fetch_parallel
 )
 
 # --- LAYOUT (Centrado y con texto actualizado) ---
@@ -66,10 +67,17 @@ def get_summary_layout():
 # --- LOGICA DE GENERACIÓN DE EXCEL (CORREGIDA) ---
 
 def create_dashboard_sheet(writer, user_id, start_date=None, end_date=None):
-    """Crea la hoja de Dashboard (usa calculate_financials que ya trae los datos correctos)."""
+    """Crea la hoja de Dashboard (KPIs agregados en SQL, tops desde los resúmenes diarios)."""
     
     see_all_flag = False if (start_date and end_date) else True
-    financials = calculate_financials(start_date, end_date, user_id, see_all=see_all_flag)
+    data = fetch_parallel(
+        financials=lambda: calculate_financials(start_date, end_date, user_id, see_all=see_all_flag, include_frames=False),
+        products=lambda: load_products(user_id, columns=['cost', 'stock']),
+        materials=lambda: load_raw_materials(user_id, columns=['current_stock', 'average_cost']),
+        sales_rollup=lambda: load_sales_rollup(user_id, start_date, end_date),
+        expense_rollup=lambda: load_expense_rollup(user_id, start_date, end_date),
+    )
+    financials = data['financials']
     
     rango_txt = "Histórico Completo"
     if start_date and end_date:
@@ -87,8 +95,8 @@ def create_dashboard_sheet(writer, user_id, start_date=None, end_date=None):
     }
     df_kpi = pd.DataFrame(kpi_data)
 
-    products_df = load_products(user_id)
-    materials_df = load_raw_materials(user_id)
+    products_df = data['products']
+    materials_df = data['materials']
     
     valor_inv_productos = (products_df['cost'] * products_df['stock']).sum() if not products_df.empty else 0
     valor_inv_insumos = (materials_df['current_stock'] * materials_df['average_cost']).sum() if not materials_df.empty else 0
@@ -99,12 +107,12 @@ def create_dashboard_sheet(writer, user_id, start_date=None, end_date=None):
     }
     df_inv = pd.DataFrame(inventory_data)
 
-    merged_sales = financials['merged_df']
+    merged_sales = data['sales_rollup'].rename(columns={'revenue': 'total_amount', 'cogs': 'cogs_total'})
     top_prod_count = 0
     
     if not merged_sales.empty:
-        prod_perf = merged_sales.groupby('name')[['total_amount', 'cogs_total']].sum().reset_index()
-        prod_perf = prod_perf.fillna(0)
+        prod_perf = merged_sales.groupby('name', observed=True)[['total_amount', 'cogs_total']].sum().reset_index()
+        prod_perf[['total_amount', 'cogs_total']] = prod_perf[['total_amount', 'cogs_total']].fillna(0)
         prod_perf['Ganancia Bruta'] = prod_perf['total_amount'] - prod_perf['cogs_total']
         df_top_prod = prod_perf.nlargest(5, 'Ganancia Bruta')
         top_prod_count = len(df_top_prod)
@@ -114,13 +122,13 @@ def create_dashboard_sheet(writer, user_id, start_date=None, end_date=None):
         title_prod = "Top Productos Rentables"
         df_top_prod = pd.DataFrame(columns=[title_prod, 'Ganancia Bruta'])
 
-    # CAMBIO: Usamos el expenses_df que viene de calculate_financials (que ya es el 'detailed')
-    expenses_df = financials['expenses_df']
+    # El resumen diario de gastos ya trae la columna 'categoria'
+    expenses_df = data['expense_rollup']
     top_exp_count = 0
     
     if not expenses_df.empty:
         # Agrupamos por la columna 'categoria' que ya viene en el df detallado
-        expense_summary = expenses_df.groupby('categoria')['amount'].sum().reset_index()
+        expense_summary = expenses_df.groupby('categoria', observed=True)['amount'].sum().reset_index()
         df_top_exp = expense_summary.nlargest(5, 'amount')
         top_exp_count = len(df_top_exp)
         title_exp = f"Top {top_exp_count} Gastos (En este periodo)"
@@ -185,15 +193,22 @@ def create_abc_analysis_df(products_df, sales_df):
 
 def generate_excel_summary(user_id, start_date=None, end_date=None):
     
-    # Stock SIEMPRE es el actual
-    products_df = load_products(user_id)
-    materials_df = load_raw_materials(user_id, include_inactive=False)
+    # Stock SIEMPRE es el actual; Ventas y Gastos FILTRADOS (Usando la función detallada)
+    data = fetch_parallel(
+        products=lambda: load_products(user_id, columns=['product_id', 'name', 'category_id', 'stock', 'cost', 'price', 'is_active']),
+        materials=lambda: load_raw_materials(user_id, include_inactive=False),
+        sales=lambda: load_sales(user_id, start_date, end_date, columns=['sale_date', 'product_id', 'quantity', 'total_amount', 'cogs_total']),
+        expenses=lambda: load_expenses_detailed(user_id, start_date, end_date, columns=['expense_date', 'amount', 'concepto', 'categoria']), # <--- CORRECCIÓN AQUÍ
+        categories=lambda: load_categories(user_id, columns=['category_id', 'name']),
+        sales_rollup=lambda: load_sales_rollup(user_id, start_date, end_date),
+        expense_rollup=lambda: load_expense_rollup(user_id, start_date, end_date),
+    )
+    products_df = data['products']
+    materials_df = data['materials']
+    sales_df = data['sales']
+    expenses_df = data['expenses']
     
-    # Ventas y Gastos FILTRADOS (Usando la función detallada)
-    sales_df = load_sales(user_id, start_date, end_date)
-    expenses_df = load_expenses_detailed(user_id, start_date, end_date) # <--- CORRECCIÓN AQUÍ
-    
-    prod_cats_df = load_categories(user_id)
+    prod_cats_df = data['categories']
     # exp_cats_df = load_expense_categories(user_id) # Ya no se necesita merge manual
     
     output = io.BytesIO()
@@ -203,17 +218,17 @@ def generate_excel_summary(user_id, start_date=None, end_date=None):
         # 1. Dashboard (KPIs)
         create_dashboard_sheet(writer, user_id, start_date, end_date)
         
-        # 2. P&L Mensual
-        df_sales_pivot = sales_df.copy()
+        # 2. P&L Mensual (desde los resúmenes diarios, no las transacciones)
+        df_sales_pivot = data['sales_rollup'].rename(columns={'revenue': 'total_amount', 'cogs': 'cogs_total'})
         if not df_sales_pivot.empty:
-            df_sales_pivot['Month'] = df_sales_pivot['sale_date'].dt.to_period('M')
+            df_sales_pivot['Month'] = df_sales_pivot['day'].dt.to_period('M')
             pivot_sales = df_sales_pivot.groupby('Month')['total_amount'].sum()
             pivot_cogs = df_sales_pivot.groupby('Month')['cogs_total'].sum()
         else: pivot_sales = pd.Series(dtype=float); pivot_cogs = pd.Series(dtype=float)
         
-        df_exp_pivot = expenses_df.copy()
+        df_exp_pivot = data['expense_rollup']
         if not df_exp_pivot.empty:
-            df_exp_pivot['Month'] = df_exp_pivot['expense_date'].dt.to_period('M')
+            df_exp_pivot['Month'] = df_exp_pivot['day'].dt.to_period('M')
             pivot_expenses = df_exp_pivot.groupby('Month')['amount'].sum()
         else: pivot_expenses = pd.Series(dtype=float)
         
@@ -242,7 +257,7 @@ def generate_excel_summary(user_id, start_date=None, end_date=None):
         # CAMBIO: Usamos las columnas 'categoria' y 'concepto' del df detallado
         df_gastos_pnl = expenses_df.copy()
         if not df_gastos_pnl.empty:
-            df_gastos_pnl['Detalle'] = df_gastos_pnl['categoria'] + ' - ' + df_gastos_pnl['concepto']
+            df_gastos_pnl['Detalle'] = df_gastos_pnl['categoria'].astype(str) + ' - ' + df_gastos_pnl['concepto'].astype(str)
             df_gastos_pnl = df_gastos_pnl[['expense_date', 'Detalle', 'amount']]
             df_gastos_pnl.rename(columns={'expense_date': 'Fecha', 'amount': 'Gasto Operativo'}, inplace=True)
             df_gastos_pnl['Tipo'] = 'Gasto'; df_gastos_pnl['Cantidad'] = 0; df_gastos_pnl['Ingresos'] = 0; df_gastos_pnl['COGS'] = 0; df_gastos_pnl['Ganancia Bruta'] = 0
@@ -270,9 +285,9 @@ def generate_excel_summary(user_id, start_date=None, end_date=None):
 
         # 6. Stock Productos
         if not products_df.empty:
-            df_prod_stock = pd.merge(products_df[products_df['is_active'] == True], prod_cats_df, on='category_id', how='left')
+            df_prod_stock = pd.merge(products_df[products_df['is_active'] == True], prod_cats_df.rename(columns={'name': 'cat_name'}), on='category_id', how='left')
             df_prod_stock['valor_inv'] = df_prod_stock['cost'] * df_prod_stock['stock']
-            df_prod_stock = df_prod_stock[['name_x', 'name_y', 'stock', 'cost', 'price', 'valor_inv']].rename(columns={'name_x': 'Producto', 'name_y': 'Cat', 'stock': 'Stock', 'valor_inv': 'Valor Total'})
+            df_prod_stock = df_prod_stock[['name', 'cat_name', 'stock', 'cost', 'price', 'valor_inv']].rename(columns={'name': 'Producto', 'cat_name': 'Cat', 'stock': 'Stock', 'valor_inv': 'Valor Total'})
             df_prod_stock.to_excel(writer, sheet_name='Stock Productos', index=False)
 
         # 7. Stock Insumos
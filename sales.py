@@ -1,12 +1,10 @@
 # sales.py
 from dash import dcc, html, dash_table
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 from dash.exceptions import PreventUpdate
 from dash.dash_table.Format import Format, Scheme
 import pandas as pd
-import base64
-import io
 import dash
 from flask_login import current_user
 from datetime import datetime
@@ -14,15 +12,22 @@ from sqlalchemy import text
 
 from app import app
 from database import (
-    load_sales, load_products, load_categories,
-    update_stock, update_sale, delete_sale, attempt_stock_deduction,
-    delete_sales_bulk, engine
+    load_sales, load_products, load_categories, load_sales_page, get_sale, prepare_page_cursors,
+    update_sale, delete_sale, record_sale, record_sales_batch,
+    delete_sales_bulk, refresh_sales_rollup, bump_data_version, engine,
+    get_import_job, request_import_job_cancel
 )
+from signals import signal_inputs, signal_output, signal_state, SIGNAL_STORES
 
 def get_layout():
     return html.Div([
         dcc.Store(id='store-sale-id-to-edit'),
         dcc.Store(id='store-sale-id-to-delete'),
+        dcc.Store(id='store-history-cursors'), # Cursores keyset por página del historial
+        dcc.Store(id='store-upload-sales-result'), # Respuesta de /api/import/sales
+        dcc.Store(id='store-upload-sales-job'), # Trabajo de importación en curso
+        dcc.Store(id='store-sale-idempotency-key'), # Clave del próximo registro (venta o carrito)
+        dcc.Interval(id='interval-upload-sales', interval=1000, disabled=True),
         # Eliminamos el dcc.Store('client-timestamp-store')
 
         # --- MODAL EDITAR VENTA ---
@@ -82,7 +87,24 @@ def get_layout():
                              ], xs=12, md=6),
                          ], className="mb-3"),
                          
-                         dbc.Button("Registrar Venta", id="submit-sale-button", color="primary", n_clicks=0, className="mt-3 w-100 w-md-auto")
+                         dbc.Button("Registrar Venta", id="submit-sale-button", color="primary", n_clicks=0, className="mt-3 w-100 w-md-auto"),
+                         dbc.Button("Agregar al Carrito", id="add-to-cart-button", color="secondary", outline=True, n_clicks=0, className="mt-3 ms-md-2 w-100 w-md-auto"),
+
+                         # --- CARRITO: varias líneas, una sola transacción al cobrar ---
+                         html.Hr(className="my-4"),
+                         html.H5("Carrito", className="mb-3"),
+                         dash_table.DataTable(
+                             id='sale-cart-table',
+                             columns=[
+                                 {"name": "Producto", "id": "label"},
+                                 {"name": "Cantidad", "id": "quantity"}
+                             ],
+                             data=[],
+                             row_deletable=True,
+                             style_table={'overflowX': 'auto'},
+                             style_cell={'textAlign': 'left', 'minWidth': '100px'}
+                         ),
+                         dbc.Button("Cobrar Carrito", id="checkout-cart-button", color="success", n_clicks=0, className="mt-3 w-100 w-md-auto")
                      ])
                  ]),
 
@@ -93,11 +115,12 @@ def get_layout():
                                  id='upload-sales-data',
                                  children=html.Div(['Arrastra y suelta o ', html.A('Selecciona un Archivo')]),
                                  style={'width': '100%', 'height': '60px', 'lineHeight': '60px', 'borderWidth': '1px', 'borderStyle': 'dashed', 'borderRadius': '5px', 'textAlign': 'center', 'margin': '10px 0'},
+                                 accept='.xlsx,.csv',
                                  multiple=False
                              ),
                              dbc.Alert([
                                  html.H5("Formato Requerido:", className="alert-heading"),
-                                 html.P("El archivo Excel debe tener las siguientes columnas:"),
+                                 html.P("El archivo Excel (.xlsx) o CSV debe tener las siguientes columnas:"),
                                  html.Ul([
                                     html.Li([html.B("categoria"), " (Ej: 'Ropa')"]),
                                     html.Li([html.B("nombre"), " (Ej: 'Camiseta Negra')"]),
@@ -113,6 +136,7 @@ def get_layout():
                                  value=False,
                                  className="my-2"
                              ),
+                             html.Div(id='upload-sales-progress'),
                              html.Div(id='upload-sales-output')
                          ],
                          title="Importar Historial de Ventas desde Excel"
@@ -147,7 +171,12 @@ def get_layout():
                         ],
                         data=[], 
                         page_size=15,
-                        sort_action='native',
+                        page_current=0,
+                        page_action='custom',
+                        sort_action='custom',
+                        sort_mode='single',
+                        filter_action='custom',
+                        filter_query='',
                         row_selectable='multi',
                         selected_rows=[],
                         selected_row_ids=[],
@@ -167,17 +196,26 @@ def get_layout():
 
 def register_callbacks(app):
 
+    # --- 0. CLAVE DE IDEMPOTENCIA (NAVEGADOR) ---
+    # Nueva clave al cargar y después de cada venta registrada (cambia la señal 'sales')
+    app.clientside_callback(
+        ClientsideFunction(namespace='idempotency', function_name='fresh'),
+        Output('store-sale-idempotency-key', 'data'),
+        Input(SIGNAL_STORES['sales'], 'data')
+    )
+
     # --- 1. REGISTRAR VENTA (SERVER-SIDE, USA HORA LOCAL) ---
     @app.callback(
         Output('sale-validation-alert', 'children'),
-        Output('store-data-signal', 'data', allow_duplicate=True), 
+        signal_output('sales'), 
         Input('submit-sale-button', 'n_clicks'), # <-- Disparador es el botón
         [State('product-dropdown', 'value'), 
          State('quantity-input', 'value'),
-         State('store-data-signal', 'data')],
+         State('store-sale-idempotency-key', 'data'),
+         signal_state('sales')],
         prevent_initial_call=True
     )
-    def register_sale(n_clicks, prod_id, qty, signal_data):
+    def register_sale(n_clicks, prod_id, qty, idempotency_key, signal_data):
         if not current_user.is_authenticated or not all([prod_id, qty, n_clicks]):
             raise PreventUpdate
 
@@ -188,190 +226,182 @@ def register_callbacks(app):
         except (ValueError, TypeError):
              return dbc.Alert("Error: Cantidad no válida.", color="danger", dismissable=True), dash.no_update
 
-        success = attempt_stock_deduction(prod_id, qty, user_id)
-
+        # Descuento de stock + venta + resumen diario en una sola transacción
+        success, msg = record_sale(prod_id, qty, user_id, idempotency_key=idempotency_key)
         if not success:
-            products_df = load_products(user_id)
-            try:
-                current_stock = products_df.loc[products_df['product_id'] == prod_id, 'stock'].iloc[0]
-                return dbc.Alert(f"Error: Stock insuficiente. Solo quedan {current_stock}.", color="danger", dismissable=True), dash.no_update
-            except IndexError:
-                 return dbc.Alert(f"Error: Producto no encontrado.", color="danger", dismissable=True), dash.no_update
+            return dbc.Alert(msg, color="danger", dismissable=True), dash.no_update
 
-        try:
-            products_df = load_products(user_id) 
-            info = products_df.loc[products_df['product_id'] == prod_id].iloc[0]
-
-            # Obtenemos la hora del servidor (que será tu hora local al correr en tu PC)
-            sale_time = datetime.now() 
+        new_signal = (signal_data or 0) + 1
+        return dbc.Alert(msg, color="success", dismissable=True, duration=4000), new_signal
 
-            pd.DataFrame([{
-                'product_id': prod_id,
-                'quantity': qty,
-                'total_amount': info['price'] * qty,
-                'cogs_total': info['cost'] * qty,
-                'sale_date': sale_time, # <-- Usamos la hora local del servidor
-                'user_id': user_id
-            }]).to_sql('sales', engine, if_exists='append', index=False)
 
-            new_signal = (signal_data or 0) + 1
-            return dbc.Alert("¡Venta registrada!", color="success", dismissable=True, duration=4000), new_signal
+    # --- 1b. CARRITO ---
+    # Las líneas se arman en el navegador (assets/sales_cart.js) y viajan juntas al cobrar.
+    app.clientside_callback(
+        ClientsideFunction(namespace='cart', function_name='add'),
+        Output('sale-cart-table', 'data'),
+        Input('add-to-cart-button', 'n_clicks'),
+        [State('product-dropdown', 'value'),
+         State('quantity-input', 'value'),
+         State('product-dropdown', 'options'),
+         State('sale-cart-table', 'data')],
+        prevent_initial_call=True
+    )
 
-        except Exception as e:
-            try:
-                 products_df = load_products(user_id)
-                 info = products_df.loc[products_df['product_id'] == prod_id].iloc[0]
-                 update_stock(prod_id, info['stock'] + qty, user_id)
-            except: pass
-            return dbc.Alert(f"Error al registrar la venta: {e}", color="danger"), dash.no_update
+    @app.callback(
+        Output('sale-validation-alert', 'children', allow_duplicate=True),
+        signal_output('sales'),
+        Output('sale-cart-table', 'data', allow_duplicate=True),
+        Input('checkout-cart-button', 'n_clicks'),
+        [State('sale-cart-table', 'data'),
+         State('store-sale-idempotency-key', 'data'),
+         signal_state('sales')],
+        prevent_initial_call=True
+    )
+    def checkout_cart(n_clicks, cart, idempotency_key, signal_data):
+        if not current_user.is_authenticated or not n_clicks: raise PreventUpdate
+        if not cart:
+            return dbc.Alert("El carrito está vacío.", color="warning", dismissable=True), dash.no_update, dash.no_update
 
+        success, msg = record_sales_batch(cart, int(current_user.id), idempotency_key=idempotency_key)
+        if not success:
+            return dbc.Alert(msg, color="danger", dismissable=True), dash.no_update, dash.no_update
+        return dbc.Alert(msg, color="success", dismissable=True, duration=4000), (signal_data or 0) + 1, []
 
-    # --- 2. REFRESCAR TABLA Y DROPDOWNS ---
+    # --- 2. REFRESCAR DROPDOWNS ---
     @app.callback(
-        Output('history-table', 'data'), 
         Output('product-dropdown', 'options'),
         Output('edit-sale-product', 'options'),
         [Input('sales-tabs', 'active_tab'), 
-         Input('store-data-signal', 'data')] 
+         *signal_inputs('sales')] 
     )
-    def refresh_sales_components(active_tab, signal_data):
+    def refresh_sales_components(active_tab, *signals):
         if not current_user.is_authenticated: raise PreventUpdate
         
         user_id = int(current_user.id) 
-        sales_df = load_sales(user_id)
-        products_df = load_products(user_id)
-        categories_df = load_categories(user_id)
-
-        df_show = pd.DataFrame()
-        if not sales_df.empty:
-            df_show = pd.merge(sales_df, products_df, on='product_id', how='left')
-            if not categories_df.empty and not df_show.empty:
-                df_show = pd.merge(df_show, categories_df, on='category_id', how='left')
-
-            df_show = df_show.rename(columns={'name_x': 'product_name', 'name_y': 'category_name'})
-            df_show['product_name'] = df_show['product_name'].fillna('Producto Eliminado')
-            df_show['category_name'] = df_show['category_name'].fillna('Sin Categoría')
-            df_show['sale_date_display'] = df_show['sale_date'].dt.strftime('%Y-%m-%d %H:%M')
-            df_show['editar'] = "✏️"
-            df_show['eliminar'] = "🗑️"
-            df_show['id'] = df_show['sale_id'] 
+        products_df = load_products(user_id, columns=['product_id', 'name', 'category_id', 'stock', 'is_active'])
+        categories_df = load_categories(user_id, columns=['category_id', 'name']).rename(columns={'name': 'cat_name'})
 
         # Dropdowns (Categoria - Producto)
         product_options = []
         if not products_df.empty:
             merged_prods = pd.merge(products_df, categories_df, on='category_id', how='left')
-            merged_prods['cat_name'] = merged_prods['name_y'].fillna('Sin Categoría')
+            merged_prods['cat_name'] = merged_prods['cat_name'].fillna('Sin Categoría')
             active_prods = merged_prods[merged_prods['is_active'] == True] if 'is_active' in merged_prods.columns else merged_prods
             
             product_options = [
                 {
-                    'label': f"{row['cat_name']} - {row['name_x']} (Stock: {row['stock']})",
+                    'label': f"{row['cat_name']} - {row['name']} (Stock: {row['stock']})",
                     'value': row['product_id']
                 } for _, row in active_prods.iterrows()
             ]
 
-        return df_show.to_dict('records'), product_options, product_options
+        return product_options, product_options
 
-    # --- 3. IMPORTAR VENTAS (CON VALIDACIÓN DE CATEGORÍA) ---
+    # --- 2b. HISTORIAL PAGINADO EN SERVIDOR ---
+    # Solo viaja la página visible; filtro y orden se resuelven en SQL (ver load_sales_page).
     @app.callback(
-        Output('upload-sales-output', 'children'),
-        Output('store-data-signal', 'data', allow_duplicate=True),
-        Input('upload-sales-data', 'contents'),
-        [State('upload-sales-data', 'filename'),
-         State('store-data-signal', 'data'),
-         State('upload-sales-update-stock', 'value')],
-        prevent_initial_call=True
+        Output('history-table', 'data'),
+        Output('history-table', 'page_count'),
+        Output('history-table', 'page_current'),
+        Output('store-history-cursors', 'data'),
+        [Input('sales-tabs', 'active_tab'),
+         Input('history-table', 'page_current'),
+         Input('history-table', 'page_size'),
+         Input('history-table', 'sort_by'),
+         Input('history-table', 'filter_query'),
+         *signal_inputs('sales')],
+        State('store-history-cursors', 'data')
     )
-    def upload_sales_data(contents, filename, signal_data, update_stock_enabled):
-        if not current_user.is_authenticated or contents is None: raise PreventUpdate
+    def update_history_table(active_tab, page_current, page_size, sort_by, filter_query, *args):
+        if not current_user.is_authenticated or active_tab != 'tab-sales-history':
+            raise PreventUpdate
+        cursors, page_current = prepare_page_cursors(args[-1], page_current, sort_by, filter_query)
 
-        user_id = int(current_user.id) 
-        content_type, content_string = contents.split(',')
-        decoded = base64.b64decode(content_string)
+        user_id = int(current_user.id)
+        df, has_more, next_cursor = load_sales_page(
+            user_id, page_current, page_size, sort_by, filter_query,
+            cursor=cursors['pages'].get(str(page_current))
+        )
+        if next_cursor:
+            cursors['pages'][str(page_current + 1)] = next_cursor
 
-        try:
-            if 'xls' in filename: df = pd.read_excel(io.BytesIO(decoded))
-            else: return dbc.Alert("Formato incorrecto. Usa .xlsx", color="danger"), dash.no_update
-        except Exception as e: return dbc.Alert(f"Error leyendo archivo: {e}", color="danger"), dash.no_update
+        if not df.empty:
+            df['sale_date_display'] = df['sale_date'].dt.strftime('%Y-%m-%d %H:%M')
+            df['editar'] = "✏️"
+            df['eliminar'] = "🗑️"
+            df['id'] = df['sale_id']
+            df = df.drop(columns=['sale_date'])
 
-        df.columns = [c.lower().strip() for c in df.columns]
-        required_columns = ['categoria', 'nombre', 'cantidad', 'fecha']
-        missing = [col for col in required_columns if col not in df.columns]
-        
-        if missing:
-            return dbc.Alert(f"Faltan columnas: {', '.join(missing)}.", color="danger"), dash.no_update
-        
-        products_db = load_products(user_id)
-        cats_db = load_categories(user_id)
-        if products_db.empty: return dbc.Alert("No hay productos registrados.", color="warning"), dash.no_update
+        # Sin COUNT(*): se habilita la página siguiente solo si existe
+        page_count = page_current + (2 if has_more else 1)
+        return df.to_dict('records'), page_count, page_current, cursors
 
-        merged_db = pd.merge(products_db, cats_db, on='category_id', how='left')
-        merged_db['cat_clean'] = merged_db['name_y'].fillna('').str.strip().str.lower()
-        merged_db['prod_clean'] = merged_db['name_x'].str.strip().str.lower()
-        
-        product_map = {}
-        prices_lookup = products_db.set_index('product_id')['price'].to_dict()
-        costs_lookup = products_db.set_index('product_id')['cost'].to_dict()
-        stock_lookup = products_db.set_index('product_id')['stock'].to_dict()
-
-        for _, row in merged_db.iterrows():
-            key = (row['cat_clean'], row['prod_clean'])
-            product_map[key] = row['product_id']
-
-        sales_to_insert = []
-        stock_updates_needed = {} 
-        errors = []
-
-        for index, row in df.iterrows():
-            cat_in = str(row['categoria']).strip().lower()
-            prod_in = str(row['nombre']).strip().lower()
-            key = (cat_in, prod_in)
-
-            if key not in product_map:
-                errors.append(f"Fila {index+2}: Producto '{row['nombre']}' en categoría '{row['categoria']}' no existe.")
-                continue
-
-            product_id = product_map[key]
-
-            try:
-                quantity = int(row['cantidad'])
-                if quantity <= 0: raise ValueError
-                sale_date_dt = pd.to_datetime(row['fecha']).to_pydatetime()
-            except:
-                errors.append(f"Fila {index+2}: Cantidad o fecha inválidos.")
-                continue
-
-            if update_stock_enabled:
-                current_stock = stock_updates_needed.get(product_id, stock_lookup.get(product_id, 0))
-                if quantity > current_stock:
-                    errors.append(f"Fila {index+2}: Stock insuficiente para '{row['nombre']}'. Stock: {current_stock}, Pedido: {quantity}")
-                    continue
-                stock_updates_needed[product_id] = current_stock - quantity
-
-            total_amount = prices_lookup.get(product_id, 0) * quantity
-            cogs_total = costs_lookup.get(product_id, 0) * quantity
-
-            sales_to_insert.append({
-                'product_id': product_id, 'quantity': quantity,
-                'total_amount': total_amount, 'cogs_total': cogs_total,
-                'sale_date': sale_date_dt, 'user_id': user_id
-            })
-
-        if errors:
-            return dbc.Alert([html.H5("Errores encontrados:")] + [html.P(e) for e in errors[:10]], color="danger"), dash.no_update
-
-        if sales_to_insert:
-            pd.DataFrame(sales_to_insert).to_sql('sales', engine, if_exists='append', index=False)
-            
-            alert_msg = f"¡Éxito! {len(sales_to_insert)} ventas importadas."
-            if update_stock_enabled and stock_updates_needed:
-                for pid, new_stk in stock_updates_needed.items():
-                    update_stock(pid, new_stk, user_id)
-                alert_msg += " Stock actualizado."
+    # --- 3. IMPORTAR VENTAS (CON VALIDACIÓN DE CATEGORÍA) ---
+    # El navegador envía el archivo a /api/import/sales (ver api.py y assets/uploads.js),
+    # que encola un trabajo en segundo plano; aquí se consulta su progreso con un dcc.Interval.
+    app.clientside_callback(
+        ClientsideFunction(namespace='uploads', function_name='sales'),
+        Output('store-upload-sales-result', 'data'),
+        Output('upload-sales-data', 'contents'),
+        Input('upload-sales-data', 'contents'),
+        [State('upload-sales-data', 'filename'),
+         State('upload-sales-update-stock', 'value')],
+        prevent_initial_call=True
+    )
 
-            return dbc.Alert(alert_msg, color="success"), (signal_data or 0) + 1
+    @app.callback(
+        Output('upload-sales-output', 'children'),
+        Output('upload-sales-progress', 'children'),
+        Output('interval-upload-sales', 'disabled'),
+        Output('store-upload-sales-job', 'data'),
+        signal_output('sales'),
+        [Input('store-upload-sales-result', 'data'),
+         Input('interval-upload-sales', 'n_intervals')],
+        [State('store-upload-sales-job', 'data'),
+         signal_state('sales')],
+        prevent_initial_call=True
+    )
+    def upload_sales_data(result, n_intervals, job_id, signal_data):
+        """Sigue el trabajo en segundo plano (import_jobs) hasta que termina."""
+        if not current_user.is_authenticated: raise PreventUpdate
+        if dash.callback_context.triggered_id == 'store-upload-sales-result':
+            if not result: raise PreventUpdate
+            if not result.get('job_id'): # Rechazado al subir (formato, sesión...)
+                return dbc.Alert(result['message'], color=result['level']), None, True, None, dash.no_update
+            job_id = result['job_id']
+        if not job_id: raise PreventUpdate
+
+        job = get_import_job(job_id, int(current_user.id))
+        if job is None:
+            return None, None, True, None, dash.no_update
+
+        if job['status'] in ('queued', 'running'):
+            label = f"Validadas: {job['rows_validated']} filas · Insertadas: {job['rows_inserted']}"
+            progress = html.Div([
+                dbc.Progress(value=100, striped=True, animated=True, label=label, className="mb-2"),
+                dbc.Button("Cancelar importación", id='cancel-upload-sales', color="secondary", size="sm",
+                           disabled=job['cancel_requested'])
+            ])
+            return None, progress, False, job_id, dash.no_update
+
+        if job['errors']:
+            children = [html.H5(job['message'])] + [html.P(e) for e in job['errors']]
+        else:
+            children = job['message']
+        new_signal = (signal_data or 0) + 1 if job['success'] else dash.no_update
+        return dbc.Alert(children, color=job['level'] or "danger"), None, True, None, new_signal
 
-        return dbc.Alert("No hay datos válidos.", color="warning"), dash.no_update
+    @app.callback(
+        Output('cancel-upload-sales', 'disabled'),
+        Input('cancel-upload-sales', 'n_clicks'),
+        State('store-upload-sales-job', 'data'),
+        prevent_initial_call=True
+    )
+    def cancel_sales_import(n, job_id):
+        if not n or not job_id or not current_user.is_authenticated: raise PreventUpdate
+        request_import_job_cancel(job_id, int(current_user.id))
+        return True
 
     # --- 4. MODALES (EDITAR/ELIMINAR) ---
     @app.callback(
@@ -386,15 +416,16 @@ def register_callbacks(app):
             raise PreventUpdate
             
         sale_id = cell['row_id']; column_id = cell['column_id']
-        user_id = int(current_user.id); sales_df = load_sales(user_id) 
+        user_id = int(current_user.id)
         
-        try: sale_info = sales_df[sales_df['sale_id'] == sale_id].iloc[0]
-        except IndexError: raise PreventUpdate
+        # La tabla solo tiene la página visible: se consulta la venta puntual
+        sale_info = get_sale(sale_id, user_id)
+        if sale_info is None: raise PreventUpdate
 
         if column_id == "editar":
-            product_value = int(sale_info['product_id']) if pd.notna(sale_info['product_id']) else None
-            quantity_value = sale_info['quantity']
-            date_value = sale_info['sale_date'].date() if pd.notna(sale_info['sale_date']) else None
+            product_value = int(sale_info.product_id) if sale_info.product_id is not None else None
+            quantity_value = sale_info.quantity
+            date_value = sale_info.sale_date.date() if sale_info.sale_date is not None else None
             return True, False, sale_id, None, product_value, quantity_value, date_value
 
         elif column_id == "eliminar":
@@ -405,14 +436,14 @@ def register_callbacks(app):
     # --- 5. GUARDAR EDICIÓN (LÓGICA DE STOCK CORREGIDA) ---
     @app.callback(
         Output('sale-edit-modal', 'is_open', allow_duplicate=True),
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('sales'),
         Output('edit-sale-alert', 'children'),
         Input('save-edited-sale-button', 'n_clicks'),
         [State('store-sale-id-to-edit', 'data'),
          State('edit-sale-product', 'value'),
          State('edit-sale-quantity', 'value'),
          State('edit-sale-date', 'date'), 
-         State('store-data-signal', 'data')],
+         signal_state('sales')],
         prevent_initial_call=True
     )
     def save_edited_sale(n, sale_id, new_prod_id, new_qty, date_str, signal):
@@ -432,7 +463,7 @@ def register_callbacks(app):
             with engine.connect() as conn:
                 with conn.begin(): # Inicia Transacción
                     
-                    orig_sale = conn.execute(text("SELECT product_id, quantity FROM sales WHERE sale_id=:sid AND user_id=:uid"), 
+                    orig_sale = conn.execute(text("SELECT product_id, quantity, sale_date FROM sales WHERE sale_id=:sid AND user_id=:uid"), 
                                              {"sid": sale_id, "uid": uid}).fetchone()
                     if not orig_sale:
                         raise Exception("Venta original no encontrada.")
@@ -469,6 +500,9 @@ def register_callbacks(app):
                     }
                     conn.execute(text("UPDATE sales SET product_id=:product_id, quantity=:quantity, total_amount=:total_amount, sale_date=:sale_date, cogs_total=:cogs_total WHERE sale_id=:sale_id AND user_id=:user_id"),
                                  {**new_data, "sale_id": int(sale_id), "user_id": uid})
+                    # Recalcular el día original y el nuevo (si cambió la fecha)
+                    refresh_sales_rollup(conn, uid, [orig_sale.sale_date, dt])
+                    bump_data_version(conn, uid, 'sales', 'products')
             
             return False, (signal or 0)+1, None 
         
@@ -478,9 +512,9 @@ def register_callbacks(app):
     # --- 6. CONFIRMAR ELIMINACIÓN (LÓGICA CORREGIDA) ---
     @app.callback(
         Output('sale-delete-confirm-modal', 'is_open', allow_duplicate=True),
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('sales'),
         Input('confirm-delete-sale-button', 'n_clicks'),
-        [State('store-sale-id-to-delete', 'data'), State('store-data-signal', 'data')],
+        [State('store-sale-id-to-delete', 'data'), signal_state('sales')],
         prevent_initial_call=True
     )
     def confirm_del(n, sid, sig):
@@ -517,11 +551,13 @@ def register_callbacks(app):
     def download(n):
         if not n: raise PreventUpdate
         uid = int(current_user.id)
-        df = load_sales(uid); prods = load_products(uid); cats = load_categories(uid)
+        df = load_sales(uid, columns=['sale_date', 'product_id', 'quantity', 'total_amount'])
+        prods = load_products(uid, columns=['product_id', 'name', 'category_id'])
+        cats = load_categories(uid, columns=['category_id', 'name']).rename(columns={'name': 'cat_name'})
         if not df.empty:
             m = pd.merge(df, prods, on='product_id', how='left')
             m = pd.merge(m, cats, on='category_id', how='left')
-            m = m[['sale_date', 'name_y', 'name_x', 'quantity', 'total_amount']]
+            m = m[['sale_date', 'cat_name', 'name', 'quantity', 'total_amount']]
             m.columns = ['Fecha', 'Categoría', 'Producto', 'Cantidad', 'Total']
             return dcc.send_data_frame(m.to_excel, "ventas.xlsx", index=False)
         return dash.no_update
@@ -529,11 +565,11 @@ def register_callbacks(app):
     # --- 9. BORRADO MASIVO (CON LIMPIEZA) ---
     @app.callback(
         Output('bulk-delete-sales-output', 'children'),
-        Output('store-data-signal', 'data', allow_duplicate=True),
+        signal_output('sales'),
         Output('history-table', 'selected_rows'),
         Output('history-table', 'selected_row_ids'),
         Input('delete-selected-sales-btn', 'n_clicks'),
-        [State('history-table', 'selected_row_ids'), State('store-data-signal', 'data')],
+        [State('history-table', 'selected_row_ids'), signal_state('sales')],
         prevent_initial_call=True
     )
     def bulk_del(n, ids, sig):
@@ -0,0 +1,56 @@
+# signals.py
+# Señales de cambio de datos por dominio. Cada escritura incrementa solo la señal de su
+# dominio y cada callback de refresco escucha únicamente los dominios que realmente lee,
+# así renombrar una categoría de gasto ya no recalcula el dashboard ni recarga usuarios.
+import dash
+from dash import dcc, Input, Output, State
+
+# Dominio -> id del dcc.Store que actúa como contador de cambios.
+SIGNAL_STORES = {
+    'sales': 'store-signal-sales',          # ventas (también mueven stock de productos)
+    'expenses': 'store-signal-expenses',    # gastos, conceptos y categorías de gasto
+    'catalog': 'store-signal-catalog',      # productos, categorías y recetas (descuentan insumos)
+    'materials': 'store-signal-materials',  # materia prima y compras
+    'users': 'store-signal-users',          # administración de usuarios
+}
+
+# Vista (callback de refresco) -> dominios de los que depende.
+SIGNAL_DEPENDENCIES = {
+    'dashboard-kpis': ('sales', 'expenses'),
+    'dashboard-inventory': ('sales', 'catalog', 'materials'),
+    'dashboard-waterfall': ('sales', 'expenses'),
+    'dashboard-revenue-bars': ('sales', 'catalog'),
+    'dashboard-sales-over-time': ('sales',),
+    'dashboard-monthly': ('sales', 'expenses'),
+    'finances-summary': ('sales', 'expenses', 'catalog'),
+    'sales': ('sales', 'catalog'),
+    'expenses': ('expenses',),
+    'products': ('sales', 'catalog', 'materials'),
+    'materials': ('materials', 'catalog'),
+    'admin': ('users',),
+}
+
+
+def signal_stores():
+    """Los dcc.Store de todas las señales, para el layout principal."""
+    return [dcc.Store(id=store_id) for store_id in SIGNAL_STORES.values()]
+
+
+def signal_inputs(view):
+    """Inputs de las señales de las que depende una vista."""
+    return [Input(SIGNAL_STORES[domain], 'data') for domain in SIGNAL_DEPENDENCIES[view]]
+
+
+def signal_output(domain):
+    """Output para incrementar la señal de un dominio desde un callback de escritura."""
+    return Output(SIGNAL_STORES[domain], 'data', allow_duplicate=True)
+
+
+def signal_state(domain):
+    """State con el valor actual de la señal de un dominio."""
+    return State(SIGNAL_STORES[domain], 'data')
+
+
+def is_signal_trigger():
+    """True si el callback en curso lo disparó alguna señal de datos."""
+    return dash.callback_context.triggered_id in SIGNAL_STORES.values()
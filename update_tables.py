@@ -1,7 +1,16 @@
 # update_tables.py
+# Migraciones versionadas del esquema. Cada migración se aplica UNA vez y queda registrada
+# en schema_version: en cada despliegue solo corren las pendientes, en orden.
+# Uso: python update_tables.py                aplica las migraciones pendientes
+#      python update_tables.py --brin         incluye los índices BRIN opcionales de fechas
+#      python update_tables.py --status       muestra versiones aplicadas y pendientes
+#      python update_tables.py --check [uid]  EXPLAIN de las consultas críticas de database.py
+import json
 import os
+import re
+import sys
+from collections import namedtuple
 from sqlalchemy import create_engine, text
-from sqlalchemy.exc import ProgrammingError, InternalError
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
@@ -12,127 +21,286 @@ if not DATABASE_URL:
 
 engine = create_engine(DATABASE_URL)
 
-# --- Definiciones Completas de SQL ---
+# --- Definiciones de migraciones ---
+# statements: sentencias SQL que corren en UNA transacción junto con el registro de la versión.
+# indexes: índices que se crean con CREATE INDEX CONCURRENTLY (sin bloquear escrituras);
+#          no pueden ir dentro de una transacción, así que se crean uno por uno.
+# option: migraciones opcionales (p. ej. 'brin'); si no se piden no se registran y
+#         pueden aplicarse en un despliegue posterior.
+# Todas son idempotentes (IF NOT EXISTS): las bases creadas con la versión anterior de
+# este script, que ya tienen parte del esquema, simplemente las registran.
+Migration = namedtuple('Migration', 'version description statements indexes option', defaults=((), (), None))
+Index = namedtuple('Index', 'name definition unique', defaults=(False,))
 
-add_column_commands = [
-    "ALTER TABLE users ADD COLUMN is_admin BOOLEAN DEFAULT FALSE NOT NULL;",
-    "ALTER TABLE users ADD COLUMN last_block_change TIMESTAMP DEFAULT NULL;",
-    "ALTER TABLE users ADD COLUMN subscription_end_date DATE DEFAULT NULL;",
-    "ALTER TABLE categories ADD COLUMN is_active BOOLEAN DEFAULT TRUE NOT NULL;",
-    "ALTER TABLE expense_categories ADD COLUMN is_active BOOLEAN DEFAULT TRUE NOT NULL;",
-    "ALTER TABLE products ADD COLUMN is_active BOOLEAN DEFAULT TRUE NOT NULL;",
+MIGRATIONS = [
+    Migration(1, "Columnas de administración de usuarios y desactivación lógica", statements=[
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_admin BOOLEAN DEFAULT FALSE NOT NULL",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS last_block_change TIMESTAMP DEFAULT NULL",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS subscription_end_date DATE DEFAULT NULL",
+        "ALTER TABLE categories ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT TRUE NOT NULL",
+        "ALTER TABLE expense_categories ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT TRUE NOT NULL",
+        "ALTER TABLE products ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT TRUE NOT NULL",
+    ]),
+    Migration(2, "Fechas TIMESTAMP y montos NUMERIC(10, 2)", statements=[
+        "ALTER TABLE sales ALTER COLUMN sale_date TYPE TIMESTAMP USING sale_date::timestamp",
+        "ALTER TABLE expenses ALTER COLUMN expense_date TYPE TIMESTAMP USING expense_date::timestamp",
+        "ALTER TABLE products ALTER COLUMN price TYPE NUMERIC(10, 2) USING price::numeric(10, 2)",
+        "ALTER TABLE products ALTER COLUMN cost TYPE NUMERIC(10, 2) USING cost::numeric(10, 2)",
+        "ALTER TABLE sales ALTER COLUMN total_amount TYPE NUMERIC(10, 2) USING total_amount::numeric(10, 2)",
+        "ALTER TABLE sales ALTER COLUMN cogs_total TYPE NUMERIC(10, 2) USING cogs_total::numeric(10, 2)",
+        "ALTER TABLE expenses ALTER COLUMN amount TYPE NUMERIC(10, 2) USING amount::numeric(10, 2)",
+    ]),
+    Migration(3, "Materia prima, recetas y compras", statements=[
+        """CREATE TABLE IF NOT EXISTS raw_materials (
+            material_id SERIAL PRIMARY KEY, name TEXT NOT NULL, unit_measure TEXT NOT NULL,
+            current_stock NUMERIC(10, 3) DEFAULT 0 NOT NULL, average_cost NUMERIC(10, 3) DEFAULT 0 NOT NULL,
+            alert_threshold NUMERIC(10, 3) DEFAULT 0 NOT NULL, user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            is_active BOOLEAN DEFAULT TRUE NOT NULL, UNIQUE(user_id, name)
+        )""",
+        """CREATE TABLE IF NOT EXISTS product_materials (
+            product_material_id SERIAL PRIMARY KEY, product_id INTEGER NOT NULL REFERENCES products(product_id) ON DELETE CASCADE,
+            material_id INTEGER NOT NULL REFERENCES raw_materials(material_id) ON DELETE CASCADE,
+            quantity_used NUMERIC(10, 3) NOT NULL, user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE
+        )""",
+        """CREATE TABLE IF NOT EXISTS material_purchases (
+            purchase_id SERIAL PRIMARY KEY, material_id INTEGER NOT NULL REFERENCES raw_materials(material_id) ON DELETE RESTRICT,
+            quantity_purchased NUMERIC(10, 3) NOT NULL, total_cost NUMERIC(10, 2) NOT NULL,
+            purchase_date TIMESTAMP NOT NULL, supplier TEXT, notes TEXT,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE
+        )""",
+    ]),
+    Migration(4, "ON DELETE SET NULL en claves foráneas de productos, ventas y gastos", statements=[
+        "ALTER TABLE products DROP CONSTRAINT IF EXISTS products_category_id_fkey",
+        "ALTER TABLE products ADD CONSTRAINT products_category_id_fkey FOREIGN KEY (category_id) REFERENCES categories(category_id) ON DELETE SET NULL",
+        "ALTER TABLE sales DROP CONSTRAINT IF EXISTS sales_product_id_fkey",
+        "ALTER TABLE sales ADD CONSTRAINT sales_product_id_fkey FOREIGN KEY (product_id) REFERENCES products(product_id) ON DELETE SET NULL",
+        "ALTER TABLE expenses DROP CONSTRAINT IF EXISTS expenses_expense_category_id_fkey",
+        "ALTER TABLE expenses ADD CONSTRAINT expenses_expense_category_id_fkey FOREIGN KEY (expense_category_id) REFERENCES expense_categories(expense_category_id) ON DELETE SET NULL",
+    ]),
+    Migration(5, "Resúmenes diarios de ventas y gastos", statements=[
+        """CREATE TABLE IF NOT EXISTS sales_daily_rollup (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE, day DATE NOT NULL,
+            product_id INTEGER, qty NUMERIC(14, 3) DEFAULT 0 NOT NULL,
+            revenue NUMERIC(14, 2) DEFAULT 0 NOT NULL, cogs NUMERIC(14, 2) DEFAULT 0 NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_sales_daily_rollup_user_day ON sales_daily_rollup (user_id, day)",
+        """CREATE TABLE IF NOT EXISTS expense_daily_rollup (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE, day DATE NOT NULL,
+            concept_id INTEGER, expense_category_id INTEGER, amount NUMERIC(14, 2) DEFAULT 0 NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_expense_daily_rollup_user_day ON expense_daily_rollup (user_id, day)",
+        # Carga inicial (misma consulta que rebuild_rollups): sin esto los gráficos quedan vacíos.
+        # Se vacían antes por si la base ya tenía resúmenes de la versión anterior de este script.
+        "DELETE FROM sales_daily_rollup",
+        """INSERT INTO sales_daily_rollup (user_id, day, product_id, qty, revenue, cogs)
+           SELECT user_id, sale_date::date, product_id, SUM(quantity), SUM(total_amount), SUM(cogs_total)
+           FROM sales
+           WHERE quantity IS NOT NULL AND total_amount IS NOT NULL AND cogs_total IS NOT NULL
+           GROUP BY user_id, sale_date::date, product_id""",
+        "DELETE FROM expense_daily_rollup",
+        """INSERT INTO expense_daily_rollup (user_id, day, concept_id, expense_category_id, amount)
+           SELECT user_id, expense_date::date, expense_concept_id, expense_category_id, SUM(amount)
+           FROM expenses
+           WHERE amount IS NOT NULL
+           GROUP BY user_id, expense_date::date, expense_concept_id, expense_category_id""",
+    ]),
+    Migration(6, "Versiones de datos por usuario (cachés)", statements=[
+        """CREATE TABLE IF NOT EXISTS tenant_data_version (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+            version BIGINT DEFAULT 0 NOT NULL, sales_version BIGINT DEFAULT 0 NOT NULL,
+            expenses_version BIGINT DEFAULT 0 NOT NULL, products_version BIGINT DEFAULT 0 NOT NULL,
+            materials_version BIGINT DEFAULT 0 NOT NULL, updated_at TIMESTAMP DEFAULT NOW() NOT NULL
+        )""",
+    ]),
+    Migration(7, "Trabajos de importación en segundo plano", statements=[
+        """CREATE TABLE IF NOT EXISTS import_jobs (
+            job_id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            kind TEXT NOT NULL, filename TEXT, status TEXT DEFAULT 'queued' NOT NULL,
+            rows_validated INTEGER DEFAULT 0 NOT NULL, rows_inserted INTEGER DEFAULT 0 NOT NULL,
+            cancel_requested BOOLEAN DEFAULT FALSE NOT NULL, success BOOLEAN, level TEXT, message TEXT, errors TEXT,
+            created_at TIMESTAMP DEFAULT NOW() NOT NULL, updated_at TIMESTAMP DEFAULT NOW() NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_import_jobs_user ON import_jobs (user_id, job_id)",
+    ]),
+    Migration(8, "Claves de idempotencia y tokens del API POS", statements=[
+        "ALTER TABLE sales ADD COLUMN IF NOT EXISTS idempotency_key TEXT",
+        "ALTER TABLE expenses ADD COLUMN IF NOT EXISTS idempotency_key TEXT",
+        "ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS idempotency_key TEXT",
+        """CREATE TABLE IF NOT EXISTS api_tokens (
+            token_hash TEXT PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            name TEXT, created_at TIMESTAMP DEFAULT NOW() NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_api_tokens_user ON api_tokens (user_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_import_jobs_user_idempotency ON import_jobs (user_id, idempotency_key) WHERE idempotency_key IS NOT NULL",
+    ]),
+    # Tablas grandes: sin bloquear ventas/gastos mientras se construyen
+    Migration(9, "Índices únicos de idempotencia en ventas y gastos", indexes=[
+        Index('idx_sales_user_idempotency', "ON sales (user_id, idempotency_key) WHERE idempotency_key IS NOT NULL", unique=True),
+        Index('idx_expenses_user_idempotency', "ON expenses (user_id, idempotency_key) WHERE idempotency_key IS NOT NULL", unique=True),
+    ]),
+    Migration(10, "Índices de los patrones de acceso de los loaders", indexes=[
+        # (user_id, fecha DESC, id DESC): rangos de fechas de load_sales/load_expenses y paginación keyset
+        Index('idx_sales_user_date_id', "ON sales (user_id, sale_date DESC, sale_id DESC)"),
+        Index('idx_expenses_user_date_id', "ON expenses (user_id, expense_date DESC, expense_id DESC)"),
+        Index('idx_product_materials_product_user', "ON product_materials (product_id, user_id)"),
+        # Búsquedas de duplicados por nombre sin distinguir mayúsculas
+        Index('idx_categories_user_lower_name', "ON categories (user_id, lower(name))"),
+        Index('idx_expense_categories_user_lower_name', "ON expense_categories (user_id, lower(name))"),
+        Index('idx_expense_concepts_user_lower_name', "ON expense_concepts (user_id, lower(name))"),
+        Index('idx_raw_materials_user_lower_name', "ON raw_materials (user_id, lower(name))"),
+    ]),
+    # Ventas y gastos se insertan casi siempre en orden de fecha: un BRIN ocupa unas pocas
+    # páginas y acelera los recorridos por fecha de todos los usuarios (rebuild_rollups, reportes globales)
+    Migration(11, "Índices BRIN de fechas (opcional: --brin)", option='brin', indexes=[
+        Index('idx_sales_sale_date_brin', "ON sales USING brin (sale_date)"),
+        Index('idx_expenses_expense_date_brin', "ON expenses USING brin (expense_date)"),
+    ]),
+    Migration(12, "Proceso dueño de cada trabajo de importación", statements=[
+        "ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS worker_id TEXT",
+    ]),
 ]
-alter_type_commands = [
-    "ALTER TABLE sales ALTER COLUMN sale_date TYPE TIMESTAMP USING sale_date::timestamp;",
-    "ALTER TABLE expenses ALTER COLUMN expense_date TYPE TIMESTAMP USING expense_date::timestamp;",
-    "ALTER TABLE products ALTER COLUMN price TYPE NUMERIC(10, 2) USING price::numeric(10, 2);",
-    "ALTER TABLE products ALTER COLUMN cost TYPE NUMERIC(10, 2) USING cost::numeric(10, 2);",
-    "ALTER TABLE sales ALTER COLUMN total_amount TYPE NUMERIC(10, 2) USING total_amount::numeric(10, 2);",
-    "ALTER TABLE sales ALTER COLUMN cogs_total TYPE NUMERIC(10, 2) USING cogs_total::numeric(10, 2);",
-    "ALTER TABLE expenses ALTER COLUMN amount TYPE NUMERIC(10, 2) USING amount::numeric(10, 2);"
-]
-create_new_tables_sql = """
-CREATE TABLE IF NOT EXISTS raw_materials (
-    material_id SERIAL PRIMARY KEY, name TEXT NOT NULL, unit_measure TEXT NOT NULL,
-    current_stock NUMERIC(10, 3) DEFAULT 0 NOT NULL, average_cost NUMERIC(10, 3) DEFAULT 0 NOT NULL,
-    alert_threshold NUMERIC(10, 3) DEFAULT 0 NOT NULL, user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-    is_active BOOLEAN DEFAULT TRUE NOT NULL, UNIQUE(user_id, name)
-);
-CREATE TABLE IF NOT EXISTS product_materials (
-    product_material_id SERIAL PRIMARY KEY, product_id INTEGER NOT NULL REFERENCES products(product_id) ON DELETE CASCADE,
-    material_id INTEGER NOT NULL REFERENCES raw_materials(material_id) ON DELETE CASCADE,
-    quantity_used NUMERIC(10, 3) NOT NULL, user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE
-);
-CREATE TABLE IF NOT EXISTS material_purchases (
-    purchase_id SERIAL PRIMARY KEY, material_id INTEGER NOT NULL REFERENCES raw_materials(material_id) ON DELETE RESTRICT,
-    quantity_purchased NUMERIC(10, 3) NOT NULL, total_cost NUMERIC(10, 2) NOT NULL,
-    purchase_date TIMESTAMP NOT NULL, supplier TEXT, notes TEXT,
-    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE
-);
-"""
-adjust_constraints_sql = """
-DO $$ BEGIN ALTER TABLE products DROP CONSTRAINT IF EXISTS products_category_id_fkey; ALTER TABLE products ADD CONSTRAINT products_category_id_fkey FOREIGN KEY (category_id) REFERENCES categories(category_id) ON DELETE SET NULL; EXCEPTION WHEN duplicate_object THEN RAISE NOTICE 'Constraint products_category_id_fkey already exists or cannot be dropped.'; END $$;
-DO $$ BEGIN ALTER TABLE sales DROP CONSTRAINT IF EXISTS sales_product_id_fkey; ALTER TABLE sales ADD CONSTRAINT sales_product_id_fkey FOREIGN KEY (product_id) REFERENCES products(product_id) ON DELETE SET NULL; EXCEPTION WHEN duplicate_object THEN RAISE NOTICE 'Constraint sales_product_id_fkey already exists or cannot be dropped.'; END $$;
-DO $$ BEGIN ALTER TABLE expenses DROP CONSTRAINT IF EXISTS expenses_expense_category_id_fkey; ALTER TABLE expenses ADD CONSTRAINT expenses_expense_category_id_fkey FOREIGN KEY (expense_category_id) REFERENCES expense_categories(expense_category_id) ON DELETE SET NULL; EXCEPTION WHEN duplicate_object THEN RAISE NOTICE 'Constraint expenses_expense_category_id_fkey already exists or cannot be dropped.'; END $$;
+
+SCHEMA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at TIMESTAMP DEFAULT NOW() NOT NULL
+)
 """
+MIGRATION_LOCK_KEY = 74210501 # pg_advisory_lock: dos despliegues simultáneos no migran a la vez
+
+# Consultas críticas de database.py y el índice que deberían usar (--check)
+HOT_QUERIES = [
+    ("load_sales (rango de fechas)", "idx_sales_user_date_id",
+     "SELECT * FROM sales WHERE user_id = :user_id AND sale_date >= NOW() - INTERVAL '30 days' AND sale_date < NOW()"),
+    ("load_sales_page (keyset)", "idx_sales_user_date_id",
+     "SELECT sale_id FROM sales WHERE user_id = :user_id ORDER BY sale_date DESC, sale_id DESC LIMIT 16"),
+    ("load_expenses (rango de fechas)", "idx_expenses_user_date_id",
+     "SELECT * FROM expenses WHERE user_id = :user_id AND expense_date >= NOW() - INTERVAL '30 days' AND expense_date < NOW()"),
+    ("load_expenses_page (keyset)", "idx_expenses_user_date_id",
+     "SELECT expense_id FROM expenses WHERE user_id = :user_id ORDER BY expense_date DESC, expense_id DESC LIMIT 16"),
+    ("get_linked_material_quantities", "idx_product_materials_product_user",
+     "SELECT material_id, quantity_used FROM product_materials WHERE product_id = 0 AND user_id = :user_id"),
+    ("add_product_category_strict", "idx_categories_user_lower_name",
+     "SELECT category_id FROM categories WHERE user_id = :user_id AND LOWER(name) = LOWER('x')"),
+    ("add_expense_category_strict", "idx_expense_categories_user_lower_name",
+     "SELECT expense_category_id FROM expense_categories WHERE user_id = :user_id AND LOWER(name) = LOWER('x')"),
+    ("add_expense_concept", "idx_expense_concepts_user_lower_name",
+     "SELECT concept_id FROM expense_concepts WHERE user_id = :user_id AND LOWER(name) = LOWER('x')"),
+    ("add_raw_material", "idx_raw_materials_user_lower_name",
+     "SELECT material_id FROM raw_materials WHERE user_id = :user_id AND lower(name) = lower('x')"),
+]
 # --- Fin Definiciones SQL ---
 
-print("Conectando a la base de datos para actualizar la estructura...")
 
-def execute_sql_safely(connection, command, description):
-    """Ejecuta un comando SQL, hace commit en éxito, rollback en error."""
-    print(f"\nIntentando: {description}")
-    print(f"   SQL: {command[:120].strip()}...")
-    trans = None # Inicializar transacción fuera del try
+def applied_versions(connection):
+    return {row.version for row in connection.execute(text("SELECT version FROM schema_version"))}
+
+def _drop_invalid_index(connection, name):
+    """Un CREATE INDEX CONCURRENTLY interrumpido deja un índice inválido que IF NOT EXISTS no repara."""
+    invalid = connection.execute(text("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = :name AND NOT i.indisvalid
+    """), {"name": name}).scalar()
+    if invalid:
+        print(f"   => Aviso: {name} quedó inválido en un intento anterior; se vuelve a crear.")
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+def apply_migration(lock_connection, migration):
+    """Aplica una migración y registra su versión. lock_connection está en AUTOCOMMIT."""
+    for index in migration.indexes:
+        _drop_invalid_index(lock_connection, index.name)
+        unique = "UNIQUE " if index.unique else ""
+        print(f"   SQL: CREATE {unique}INDEX CONCURRENTLY {index.name} {index.definition}")
+        lock_connection.execute(text(f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {index.name} {index.definition}"))
+    with engine.begin() as connection:
+        for statement in migration.statements:
+            print(f"   SQL: {' '.join(statement.split())[:120]}...")
+            connection.execute(text(statement))
+        connection.execute(text("INSERT INTO schema_version (version, description) VALUES (:version, :description)"),
+                           {"version": migration.version, "description": migration.description})
+
+def run_migrations(options=()):
+    """Aplica en orden las migraciones pendientes. Se detiene en la primera que falle."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_connection:
+        lock_connection.execute(text(SCHEMA_VERSION_SQL))
+        lock_connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            done = applied_versions(lock_connection)
+            pending = [m for m in sorted(MIGRATIONS, key=lambda m: m.version) if m.version not in done]
+            if not pending:
+                print("El esquema ya está al día.")
+            for migration in pending:
+                if migration.option and migration.option not in options:
+                    print(f"\n[{migration.version}] {migration.description}: omitida (usa --{migration.option}).")
+                    continue
+                print(f"\n[{migration.version}] {migration.description}")
+                try:
+                    apply_migration(lock_connection, migration)
+                except Exception as e:
+                    print(f"   => ERROR: {e}")
+                    print("!!! Migración detenida. Corrige el error y vuelve a ejecutar el script. !!!")
+                    return False
+                print("   => ¡Aplicada!")
+            return True
+        finally:
+            lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+def show_status():
+    with engine.connect() as connection:
+        connection.execute(text(SCHEMA_VERSION_SQL))
+        rows = {row.version: row for row in connection.execute(text("SELECT version, applied_at FROM schema_version"))}
+    for migration in MIGRATIONS:
+        row = rows.get(migration.version)
+        state = f"aplicada {row.applied_at:%Y-%m-%d %H:%M}" if row else "PENDIENTE"
+        print(f"[{migration.version:>3}] {state:<28} {migration.description}")
+
+def _explain_indexes(connection, sql, params):
+    plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar()
+    plan = plan if isinstance(plan, list) else json.loads(plan) # psycopg2 ya decodifica el json
+    return _plan_indexes(plan[0]['Plan'])
+
+def _plan_indexes(node):
+    """Nombres de índices usados en un plan de EXPLAIN (FORMAT JSON), recorriendo subnodos."""
+    names = {node['Index Name']} if 'Index Name' in node else set()
+    for child in node.get('Plans', []):
+        names |= _plan_indexes(child)
+    return names
+
+def check_hot_queries(user_id=None):
+    """
+    EXPLAIN de las consultas críticas. 'elegido' es el plan real; en tablas chicas el
+    planificador prefiere un Seq Scan y está bien. 'disponible' repite el EXPLAIN con
+    enable_seqscan = off: si aun así no aparece el índice, el índice falta o no sirve.
+    """
+    ok = True
+    with engine.connect() as connection:
+        if user_id is None:
+            user_id = connection.execute(text("SELECT MIN(id) FROM users")).scalar() or 0
+        for label, expected, sql in HOT_QUERIES:
+            params = {"user_id": int(user_id)}
+            chosen = _explain_indexes(connection, sql, params)
+            connection.execute(text("SET LOCAL enable_seqscan = off")) # Hasta el rollback de abajo
+            available = _explain_indexes(connection, sql, params)
+            status = "OK " if expected in available else "FALTA"
+            ok = ok and expected in available
+            print(f"{status} {label:<34} {expected:<40} elegido: {', '.join(sorted(chosen)) or 'Seq Scan'}")
+            connection.rollback()
+    return ok
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
     try:
-        trans = connection.begin()
-        connection.execute(text(command))
-        trans.commit()
-        print(f"   => ¡Éxito!")
-        return True
-    except (ProgrammingError, InternalError) as e:
-        if trans:
-            try: trans.rollback(); print("   => Rollback ejecutado tras error.")
-            except Exception as rb_exc: print(f"   => ERROR durante rollback: {rb_exc}")
-
-        pgcode = getattr(e.orig, 'pgcode', None)
-        pgerror_msg = str(e).lower()
-
-        if pgcode == '42701' or ("column" in pgerror_msg and "already exists" in pgerror_msg):
-            print(f"   => Aviso: La columna ya existe.")
-            return True # Continuar
-        elif pgcode == '42P07' or ("relation" in pgerror_msg and "already exists" in pgerror_msg):
-             print(f"   => Aviso: La tabla/objeto ya existe.")
-             return True # Continuar
-        elif pgcode == '42804' or "already of type" in pgerror_msg:
-             print(f"   => Aviso: La columna ya es del tipo correcto.")
-             return True # Continuar
-        elif pgcode == '42710' or ("constraint" in pgerror_msg and "already exists" in pgerror_msg):
-             print(f"   => Aviso: La restricción ya existe.")
-             return True # Continuar
-        elif "cannot be cast automatically" in pgerror_msg:
-             print(f"   => Aviso: No se pudo convertir automáticamente el tipo. Revisa los datos.")
-             return True
-        elif pgcode == '25P02': # InFailedSqlTransaction
-             print(f"   => ERROR: La transacción falló. El script anterior puede haber dejado la conexión en mal estado. Reintenta el script.")
-             return False # Detener
+        if '--status' in args:
+            show_status()
+        elif '--check' in args:
+            user_ids = [a for a in args if re.fullmatch(r"\d+", a)]
+            sys.exit(0 if check_hot_queries(int(user_ids[0]) if user_ids else None) else 1)
         else:
-            print(f"   => ERROR SQL al ejecutar comando: {e} (Code: {pgcode})")
-            return False # Detener
+            print("Conectando a la base de datos para actualizar la estructura...")
+            options = {a[2:] for a in args if a.startswith('--')}
+            if not run_migrations(options):
+                sys.exit(1)
+            print("\nActualización de estructura de tablas completada.")
     except Exception as e:
-         if trans:
-             try: trans.rollback(); print("   => Rollback ejecutado tras error inesperado.")
-             except Exception as rb_exc: print(f"   => ERROR durante rollback: {rb_exc}")
-         print(f"   => ERROR inesperado: {e}")
-         return False # Detener
-    return True
-
-try:
-    with engine.connect() as connection:
-        print("\n--- Añadiendo columnas faltantes (si aplica) ---")
-        for command in add_column_commands:
-            if not execute_sql_safely(connection, command, "Añadir columna"):
-                 print("!!! Script detenido por error irrecuperable. !!!"); exit()
-
-        print("\n--- Modificando tipos de columna (si aplica) ---")
-        for command in alter_type_commands:
-             if not execute_sql_safely(connection, command, "Cambiar tipo columna"):
-                 print("!!! Script detenido por error irrecuperable. !!!"); exit()
-
-        print("\n--- Creando nuevas tablas (si no existen) ---")
-        for create_cmd in create_new_tables_sql.strip().split(';'):
-            if create_cmd.strip():
-                if not execute_sql_safely(connection, create_cmd.strip() + ';', "Crear tabla"):
-                    print("!!! Script detenido por error irrecuperable. !!!"); exit()
-
-        print("\n--- Ajustando restricciones FK (si aplica) ---")
-        for cmd_block in adjust_constraints_sql.split('END $$;'):
-             if cmd_block.strip():
-                 full_cmd = cmd_block.strip() + ' END $$;'
-                 if not execute_sql_safely(connection, full_cmd, "Ajustar restricciones ON DELETE"):
-                      print("!!! Script detenido por error irrecuperable. !!!"); exit()
-
-except Exception as e:
-    print(f"\nERROR: No se pudo conectar a la base de datos: {e}")
-
-print("\nActualización de estructura de tablas completada (Revisa mensajes por errores).")
\ No newline at end of file
+        print(f"\nERROR: No se pudo conectar a la base de datos: {e}")
+        sys.exit(1)
@@ -1,5 +1,5 @@
 import pandas as pd
-from database import engine, get_all_users, set_user_block_status, reset_user_password, delete_user
+from database import engine, get_all_users, set_user_block_status, reset_user_password, delete_user, create_api_token, revoke_api_tokens
 from auth import set_password
 import os
 import sys
@@ -98,6 +98,18 @@ def delete_user_account():
     else:
         print("La confirmación no coincide. Operación cancelada.")
 
+def manage_api_token():
+    username = input("Ingresa el nombre de usuario para su token de API (POS): ")
+    user_id = find_user_id(username)
+    if not user_id: return
+
+    if input("¿Revocar primero los tokens existentes? (s/n): ").lower() == 's':
+        print(f"{revoke_api_tokens(user_id)} token(s) revocado(s).")
+    if input("¿Crear un token nuevo? (s/n): ").lower() != 's': return
+    name = input("Nombre de la terminal (opcional): ") or None
+    token = create_api_token(user_id, name)
+    print(f"Token de '{username}' (cópialo ahora, no se volverá a mostrar):\n{token}")
+
 def main_menu():
     while True:
         clear_screen()
@@ -107,8 +119,9 @@ def main_menu():
         print("3. Bloquear / Desbloquear un usuario")
         print("4. Resetear contraseña de un usuario")
         print("5. Eliminar un usuario (¡Peligroso!)")
-        print("6. Salir")
-        choice = input("Selecciona una opción (1-6): ")
+        print("6. Tokens de API (POS)")
+        print("7. Salir")
+        choice = input("Selecciona una opción (1-7): ")
         
         clear_screen()
         if choice == '1':
@@ -125,6 +138,9 @@ def main_menu():
             show_users()
             delete_user_account()
         elif choice == '6':
+            show_users()
+            manage_api_token()
+        elif choice == '7':
             print("Saliendo...")
             break
         else: